@@ -38,6 +38,11 @@ class Adapter(metaclass=ABCMeta):
     HARNESS_FILE = pathjoin(dirname(__file__), "harness.html")
     IGNORE_UNSERVED = True  # Only report test cases with served content
     NAME = None  # must be a unique string
+    # generate() can be called (on a background thread) while the previous test
+    # case is running. It is passed a copy of the server map that is used once
+    # the test case is served. Only set this if generate() does not depend on the
+    # results of the previous test case.
+    PIPELINED = False
     RELAUNCH = 0  # maximum iterations between Target relaunches (<1 use default)
     TEST_DURATION = 30  # maximum execution time per test (used as minimum timeout)
 
@@ -4,10 +4,13 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from os import environ
 from os.path import isfile
 
 from sapphire.server_map import ServerMap
+from .runner import Runner
 from .storage import TestCase, TestFile
 from ..target import sanitizer_opts
 
@@ -25,13 +28,18 @@ class IOManager:
         "MOZ_CHAOSMODE",
         "XPCOM_DEBUG_BREAK")
 
-    def __init__(self, report_size=1):
+    def __init__(self, report_size=1, look_ahead=1):
         assert report_size > 0
+        assert look_ahead > 0
         self.harness = None
         self.server_map = ServerMap()  # manage redirects, include directories and dynamic responses
         self.tests = deque()
+        # (TestCase, ServerMap, Future) of test cases generated in the background
+        self._ahead = deque()
         self._environ_files = list()  # collection of files that should be added to the testcase
+        self._executor = None  # used to generate test cases in the background
         self._generated = 0  # number of test cases generated
+        self._look_ahead = look_ahead  # number of test cases to generate in the background
         self._report_size = report_size
         # used to record environment variable that directly impact the browser
         self._tracked_env = self.tracked_environ()
@@ -43,6 +51,26 @@ class IOManager:
     def __exit__(self, *exc):
         self.cleanup()
 
+    def _activate(self, test):
+        # update the server map to serve test and add it to the testcase cache
+        # reset redirect map
+        self.server_map.redirect.clear()
+        self.server_map.set_redirect("grz_current_test", test.landing_page, required=False)
+        self.server_map.set_redirect("grz_next_test", test.redirect_page)
+        if self.harness is not None:
+            self.server_map.set_dynamic_response(
+                "grz_harness",
+                lambda: self.harness,
+                mime_type="text/html")
+            self.server_map.set_dynamic_response(
+                "grz_control",
+                partial(Runner.control_response, self.server_map),
+                mime_type="application/json")
+        self.tests.append(test)
+        # manage testcase cache size
+        if len(self.tests) > self._report_size:
+            self.tests.popleft().cleanup()
+
     def _add_suppressions(self):
         # Add suppression files to environment files
         for env_var in (x for x in environ if "SAN_OPTIONS" in x):
@@ -54,12 +82,17 @@ class IOManager:
                 fname = "%s.supp" % (env_var.split("_")[0].lower(),)
                 self._environ_files.append(TestFile.from_file(supp_file, fname))
 
-    def cleanup(self):
-        for e_file in self._environ_files:
-            e_file.close()
-        self.purge_tests()
+    def _copy_server_map(self):
+        # test cases generated in the background use a copy of the server map
+        # that is swapped in when the test case is activated (see next_testcase())
+        server_map = ServerMap()
+        server_map.dynamic.update(self.server_map.dynamic)
+        server_map.include.update(self.server_map.include)
+        server_map.redirect.update(self.server_map.redirect)
+        server_map.upload.update(self.server_map.upload)
+        return server_map
 
-    def create_testcase(self, adapter_name):
+    def _new_testcase(self, adapter_name):
         # create testcase object and landing page names
         test = TestCase(
             self.page_name(),
@@ -71,20 +104,66 @@ class IOManager:
         # add environment files to the test case
         for e_file in self._environ_files:
             test.add_meta(e_file.clone())
-        # reset redirect map
-        self.server_map.redirect.clear()
-        self.server_map.set_redirect("grz_current_test", self.page_name(), required=False)
-        self.server_map.set_redirect("grz_next_test", self.page_name(offset=1))
-        if self.harness is not None:
-            self.server_map.set_dynamic_response(
-                "grz_harness",
-                lambda: self.harness,
-                mime_type="text/html")
         self._generated += 1
-        self.tests.append(test)
-        # manage testcase cache size
-        if len(self.tests) > self._report_size:
-            self.tests.popleft().cleanup()
+        return test
+
+    def _schedule(self, adapter_name, generate):
+        # populate a test case in the background
+        test = self._new_testcase(adapter_name)
+        server_map = self._copy_server_map()
+        self._ahead.append((test, server_map, self._executor.submit(generate, test, server_map)))
+
+    def cleanup(self):
+        # wait for test cases that are being generated in the background
+        while self._ahead:
+            test, _, job = self._ahead.popleft()
+            job.exception()
+            test.cleanup()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        for e_file in self._environ_files:
+            e_file.close()
+        self.purge_tests()
+
+    def create_testcase(self, adapter_name):
+        test = self._new_testcase(adapter_name)
+        self._activate(test)
+        return test
+
+    def next_testcase(self, adapter_name, generate, look_ahead=True):
+        """Get the next test case from the look-ahead buffer. Test cases are
+        populated in order by calling generate() on a background thread. Each
+        test case is populated using its own copy of the server map, which
+        replaces server_map when the test case is returned. When a test case is
+        returned the following test case(s) are populated while it is running.
+
+        Args:
+            adapter_name (str): Name of the Adapter used to create test cases.
+            generate (callable): Populates the TestCase and ServerMap it is passed.
+            look_ahead (bool): Populate the following test case(s). This should
+                               be False if no further test cases are needed.
+
+        Returns:
+            TestCase: The next test case, ready to be served.
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1)
+        if not self._ahead:
+            self._schedule(adapter_name, generate)
+        test, server_map, job = self._ahead.popleft()
+        try:
+            # wait for the test case to be populated
+            job.result()
+        except Exception:
+            test.cleanup()
+            raise
+        self.server_map = server_map
+        self._activate(test)
+        if look_ahead:
+            # populate the following test case(s) while test is running
+            while len(self._ahead) < self._look_ahead:
+                self._schedule(adapter_name, generate)
         return test
 
     def page_name(self, offset=0):
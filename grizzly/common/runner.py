@@ -2,14 +2,14 @@
 # This Source Code Form is subject to the terms of the Mozilla Public
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
+from itertools import chain
+from json import dumps
 from logging import getLogger
-from shutil import rmtree
-from tempfile import mkdtemp
+from threading import Event, Lock, Thread
 from time import sleep, time
 
-from sapphire import SERVED_TIMEOUT
+from sapphire import SERVED_TIMEOUT, ServeStats
 from ..target import TargetLaunchError, TargetLaunchTimeout
-from .utils import grz_tmp
 
 __all__ = ("Runner", "RunResult")
 __author__ = "Tyson Smith"
@@ -73,7 +73,34 @@ class _IdleChecker:
             self._next_poll = now + self._poll_delay
 
 
+# _TestCaseProvider supplies the content of a TestCase to Sapphire from storage.
+# This avoids writing each test case to the filesystem before it is served.
+class _TestCaseProvider:
+    __slots__ = ("_files", "_lock", "_testcase")
+
+    def __init__(self, testcase):
+        self._files = dict()
+        # files are looked up by multiple worker threads
+        self._lock = Lock()
+        self._testcase = testcase
+
+    def open(self, url):
+        with self._lock:
+            t_file = self._files[url]
+        # TestFile data is streamed, it is not loaded into memory
+        return t_file.open(), t_file.size
+
+    def files(self):
+        with self._lock:
+            self._files.clear()
+            for file_name in chain(self._testcase.required, self._testcase.optional):
+                self._files[file_name] = self._testcase.get_file(file_name)
+            return tuple(self._files)
+
+
 class Runner:
+    WATCH_DELAY = 0.1  # maximum time the target watcher blocks in TargetMonitor.wait()
+
     __slots__ = (
         "_close_delay",
         "_idle",
@@ -142,6 +169,22 @@ class Runner:
             break
         self._tests_run = 0
 
+    @staticmethod
+    def control_response(server_map):
+        """Dynamic response used by the harness to look up the location of the
+        next test before the current test is complete. This allows the harness
+        to open the next test directly instead of following the redirect.
+
+        Args:
+            server_map (sapphire.ServerMap): ServerMap used to serve the test.
+
+        Returns:
+            bytes: JSON encoded data.
+        """
+        resource = server_map.redirect.get("grz_next_test")
+        next_test = None if resource is None else "/%s" % (resource.target.lstrip("/"),)
+        return dumps({"next": next_test}).encode("ascii")
+
     @staticmethod
     def location(srv_path, srv_port, close_after=None, timeout=None):
         """Build a valid URL to pass to a browser.
@@ -197,28 +240,29 @@ class Runner:
             # overwrite instead of replace 'grz_next_test' for consistency
             server_map.set_redirect("grz_next_test", "grz_empty", required=True)
             server_map.set_dynamic_response("grz_empty", lambda: b"", required=True)
+        # serve the test case
+        # test case content is served from memory unless test_path is given
+        serve_stats = ServeStats()
+        serve_start = time()
+        serving = Event()
+        serving.set()
+        Thread(target=self._watch_target, args=(serving,), daemon=True).start()
         try:
-            # unpack test case
-            if test_path is None:
-                wwwdir = mkdtemp(prefix="test_", dir=grz_tmp("serve"))
-                testcase.dump(wwwdir)
-            else:
-                wwwdir = test_path
-            # serve the test case
-            serve_start = time()
             server_status, served = self._server.serve_path(
-                wwwdir,
+                test_path,
                 continue_cb=self._keep_waiting,
                 forever=wait_for_callback,
                 optional_files=tuple(testcase.optional),
+                provider=_TestCaseProvider(testcase) if test_path is None else None,
                 server_map=server_map,
+                stats=serve_stats,
             )
-            duration = time() - serve_start
         finally:
-            # remove temporary files
-            if test_path is None:
-                rmtree(wwwdir)
+            # the watcher exits within WATCH_DELAY (it is not joined to avoid the delay)
+            serving.clear()
+        duration = time() - serve_start
         result = RunResult(served, duration, timeout=server_status == SERVED_TIMEOUT)
+        result.serve_stats = serve_stats
         result.attempted = testcase.landing_page in result.served
         result.initial = self._tests_run == 0
         # TODO: fix calling TestCase.add_batch() for multi-test replay
@@ -283,6 +327,24 @@ class Runner:
             return False
         return self._target.monitor.is_healthy()
 
+    def _watch_target(self, serving):
+        """Wake the server (see Sapphire.wake()) as soon as the target exits
+        while a test case is being served. Otherwise this is only detected the
+        next time the server calls _keep_waiting().
+
+        Args:
+            serving (threading.Event): Cleared once serving is complete.
+
+        Returns:
+            None
+        """
+        while serving.is_set():
+            if self._target.monitor.wait(self.WATCH_DELAY):
+                if serving.is_set():
+                    LOG.debug("target exited, waking server")
+                    self._server.wake()
+                break
+
 
 class RunResult:
     """A RunResult holds result details from a call to Runner.run().
@@ -291,6 +353,7 @@ class RunResult:
         attempted (bool): Test landing page (entry point) was requested.
         duration (float): Time spent waiting for test contents to be served.
         initial (bool): Target was (re)launched prior to run attempt.
+        serve_stats (sapphire.ServeStats): Timings of the requests that were handled.
         served (tuple(str)): Files that were served.
         status (int): Result status of test.
         timeout (bool): A timeout occurred waiting for test to complete.
@@ -299,12 +362,15 @@ class RunResult:
     FAILED = 1
     IGNORED = 2
 
-    __slots__ = ("attempted", "duration", "initial", "served", "status", "timeout")
+    __slots__ = (
+        "attempted", "duration", "initial", "serve_stats", "served", "status", "timeout"
+    )
 
     def __init__(self, served, duration, status=None, timeout=False):
         self.attempted = False
         self.duration = duration
         self.initial = False
+        self.serve_stats = None
         self.served = served
         self.status = status
         self.timeout = timeout
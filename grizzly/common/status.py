@@ -3,6 +3,7 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 """Manage Grizzly status reports."""
+from bisect import bisect_left
 from collections import defaultdict, namedtuple
 from contextlib import contextmanager
 from json import dump, load
@@ -13,6 +14,7 @@ from tempfile import mkstemp
 from time import time
 
 from fasteners.process_lock import InterProcessLock
+from sapphire.stats import Histogram
 
 from .utils import grz_tmp
 
@@ -110,6 +112,30 @@ class Status:
         """
         return max(self.timestamp - self.start_time, 0)
 
+    def histogram(self, name):
+        """Distribution of the durations of a profiling entry. Only entries
+        added using record_histogram() have a distribution.
+
+        Args:
+            name (str): Profiling entry.
+
+        Returns:
+            Histogram: Durations of the entry or None.
+        """
+        entry = self._profiles.get(name)
+        if entry is None or "buckets" not in entry:
+            return None
+        hist = Histogram()
+        if len(entry["buckets"]) != len(hist.buckets):
+            # recorded using different bucket bounds
+            return None
+        hist.buckets = list(entry["buckets"])
+        hist.count = entry["count"]
+        hist.max = entry["max"]
+        hist.min = entry["min"]
+        hist.total = entry["total"]
+        return hist
+
     @classmethod
     def load(cls, data_file):
         """Load status report. Loading a status report from disk will create a
@@ -237,6 +263,8 @@ class Status:
             elif self._profiles[name]["min"] > duration:
                 self._profiles[name]["min"] = duration
             self._profiles[name]["total"] += duration
+            if "buckets" in self._profiles[name]:
+                self._profiles[name]["buckets"][bisect_left(Histogram.BOUNDS, duration)] += 1
         except KeyError:
             if self._enable_profiling:
                 # add profile entry
@@ -247,6 +275,38 @@ class Status:
                     "total": duration,
                 }
 
+    def record_histogram(self, name, histogram):
+        """Used to add aggregated profiling data such as the request timings
+        collected by Sapphire. The bucket counts are kept so the distribution
+        can be reported (see histogram()).
+
+        Args:
+            name (str): Used to group the entries.
+            histogram (sapphire.stats.Histogram): Durations to add.
+
+        Returns:
+            None
+        """
+        if not self._enable_profiling or histogram.count < 1:
+            return
+        entry = self._profiles.get(name)
+        if entry is None:
+            self._profiles[name] = {
+                "buckets": list(histogram.buckets),
+                "count": histogram.count,
+                "max": histogram.max,
+                "min": histogram.min,
+                "total": histogram.total,
+            }
+        else:
+            entry["count"] += histogram.count
+            entry["max"] = max(entry["max"], histogram.max)
+            entry["min"] = min(entry["min"], histogram.min)
+            entry["total"] += histogram.total
+            if "buckets" in entry:
+                for idx, count in enumerate(histogram.buckets):
+                    entry["buckets"][idx] += count
+
     def report(self, force=False, report_freq=REPORT_FREQ):
         """Write status report to disk. Reports are only written periodically.
         It is limited by `report_freq`. The specified number of seconds must
@@ -155,9 +155,23 @@ class StatusReporter:
                     txt.append("%0.3fs" % (round(entry.total, 3),))
                 txt.append(" %0.2f%%" % (round(entry.total / report.duration * 100, 2),))
                 txt.append(" (%0.3f avg," % (round(avg, 3),))
+                hist = report.histogram(entry.name)
+                if hist is not None:
+                    txt.append(" %0.3f p50," % (round(hist.percentile(50), 3),))
+                    txt.append(" %0.3f p99," % (round(hist.percentile(99), 3),))
                 txt.append(" %0.3f max," % (round(entry.max, 3),))
                 txt.append(" %0.3f min)" % (round(entry.min, 3),))
                 txt.append("\n")
+        # merge the distributions of all active reports
+        merged = self._merge_histograms(x for x in self.reports if x.timestamp >= exp)
+        if len(self.reports) > 1 and merged:
+            txt.append("Merged distributions\n")
+            for name, hist in sorted(merged.items()):
+                txt.append(" > %s: %dx" % (name, hist.count))
+                txt.append(" (%0.3f p50," % (round(hist.percentile(50), 3),))
+                txt.append(" %0.3f p99," % (round(hist.percentile(99), 3),))
+                txt.append(" %0.3f max)" % (round(hist.max, 3),))
+                txt.append("\n")
         return "".join(txt)
 
     def _summary(self, runtime=True, sysinfo=False, timestamp=False):
@@ -228,6 +242,28 @@ class StatusReporter:
             msg = "".join((msg, txt))
         return msg
 
+    @staticmethod
+    def _merge_histograms(reports):
+        """Merge the distributions of profiling entries that have the same name.
+
+        Args:
+            reports (iterable): Status reports to merge.
+
+        Returns:
+            dict: Merged Histogram of each profiling entry name.
+        """
+        merged = dict()
+        for report in reports:
+            for entry in report.profile_entries():
+                hist = report.histogram(entry.name)
+                if hist is None:
+                    continue
+                if entry.name in merged:
+                    merged[entry.name].merge(hist)
+                else:
+                    merged[entry.name] = hist
+        return merged
+
     @staticmethod
     def _merge_tracebacks(tracebacks, size_limit):
         """Merge traceback without exceeding size_limit.
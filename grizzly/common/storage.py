@@ -3,17 +3,33 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
-from collections import namedtuple
-from itertools import chain
+from collections import namedtuple, OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from hashlib import sha512
+from functools import partial
+from io import BytesIO
+from itertools import chain, islice
 import json
-from os import listdir, makedirs, SEEK_END, walk
-from os.path import abspath, basename, dirname, isfile, isdir, join as pathjoin, \
-    normpath, relpath
+from os import fstat, listdir, makedirs, SEEK_END, walk
+try:
+    from os import copy_file_range
+except ImportError:  # pragma: no cover
+    # only available on Linux
+    copy_file_range = None
+from os.path import abspath, basename, dirname, exists, isfile, isdir, join as pathjoin, \
+    normpath, relpath, samefile
 from shutil import copyfileobj, rmtree
-from tempfile import mkdtemp, SpooledTemporaryFile
+from tempfile import mkdtemp, SpooledTemporaryFile, TemporaryFile
+from threading import Lock, RLock
 from time import time
+from weakref import ref as ref_to, WeakValueDictionary
 from zipfile import BadZipfile, ZipFile
 from zlib import error as zlib_error
+try:
+    from fcntl import ioctl
+except ImportError:  # pragma: no cover
+    # not available on Windows
+    ioctl = None
 
 from ..target import sanitizer_opts
 from .utils import grz_tmp
@@ -23,6 +39,8 @@ __all__ = ("TestCase", "TestFile", "TestCaseLoadFailure", "TestFileExists")
 __author__ = "Tyson Smith"
 __credits__ = ["Tyson Smith"]
 
+FICLONE = 0x40049409  # ioctl request to reflink a file (linux/fs.h)
+
 
 class TestCaseLoadFailure(Exception):
     """Raised when loading a TestCase fails"""
@@ -33,13 +51,16 @@ class TestFileExists(Exception):
     TestFile with the same name"""
 
 
+MemoryStats = namedtuple("MemoryStats", "hits limit misses spills used")
 TestFileMap = namedtuple("TestFileMap", "meta optional required")
 
 
 class TestCase:
+    LOAD_WORKERS = 8  # maximum number of paths loaded concurrently by load_many()
+
     __slots__ = (
         "adapter_name", "duration", "env_vars", "input_fname", "landing_page",
-        "redirect_page", "timestamp", "_existing_paths", "_files")
+        "redirect_page", "timestamp", "_files")
 
     def __init__(self, landing_page, redirect_page, adapter_name, input_fname=None, timestamp=None):
         self.adapter_name = adapter_name
@@ -49,11 +70,11 @@ class TestCase:
         self.landing_page = landing_page
         self.redirect_page = redirect_page
         self.timestamp = time() if timestamp is None else timestamp
-        self._existing_paths = list()  # file paths in use
+        # file names are unique across all groups, each group maps file name -> TestFile
         self._files = TestFileMap(
-            meta=list(),  # environment files such as prefs.js, etc...
-            optional=list(),
-            required=list())
+            meta=dict(),  # environment files such as prefs.js, etc...
+            optional=dict(),
+            required=dict())
 
     def __enter__(self):
         return self
@@ -65,17 +86,16 @@ class TestCase:
         """Add a test file to test case and perform sanity checks.
 
         Args:
-            target (list): Specific list of files to append target test_file to.
-            test_file (TestFile): TestFile to append.
+            target (dict): Specific group of files to add target test_file to.
+            test_file (TestFile): TestFile to add.
 
         Returns:
             None
         """
         assert isinstance(test_file, TestFile), "only accepts TestFiles"
-        if test_file.file_name in self._existing_paths:
+        if self.contains(test_file.file_name):
             raise TestFileExists("%r exists in test" % (test_file.file_name,))
-        self._existing_paths.append(test_file.file_name)
-        target.append(test_file)
+        target[test_file.file_name] = test_file
 
     def add_batch(self, path, include_files, prefix=None):
         """Iterate over files in include_files and attach the files that are
@@ -158,19 +178,20 @@ class TestCase:
             tfile.close()
             raise
 
-    def add_from_file(self, input_file, file_name=None, required=True):
+    def add_from_file(self, input_file, file_name=None, linked=False, required=True):
         """Create a TestFile from an existing file and add it to the TestCase.
 
         Args:
             input_file (str): Path to existing file to use.
             file_name (str): Name for the TestFile. If file_name is not given
                              the name of the input_file will be used.
+            linked (bool): Use input_file in place of a copy (see TestFile.from_file()).
             required (bool): Indicates whether the TestFile must be served.
 
         Returns:
             None
         """
-        tfile = TestFile.from_file(input_file, file_name=file_name)
+        tfile = TestFile.from_file(input_file, file_name=file_name, linked=linked)
         try:
             self.add_file(tfile, required=required)
         except TestFileExists:
@@ -187,7 +208,7 @@ class TestCase:
             None
         """
         for file_group in self._files:
-            for test_file in file_group:
+            for test_file in file_group.values():
                 test_file.close()
 
     def clone(self):
@@ -203,11 +224,11 @@ class TestCase:
                             self.input_fname, self.timestamp)
         result.duration = self.duration
         result.env_vars.update(self.env_vars)
-        for entry in self._files.meta:
+        for entry in self._files.meta.values():
             result.add_meta(entry.clone())
-        for entry in self._files.optional:
+        for entry in self._files.optional.values():
             result.add_file(entry.clone(), required=False)
-        for entry in self._files.required:
+        for entry in self._files.required.values():
             result.add_file(entry.clone(), required=True)
         return result
 
@@ -220,7 +241,7 @@ class TestCase:
         Returns:
             bool: True if file exists in the TestCase otherwise False.
         """
-        return file_name in self._existing_paths
+        return any(file_name in group for group in self._files)
 
     @property
     def data_size(self):
@@ -233,11 +254,25 @@ class TestCase:
         Returns:
             int: Total size of the test case in byte.
         """
+        # TestFiles can be modified after they are added so the total is not cached
+        # (TestFile.size does not require reading the data)
         total = 0
         for group in self._files:
-            total += sum(x.size for x in group)
+            total += sum(x.size for x in group.values())
         return total
 
+    @property
+    def digests(self):
+        """SHA-512 digests of the data of all the TestFiles (see TestFile.digest).
+
+        Args:
+            None
+
+        Returns:
+            dict: Hex digest of each TestFile keyed by file name.
+        """
+        return {x.file_name: x.digest for group in self._files for x in group.values()}
+
     def dump(self, out_path, include_details=False):
         """Write all the test case data to the filesystem.
 
@@ -249,23 +284,24 @@ class TestCase:
             None
         """
         # save test files to out_path
-        for test_file in chain(self._files.required, self._files.optional):
+        for test_file in chain(self._files.required.values(), self._files.optional.values()):
             test_file.dump(out_path)
         # save test case files and meta data including:
-        # adapter used, input file, environment info and files
+        # adapter used, input file, environment info, file hashes and files
         if include_details:
             assert isinstance(self.env_vars, dict)
             info = {
                 "adapter": self.adapter_name,
                 "duration": self.duration,
                 "env": self.env_vars,
+                "hashes": self.digests,
                 "input": basename(self.input_fname) if self.input_fname else None,
                 "target": self.landing_page,
                 "timestamp": self.timestamp}
             with open(pathjoin(out_path, "test_info.json"), "w") as out_fp:
                 json.dump(info, out_fp, indent=2, sort_keys=True)
             # save meta files
-            for meta_file in self._files.meta:
+            for meta_file in self._files.meta.values():
                 meta_file.dump(out_path)
 
     def get_file(self, file_name):
@@ -277,13 +313,124 @@ class TestCase:
         Returns:
             TestFile: TestFile with matching file name otherwise None.
         """
-        for tfile in chain(self._files.meta, self._files.optional, self._files.required):
-            if tfile.file_name == file_name:
+        for group in self._files:
+            tfile = group.get(file_name)
+            if tfile is not None:
                 return tfile
         return None
 
     @classmethod
-    def load(cls, path, load_prefs, adjacent=False):
+    def _load_archive(cls, path, load_prefs):
+        """Load TestCases from a zip archive without extracting it. Only
+        'test_info.json' is read, the content of TestFiles is read from the
+        archive when it is needed. See load() for supported layouts.
+
+        Args:
+            path (str): Path to zip archive.
+            load_prefs (bool): Load prefs.js file if available.
+
+        Returns:
+            list: TestCases successfully loaded from path.
+        """
+        try:
+            zip_fp = ZipFile(path)
+        except (BadZipfile, zlib_error):
+            raise TestCaseLoadFailure("Testcase archive is corrupted") from None
+        tests = list()
+        unpacked = None
+        try:
+            # index members by directory
+            contents = dict()
+            for info in zip_fp.infolist():
+                if info.is_dir():
+                    continue
+                name = normpath(info.filename.replace("\\", "/")).replace("\\", "/")
+                if name.startswith(("/", "../")):
+                    continue
+                dir_name, _, file_name = name.rpartition("/")
+                contents.setdefault(dir_name, dict())[file_name] = info
+            # same layouts as scan_path()
+            if "test_info.json" in contents.get("", ()):
+                tc_dirs = [""]
+            else:
+                tc_dirs = sorted(
+                    x for x in contents
+                    if "/" not in x and x and "test_info.json" in contents[x])
+            unpacked = mkdtemp(prefix="unpack_", dir=grz_tmp("storage"))
+            for tc_dir in tc_dirs:
+                prefix = "%s/" % (tc_dir,) if tc_dir else ""
+                try:
+                    info = json.loads(zip_fp.read(contents[tc_dir]["test_info.json"]))
+                except (BadZipfile, zlib_error):
+                    raise TestCaseLoadFailure("Testcase archive is corrupted") from None
+                except ValueError:
+                    raise TestCaseLoadFailure("Invalid 'test_info.json'") from None
+                if not isinstance(info, dict) or not isinstance(info.get("target"), str):
+                    raise TestCaseLoadFailure("'test_info.json' has invalid 'target' entry")
+                entry_point = basename(info["target"])
+                if entry_point not in contents[tc_dir]:
+                    raise TestCaseLoadFailure(
+                        "Entry point %r not found in '%s'" % (entry_point, pathjoin(path, tc_dir)))
+                test = cls(None, None, info.get("adapter", None), timestamp=info.get("timestamp", 0))
+                tests.append(test)
+                if load_prefs and "prefs.js" in contents[tc_dir]:
+                    test.add_meta(TestFile.from_archive(
+                        zip_fp, contents[tc_dir]["prefs.js"].filename, file_name="prefs.js"))
+                test.add_file(TestFile.from_archive(
+                    zip_fp, contents[tc_dir][entry_point].filename, file_name=entry_point))
+                test.landing_page = entry_point
+                # only suppression files are extracted (see load_environ())
+                supp_path = mkdtemp(prefix="env_", dir=unpacked)
+                for fname, member in contents[tc_dir].items():
+                    if fname.lower() in ("lsan.supp", "tsan.supp", "ubsan.supp"):
+                        with open(pathjoin(supp_path, fname), "wb") as out_fp:
+                            out_fp.write(zip_fp.read(member))
+                test.load_environ(supp_path, info.get("env", {}))
+                # load all adjacent data from directory
+                for dir_name, files in contents.items():
+                    if dir_name != tc_dir and not dir_name.startswith(prefix):
+                        continue
+                    for fname, member in files.items():
+                        # ignore files that have been previously loaded
+                        if fname in (entry_point, "prefs.js", "test_info.json"):
+                            continue
+                        test.add_file(
+                            TestFile.from_archive(
+                                zip_fp,
+                                member.filename,
+                                file_name="/".join((dir_name[len(prefix):], fname))),
+                            required=False)
+        except BaseException:
+            # release the archive and partially loaded TestCases on any failure
+            for test in tests:
+                test.cleanup()
+            zip_fp.close()
+            raise
+        finally:
+            if unpacked is not None:
+                rmtree(unpacked, ignore_errors=True)
+        tests.sort(key=lambda tc: tc.timestamp)
+        return tests
+
+    @classmethod
+    def _load_path(cls, path, load_prefs, linked=False):
+        """Load TestCases from a directory containing 'test_info.json' or a
+        zip archive.
+
+        Args:
+            path (str): Path to load.
+            load_prefs (bool): Load prefs.js file if available.
+            linked (bool): Use linked TestFiles (see load_single()).
+
+        Returns:
+            list: TestCases loaded from path.
+        """
+        if path.lower().endswith(".zip"):
+            return cls._load_archive(path, load_prefs)
+        return [cls.load_single(path, load_prefs, linked=linked)]
+
+    @classmethod
+    def load(cls, path, load_prefs, adjacent=False, linked=False):
         """Load TestCases from disk.
 
         Args:
@@ -297,36 +444,70 @@ class TestCase:
             adjacent (str): Load adjacent files as part of the test case.
                             This is always the case when loading a directory.
                             WARNING: This should be used with caution!
+            linked (bool): Use linked TestFiles (see load_single()).
 
         Returns:
             list: TestCases successfully loaded from path.
         """
-        # unpack archive if needed
+        # archive content is read on demand
         if path.lower().endswith(".zip"):
-            unpacked = mkdtemp(prefix="unpack_", dir=grz_tmp("storage"))
-            try:
-                with ZipFile(path) as zip_fp:
-                    zip_fp.extractall(path=unpacked)
-            except (BadZipfile, zlib_error):
-                rmtree(unpacked, ignore_errors=True)
-                raise TestCaseLoadFailure("Testcase archive is corrupted") from None
-            path = unpacked
-        else:
-            unpacked = None
+            return cls._load_archive(path, load_prefs)
         # load testcase data from disk
-        try:
-            if isfile(path):
-                tests = [cls.load_single(path, load_prefs, adjacent=adjacent)]
-            elif isdir(path):
-                tests = list()
-                for tc_path in TestCase.scan_path(path):
-                    tests.append(cls.load_single(tc_path, load_prefs))
-                tests.sort(key=lambda tc: tc.timestamp)
-            else:
-                raise TestCaseLoadFailure("Invalid TestCase path")
-        finally:
-            if unpacked is not None:
-                rmtree(unpacked, ignore_errors=True)
+        if isfile(path):
+            tests = [cls.load_single(path, load_prefs, adjacent=adjacent, linked=linked)]
+        elif isdir(path):
+            tests = cls.load_many(sorted(TestCase.scan_path(path)), load_prefs, linked=linked)
+        else:
+            raise TestCaseLoadFailure("Invalid TestCase path")
+        return tests
+
+    @classmethod
+    def load_many(cls, paths, load_prefs, linked=False):
+        """Load TestCases from multiple directories and/or zip archives
+        concurrently. At most LOAD_WORKERS paths are loaded at a time and no
+        more paths are loaded once a failure occurs. TestFile data held in
+        memory is limited by the TestFile memory limit
+        (see TestFile.set_memory_limit()).
+
+        Args:
+            paths (iterable(str)): Directories (containing 'test_info.json')
+                                   and zip archives to load.
+            load_prefs (bool): Load prefs.js file if available.
+            linked (bool): Use linked TestFiles (see load_single()).
+
+        Returns:
+            list: TestCases loaded from paths sorted by timestamp. TestCases with
+                  the same timestamp are in the order of paths.
+        """
+        paths = tuple(paths)
+        if not paths:
+            return list()
+        workers = min(cls.LOAD_WORKERS, len(paths))
+        failure = None
+        loaded = [()] * len(paths)
+        queued = iter(enumerate(paths))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            active = dict()
+            while True:
+                if failure is None:
+                    # limit the number of paths submitted to the number of workers
+                    for idx, path in islice(queued, workers - len(active)):
+                        active[executor.submit(cls._load_path, path, load_prefs, linked)] = idx
+                if not active:
+                    break
+                done, _ = wait(active, return_when=FIRST_COMPLETED)
+                for job in done:
+                    idx = active.pop(job)
+                    if job.exception() is None:
+                        loaded[idx] = job.result()
+                    elif failure is None:
+                        failure = job.exception()
+        tests = list(chain.from_iterable(loaded))
+        if failure is not None:
+            for test in tests:
+                test.cleanup()
+            raise failure
+        tests.sort(key=lambda tc: tc.timestamp)
         return tests
 
     def load_environ(self, path, env_data):
@@ -345,7 +526,7 @@ class TestCase:
                 self.env_vars[opt_key] = ":".join("=".join((k, v)) for k, v in opts.items())
 
     @classmethod
-    def load_single(cls, path, load_prefs, adjacent=False):
+    def load_single(cls, path, load_prefs, adjacent=False, linked=False):
         """Load contents of a TestCase from disk. If `path` is a directory it must
         contain a valid 'test_info.json' file.
 
@@ -355,6 +536,9 @@ class TestCase:
             adjacent (bool): Load adjacent files as part of the TestCase.
                              This is always true when loading a directory.
                              WARNING: This should be used with caution!
+            linked (bool): Use the files in path instead of copies
+                           (see TestFile.from_file()). The files must not be
+                           modified while the TestCase is in use.
 
         Returns:
             TestCase: A TestCase.
@@ -385,8 +569,8 @@ class TestCase:
         # create testcase and add data
         test = cls(None, None, info.get("adapter", None), timestamp=info.get("timestamp", 0))
         if load_prefs and isfile(pathjoin(path, "prefs.js")):
-            test.add_meta(TestFile.from_file(pathjoin(path, "prefs.js")))
-        test.add_from_file(pathjoin(path, entry_point))
+            test.add_meta(TestFile.from_file(pathjoin(path, "prefs.js"), linked=linked))
+        test.add_from_file(pathjoin(path, entry_point), linked=linked)
         test.landing_page = entry_point
         # load environment variables
         if info:
@@ -406,6 +590,7 @@ class TestCase:
                     test.add_from_file(
                         pathjoin(dpath, fname),
                         file_name=location,
+                        linked=linked,
                         required=False)
         return test
 
@@ -419,8 +604,8 @@ class TestCase:
         Yields:
             str: File names of optional files.
         """
-        for test in self._files.optional:
-            yield test.file_name
+        for file_name in self._files.optional:
+            yield file_name
 
     def purge_optional(self, keep):
         """Remove optional files (by name) that are not in keep.
@@ -431,24 +616,28 @@ class TestCase:
         Returns:
             None
         """
-        opt_files = tuple(x.file_name for x in self._files.optional)
-        if not opt_files:
+        if not self._files.optional:
             # nothing to purge
             return
-        # filter required files from opt_files files to keep
-        keep_opt = list()
-        for fname in set(keep):
-            if fname not in (x.file_name for x in self._files.required):
-                keep_opt.append(fname)
+        keep = set(keep)
         # sanity check keep (cannot remove file that does not exist)
-        assert all(fname in opt_files for fname in keep_opt)
+        assert all(x in self._files.optional or x in self._files.required for x in keep)
         # purge
-        to_remove = list()
-        for idx, fname in enumerate(opt_files):
-            if fname not in keep_opt:
-                to_remove.append(idx)
-        for idx in reversed(to_remove):
-            self._files.optional.pop(idx).close()
+        for fname in [x for x in self._files.optional if x not in keep]:
+            self._files.optional.pop(fname).close()
+
+    @property
+    def required(self):
+        """Get file names of required TestFiles.
+
+        Args:
+            None
+
+        Yields:
+            str: File names of required files.
+        """
+        for file_name in self._files.required:
+            yield file_name
 
     @staticmethod
     def scan_path(path):
@@ -470,11 +659,527 @@ class TestCase:
                     yield tc_path
 
 
+def _fast_copy(src_fp, dst_fp):
+    """Copy the content of a file to another file. When supported by the
+    platform and filesystem the data is reflinked or copied by the kernel
+    otherwise it is streamed.
+
+    Args:
+        src_fp (file): Source file object. Must be backed by a file on disk.
+        dst_fp (file): Destination file object. Must be backed by a file on
+                       disk, data is added at the current position.
+
+    Returns:
+        None
+    """
+    src_fp.flush()
+    dst_fp.flush()
+    size = fstat(src_fp.fileno()).st_size
+    offset = 0
+    if ioctl is not None and dst_fp.tell() == 0:
+        try:
+            # replaces the content of dst_fp
+            ioctl(dst_fp.fileno(), FICLONE, src_fp.fileno())
+        except OSError:
+            pass
+        else:
+            offset = size
+    if copy_file_range is not None:
+        try:
+            while offset < size:
+                copied = copy_file_range(
+                    src_fp.fileno(), dst_fp.fileno(), size - offset, offset_src=offset)
+                if copied == 0:
+                    break
+                offset += copied
+        except OSError:
+            pass
+    # update the file position (data may have been added by the kernel)
+    dst_fp.seek(0, SEEK_END)
+    if offset < size:
+        src_fp.seek(offset)
+        copyfileobj(src_fp, dst_fp, TestFile.XFER_BUF)
+
+
+def _in_memory(spool):
+    # SpooledTemporaryFile does not provide a public way to check
+    return not spool._rolled  # pylint: disable=protected-access
+
+
+class _MemoryBudget:
+    """Process wide limit on the amount of TestFile data that is held in
+    memory. This includes the shared data of Blobs (see _Blob) and the private
+    data of TestFiles that have been modified (see TestFile.write()). When the
+    limit is reached the least recently used data is spilled to disk. Data
+    that is read from disk is kept in memory again.
+
+    Attributes:
+        hits (int): Number of reads that were served from memory.
+        limit (int): Maximum amount of data in bytes to keep in memory.
+        misses (int): Number of reads that required disk I/O.
+        spills (int): Number of times data was evicted and spilled to disk.
+        used (int): Amount of data in bytes currently held in memory.
+    """
+
+    __slots__ = ("_lock", "_lru", "hits", "limit", "misses", "spills", "used")
+
+    def __init__(self, limit):
+        # Blobs dropped by the garbage collector are removed via a weakref callback
+        # which can be run by a thread that is already holding the lock
+        self._lock = RLock()
+        # weakref(_Blob or TestFile) -> size (least recently used first)
+        self._lru = OrderedDict()
+        self.hits = 0
+        self.limit = limit
+        self.misses = 0
+        self.spills = 0
+        self.used = 0
+
+    def _evict(self, needed):
+        # the lock must be held by the caller
+        while self._lru and self.used + needed > self.limit:
+            ref, size = self._lru.popitem(last=False)
+            self.used -= size
+            owner = ref()
+            if owner is not None:
+                owner.spill()
+                self.spills += 1
+
+    def _forget(self, ref):
+        with self._lock:
+            size = self._lru.pop(ref, None)
+            if size is not None:
+                self.used -= size
+
+    def admit(self, blob, data):
+        """Keep data of a Blob in memory. Least recently used data is spilled
+        to make room if needed.
+
+        Args:
+            blob (_Blob): Owner of the data.
+            data (bytes): Content of the Blob.
+
+        Returns:
+            bool: True if the data is held in memory otherwise False.
+        """
+        with self._lock:
+            ref = ref_to(blob)
+            if ref in self._lru:
+                self._lru.move_to_end(ref)
+                return True
+            if len(data) > self.limit:
+                return False
+            self._evict(len(data))
+            blob._data = data  # pylint: disable=protected-access
+            self._lru[ref_to(blob, self._forget)] = len(data)
+            self.used += len(data)
+            return True
+
+    def discard(self, owner):
+        """Stop accounting for the data of a Blob or TestFile. The owner must
+        release the data.
+
+        Args:
+            owner (_Blob or TestFile): Owner of the data.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            size = self._lru.pop(ref_to(owner), None)
+            if size is not None:
+                self.used -= size
+
+    def hit(self, blob):
+        """Record a read that was served from memory.
+
+        Args:
+            blob (_Blob): Blob that was read.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self.hits += 1
+            ref = ref_to(blob)
+            if ref in self._lru:
+                self._lru.move_to_end(ref)
+
+    def miss(self, blob, data=None):
+        """Record a read that required disk I/O.
+
+        Args:
+            blob (_Blob): Blob that was read.
+            data (bytes): Content of the Blob to keep in memory (if possible).
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self.misses += 1
+            if data is not None:
+                self.admit(blob, data)
+
+    def reserve(self, owner, size):
+        """Account for data that is about to be added to the private data of a
+        TestFile that is held in memory. Least recently used data is spilled
+        to make room if needed.
+
+        Args:
+            owner (TestFile): Owner of the data.
+            size (int): Amount of data in bytes to add.
+
+        Returns:
+            bool: True if the data can be held in memory otherwise False, in
+                  which case the owner must spill its data.
+        """
+        with self._lock:
+            held = self._lru.pop(ref_to(owner), 0)
+            self.used -= held
+            if held + size > self.limit:
+                return False
+            self._evict(held + size)
+            self._lru[ref_to(owner, self._forget)] = held + size
+            self.used += held + size
+            return True
+
+    def resize(self, limit):
+        """Update the limit. Data is spilled if the new limit is exceeded.
+
+        Args:
+            limit (int): Maximum amount of data in bytes to keep in memory.
+
+        Returns:
+            None
+        """
+        assert limit >= 0
+        with self._lock:
+            self.limit = limit
+            self._evict(0)
+
+    def stats(self):
+        """Get usage statistics.
+
+        Args:
+            None
+
+        Returns:
+            MemoryStats: Current usage statistics.
+        """
+        with self._lock:
+            return MemoryStats(
+                hits=self.hits,
+                limit=self.limit,
+                misses=self.misses,
+                spills=self.spills,
+                used=self.used)
+
+
+class _BlobReader:
+    """Read-only file object used to stream the content of a _Blob that is
+    stored on disk. The file is shared by all readers of the Blob, each read
+    is performed while holding the lock of the Blob.
+    """
+
+    __slots__ = ("_blob", "_pos")
+
+    def __init__(self, blob):
+        self._blob = blob
+        self._pos = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._blob = None
+
+    def read(self, size=-1):
+        if self._blob is None:
+            raise ValueError("I/O operation on closed file")
+        # pylint: disable=protected-access
+        with self._blob._lock:
+            self._blob._fp.seek(self._pos)
+            data = self._blob._fp.read(size)
+        self._pos += len(data)
+        return data
+
+    def seek(self, offset, whence=0):
+        assert whence == 0
+        self._pos = offset
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+
+class _Blob:
+    """Immutable content shared by TestFiles. See _BlobStore. Content is held
+    in memory when permitted by _BUDGET otherwise it is read from disk.
+    Content of linked Blobs is read from the file they are linked to and
+    content of Blobs with a source is read from the source (archive member).
+    """
+
+    __slots__ = (
+        "__weakref__", "_data", "_fp", "_lock", "_source", "key", "path", "refs", "size")
+
+    def __init__(self, key, data_fp, size, path=None, source=None):
+        self._data = None  # managed by _BUDGET
+        self._fp = None  # copy of the content on disk
+        self._lock = Lock()  # the file position is shared by all readers
+        # callable that returns a file object containing the content
+        self._source = source
+        self.key = key
+        self.path = path  # existing file containing the content (must not be modified)
+        self.refs = 0  # managed by _BlobStore
+        self.size = size
+        if data_fp is None:
+            assert path is not None or source is not None
+            if source is None:
+                self._source = partial(open, path, "rb")
+        elif _in_memory(data_fp):
+            data_fp.seek(0)
+            if _BUDGET.admit(self, data_fp.read()):
+                data_fp.close()
+                return
+        if data_fp is not None:
+            # content is read from disk until it is brought into memory by read()
+            data_fp.rollover()
+            self._fp = data_fp
+
+    def close(self):
+        _BUDGET.discard(self)
+        self._data = None
+        self._source = None
+        with self._lock:
+            if self._fp is not None:
+                self._fp.close()
+
+    def copy_to(self, dst_fp):
+        """Write the content of the Blob to a file object.
+
+        Args:
+            dst_fp (file): Destination file object.
+
+        Returns:
+            None
+        """
+        data = self._data
+        if data is not None:
+            _BUDGET.hit(self)
+            dst_fp.write(data)
+            return
+        # content is copied on disk and not brought back into memory
+        _BUDGET.miss(self)
+        if self._fp is None:
+            with self._source() as src_fp:
+                if self.path is None:
+                    copyfileobj(src_fp, dst_fp, TestFile.XFER_BUF)
+                else:
+                    _fast_copy(src_fp, dst_fp)
+        else:
+            with self._lock:
+                _fast_copy(self._fp, dst_fp)
+
+    def open(self):
+        """Open the content of the Blob for reading. Content on disk is streamed
+        and is not brought into memory.
+
+        Args:
+            None
+
+        Returns:
+            file: Binary file object containing the content.
+        """
+        data = self._data
+        if data is not None:
+            _BUDGET.hit(self)
+            return BytesIO(data)
+        _BUDGET.miss(self)
+        if self._fp is None:
+            return self._source()
+        return _BlobReader(self)
+
+    def read(self):
+        """Get the content of the Blob.
+
+        Args:
+            None
+
+        Returns:
+            bytes: Content of the Blob.
+        """
+        data = self._data
+        if data is not None:
+            _BUDGET.hit(self)
+            return data
+        if self._fp is None:
+            with self._source() as src_fp:
+                data = src_fp.read()
+        else:
+            with self._lock:
+                self._fp.seek(0)
+                data = self._fp.read()
+        _BUDGET.miss(self, data)
+        return data
+
+    def spill(self):
+        """Write the content of the Blob to disk (if needed) and release the
+        copy held in memory. This is called by _BUDGET.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        data = self._data
+        if data is None:
+            return
+        with self._lock:
+            if self._fp is None and self._source is None:
+                self._fp = TemporaryFile(dir=grz_tmp("storage"), prefix="testfile_")
+                self._fp.write(data)
+        self._data = None
+
+
+class _BlobStore:
+    """Content-addressed store of TestFile data. Identical content is stored
+    once and shared by all TestFiles that contain it. Blobs are reference
+    counted and closed once the last reference is released. Blobs that are
+    no longer referenced (TestFiles that were not closed) are dropped by the
+    garbage collector.
+    """
+
+    __slots__ = ("_blobs", "_lock")
+
+    def __init__(self):
+        self._blobs = WeakValueDictionary()  # key -> _Blob
+        self._lock = Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._blobs)
+
+    def acquire(self, key):
+        """Add a reference to existing content.
+
+        Args:
+            key (tuple(str, int)): Digest and size of the content.
+
+        Returns:
+            _Blob: Blob with matching content or None if it is not in the store.
+        """
+        with self._lock:
+            blob = self._blobs.get(key)
+            if blob is not None:
+                blob.refs += 1
+            return blob
+
+    def add(self, key, data_fp, path=None):
+        """Add content to the store. The store takes ownership of data_fp, it
+        is closed if the content is already in the store.
+
+        Args:
+            key (tuple(str, int)): Digest and size of the content.
+            data_fp (file): File object containing the content. None if the
+                            Blob is linked to path.
+            path (str): Existing file containing the content. It is used in place
+                        of a copy and must not be modified.
+
+        Returns:
+            _Blob: Blob with a reference held by the caller.
+        """
+        with self._lock:
+            blob = self._blobs.get(key)
+            if blob is None:
+                blob = _Blob(key, data_fp, key[1], path=path)
+                self._blobs[key] = blob
+                data_fp = None
+            blob.refs += 1
+        if data_fp is not None:
+            data_fp.close()
+        return blob
+
+    def add_source(self, size, source):
+        """Add content that is read from source when it is needed. The content
+        is unknown until it is read so it is not shared.
+
+        Args:
+            size (int): Size of the content.
+            source (callable): Returns a file object containing the content.
+
+        Returns:
+            _Blob: Blob with a reference held by the caller.
+        """
+        blob = _Blob(None, None, size, source=source)
+        with self._lock:
+            blob.refs += 1
+        return blob
+
+    def release(self, blob):
+        """Remove a reference to a Blob. The Blob is closed once all references
+        have been released.
+
+        Args:
+            blob (_Blob): Blob to release.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            assert blob.refs > 0
+            blob.refs -= 1
+            if blob.refs > 0:
+                return
+            if self._blobs.get(blob.key) is blob:
+                del self._blobs[blob.key]
+        blob.close()
+
+    def retain(self, blob):
+        """Add a reference to a Blob.
+
+        Args:
+            blob (_Blob): Blob to retain.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            assert blob.refs > 0
+            blob.refs += 1
+
+    @property
+    def size(self):
+        """Total size of the content in the store.
+
+        Args:
+            None
+
+        Returns:
+            int: Size in bytes.
+        """
+        with self._lock:
+            return sum(x.size for x in self._blobs.values())
+
+
+# storage shared by all TestFiles
+_BLOBS = _BlobStore()
+# limit on the amount of TestFile data held in memory: 64MB
+_BUDGET = _MemoryBudget(0x4000000)
+# used when adding data to the blob store from multiple threads (see TestFile.open())
+_STORE_LOCK = Lock()
+
+
 class TestFile:
-    CACHE_LIMIT = 0x80000  # data cache limit per file: 512KB
+    CACHE_LIMIT = 0x80000  # larger files are copied on disk by from_file(): 512KB
     XFER_BUF = 0x10000  # transfer buffer size: 64KB
 
-    __slots__ = ("_file_name", "_fp")
+    # content is stored in _blob (shared and immutable) or _fp (private)
+    # linked TestFiles are read-only and the content is not copied (see from_file())
+    __slots__ = ("__weakref__", "_blob", "_file_name", "_fp", "_linked")
 
     def __init__(self, file_name):
         # This is a naive fix for a larger path issue. This is a simple sanity
@@ -491,12 +1196,11 @@ class TestFile:
                 or ("/" in file_name and not file_name.rsplit("/", 1)[-1]) \
                 or file_name.startswith("../"):
             raise TypeError("file_name is invalid %r" % (file_name,))
+        self._blob = None
         # name including path relative to wwwroot
         self._file_name = normpath(file_name)
-        self._fp = SpooledTemporaryFile(
-            dir=grz_tmp("storage"),
-            max_size=self.CACHE_LIMIT,
-            prefix="testfile_")
+        self._fp = None
+        self._linked = False
 
     def __enter__(self):
         return self
@@ -504,8 +1208,44 @@ class TestFile:
     def __exit__(self, *exc):
         self.close()
 
+    def _reserve(self, size):
+        # private data held in memory is limited by _BUDGET
+        if _in_memory(self._fp) and not _BUDGET.reserve(self, size):
+            self._fp.rollover()
+
+    @staticmethod
+    def _spool():
+        # data is spilled to disk by _BUDGET (no size limit per file)
+        return SpooledTemporaryFile(dir=grz_tmp("storage"), prefix="testfile_")
+
+    def _store(self, key=None):
+        """Move private data to the blob store. Once stored the data is shared
+        and a private copy is made by the next call to write().
+
+        Args:
+            key (tuple(str, int)): Digest and size of the data if known.
+
+        Returns:
+            None
+        """
+        if self._blob is not None:
+            return
+        if self._fp is None:
+            self._fp = self._spool()
+        if key is None:
+            digest = sha512()
+            self._fp.seek(0)
+            for chunk in iter(lambda: self._fp.read(self.XFER_BUF), b""):
+                digest.update(chunk)
+            key = (digest.hexdigest(), self._fp.tell())
+        # the data is accounted for by the Blob
+        _BUDGET.discard(self)
+        self._blob = _BLOBS.add(key, self._fp)
+        self._fp = None
+
     def clone(self):
-        """Make a copy of the TestFile.
+        """Make a copy of the TestFile. Data is shared by the copies until
+        it is modified.
 
         Args:
             None
@@ -513,9 +1253,11 @@ class TestFile:
         Returns:
             TestFile: A copy of the TestFile instance
         """
+        self._store()
         cloned = type(self)(self._file_name)
-        self._fp.seek(0)
-        copyfileobj(self._fp, cloned._fp, self.XFER_BUF)  # pylint: disable=protected-access
+        _BLOBS.retain(self._blob)
+        cloned._blob = self._blob  # pylint: disable=protected-access
+        cloned._linked = self._linked  # pylint: disable=protected-access
         return cloned
 
     def close(self):
@@ -527,7 +1269,12 @@ class TestFile:
         Returns:
             None
         """
-        self._fp.close()
+        if self._blob is not None:
+            _BLOBS.release(self._blob)
+            self._blob = None
+        if self._fp is not None:
+            _BUDGET.discard(self)
+            self._fp.close()
 
     @property
     def data(self):
@@ -539,12 +1286,34 @@ class TestFile:
         Returns:
             bytes: Data from the TestFile
         """
+        if self._blob is not None:
+            return self._blob.read()
+        if self._fp is None:
+            return b""
         pos = self._fp.tell()
         self._fp.seek(0)
         data = self._fp.read()
         self._fp.seek(pos)
         return data
 
+    @property
+    def digest(self):
+        """SHA-512 digest of the data. The digest is calculated when the data is
+        added to the blob store and is shared by all copies of the data.
+
+        Args:
+            None
+
+        Returns:
+            str: Hex digest of the data.
+        """
+        self._store()
+        if self._blob.key is None:
+            # content from an archive is hashed the first time it is needed
+            data = self._blob.read()
+            self._blob.key = (sha512(data).hexdigest(), len(data))
+        return self._blob.key[0]
+
     def dump(self, path):
         """Write TestFile data to the filesystem.
 
@@ -557,14 +1326,45 @@ class TestFile:
         target_path = pathjoin(path, dirname(self._file_name))
         if not isdir(target_path):
             makedirs(target_path)
-        self._fp.seek(0)
-        with open(pathjoin(path, self._file_name), "wb") as dst_fp:
-            copyfileobj(self._fp, dst_fp, self.XFER_BUF)
+        dst_file = pathjoin(path, self._file_name)
+        if self._linked and exists(dst_file) and samefile(dst_file, self._blob.path):
+            # dumping to the linked file
+            return
+        # linked files are copied (reflink when supported) not hard linked
+        # since the output may be modified in place
+        with open(dst_file, "wb") as dst_fp:
+            if self._blob is not None:
+                self._blob.copy_to(dst_fp)
+            elif self._fp is not None:
+                self._fp.seek(0)
+                copyfileobj(self._fp, dst_fp, self.XFER_BUF)
 
     @property
     def file_name(self):
         return self._file_name
 
+    @classmethod
+    def from_archive(cls, archive, member, file_name=None):
+        """Create a TestFile from a member of a zip archive. The member is read
+        from the archive when the data is needed.
+
+        Args:
+            archive (ZipFile): Open archive containing member. It must remain
+                               unmodified while the TestFile is in use.
+            member (str): Name of the member to use.
+            file_name (str): Name for the TestFile. If file_name is not given
+                             the name of the member will be used.
+
+        Returns:
+            TestFile: A TestFile.
+        """
+        info = archive.getinfo(member)
+        # the archive is kept open until all TestFiles using it are closed
+        t_file = cls(basename(member) if file_name is None else file_name)
+        # pylint: disable=protected-access
+        t_file._blob = _BLOBS.add_source(info.file_size, partial(archive.open, info))
+        return t_file
+
     @classmethod
     def from_data(cls, data, file_name, encoding="UTF-8"):
         """Create a TestFile and add it to the test case.
@@ -579,21 +1379,29 @@ class TestFile:
             TestFile: A TestFile.
         """
         t_file = cls(file_name)
-        if data:
-            if isinstance(data, bytes) or not encoding:
+        if data and not isinstance(data, bytes) and encoding:
+            data = data.encode(encoding)
+        key = (sha512(data or b"").hexdigest(), len(data or b""))
+        # use existing data from the blob store when possible
+        t_file._blob = _BLOBS.acquire(key)  # pylint: disable=protected-access
+        if t_file._blob is None:  # pylint: disable=protected-access
+            if data:
                 t_file.write(data)
-            else:
-                t_file.write(data.encode(encoding))
+            t_file._store(key)  # pylint: disable=protected-access
         return t_file
 
     @classmethod
-    def from_file(cls, input_file, file_name=None):
+    def from_file(cls, input_file, file_name=None, linked=False):
         """Create a TestFile from an existing file.
 
         Args:
             input_file (str): Path to existing file to use.
             file_name (str): Name for the TestFile. If file_name is not given
                              the name of the input_file will be used.
+            linked (bool): Create a read-only TestFile that uses input_file in
+                           place of a copy. input_file must not be modified or
+                           removed while the TestFile is in use. dump()
+                           makes a copy (reflink when supported).
 
         Returns:
             TestFile: A TestFile.
@@ -601,10 +1409,88 @@ class TestFile:
         if file_name is None:
             file_name = basename(input_file)
         t_file = cls(file_name)
+        digest = sha512()
         with open(input_file, "rb") as src_fp:
-            copyfileobj(src_fp, t_file._fp, cls.XFER_BUF)  # pylint: disable=protected-access
+            size = fstat(src_fp.fileno()).st_size
+            if linked or size > cls.CACHE_LIMIT:
+                for chunk in iter(lambda: src_fp.read(cls.XFER_BUF), b""):
+                    digest.update(chunk)
+                key = (digest.hexdigest(), src_fp.tell())
+                if linked:
+                    # pylint: disable=protected-access
+                    t_file._blob = _BLOBS.add(key, None, path=abspath(input_file))
+                    t_file._linked = True
+                    return t_file
+                # large files are copied on disk
+                t_file._fp = cls._spool()  # pylint: disable=protected-access
+                t_file._fp.rollover()  # pylint: disable=protected-access
+                _fast_copy(src_fp, t_file._fp)  # pylint: disable=protected-access
+            else:
+                t_file._fp = cls._spool()  # pylint: disable=protected-access
+                t_file._reserve(size)  # pylint: disable=protected-access
+                for chunk in iter(lambda: src_fp.read(cls.XFER_BUF), b""):
+                    digest.update(chunk)
+                    t_file._fp.write(chunk)  # pylint: disable=protected-access
+                key = (digest.hexdigest(), t_file._fp.tell())  # pylint: disable=protected-access
+        t_file._store(key)  # pylint: disable=protected-access
         return t_file
 
+    @property
+    def linked(self):
+        """Check if the TestFile is linked to an existing file (read-only).
+
+        Args:
+            None
+
+        Returns:
+            bool: True if the TestFile is linked otherwise False.
+        """
+        return self._linked
+
+    @staticmethod
+    def memory_stats():
+        """Get statistics of the data held in memory (shared by all TestFiles).
+
+        Args:
+            None
+
+        Returns:
+            MemoryStats: Hits, misses and spills of reads and the current usage.
+        """
+        return _BUDGET.stats()
+
+    def open(self):
+        """Open the data of the TestFile for reading. The data is streamed, it
+        is not loaded into memory. Multiple threads can read the data of a
+        TestFile concurrently (it must not be modified while it is being read).
+
+        Args:
+            None
+
+        Returns:
+            file: Binary file object containing the data.
+        """
+        if self._blob is None:
+            with _STORE_LOCK:
+                # the data is shared by readers once it is in the blob store
+                self._store()
+        return self._blob.open()
+
+    @staticmethod
+    def set_memory_limit(limit):
+        """Set the maximum amount of data held in memory by all TestFiles.
+        Least recently used data is spilled to disk when the limit is exceeded.
+        This includes data that has not been added to the blob store
+        (modified TestFiles).
+
+        Args:
+            limit (int): Maximum size in bytes.
+
+        Returns:
+            None
+        """
+        _BUDGET.resize(limit)
+
     @property
     def size(self):
         """Size of the file in bytes.
@@ -615,12 +1501,28 @@ class TestFile:
         Returns:
             int: Size in bytes.
         """
+        if self._blob is not None:
+            return self._blob.size
+        if self._fp is None:
+            return 0
         pos = self._fp.tell()
         self._fp.seek(0, SEEK_END)
         size = self._fp.tell()
         self._fp.seek(pos)
         return size
 
+    def spill(self):
+        """Write private data held in memory to disk. This is called by _BUDGET.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        if self._fp is not None:
+            self._fp.rollover()
+
     def write(self, data):
         """Add data to the TestFile.
 
@@ -630,4 +1532,19 @@ class TestFile:
         Returns:
             None
         """
+        if self._linked:
+            raise IOError("Cannot write to linked TestFile %r" % (self._file_name,))
+        if self._fp is None:
+            self._fp = self._spool()
+            if self._blob is not None:
+                # copy on write, the blob is shared
+                self._reserve(self._blob.size)
+                self._blob.copy_to(self._fp)
+                if not _in_memory(self._fp):
+                    # copying from disk requires a file on disk
+                    _BUDGET.discard(self)
+                _BLOBS.release(self._blob)
+                self._blob = None
+        self._reserve(len(data))
         self._fp.write(data)
+
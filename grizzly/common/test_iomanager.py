@@ -4,6 +4,8 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 # pylint: disable=protected-access
 
+from pytest import raises
+
 from .iomanager import IOManager
 from .storage import TestFile
 
@@ -62,6 +64,7 @@ def test_iomanager_04():
         assert iom.server_map.redirect["grz_current_test"].target == tcase.landing_page
         assert "grz_next_test" in iom.server_map.redirect
         assert "grz_harness" not in iom.server_map.dynamic
+        assert "grz_control" not in iom.server_map.dynamic
         # with a harness
         iom.harness = b"harness-data"
         tcase = iom.create_testcase("test-adapter")
@@ -72,6 +75,8 @@ def test_iomanager_04():
         assert iom.server_map.redirect["grz_current_test"].target == tcase.landing_page
         assert "grz_next_test" in iom.server_map.redirect
         assert "grz_harness" in iom.server_map.dynamic
+        assert iom.server_map.dynamic["grz_control"].target() == \
+            b'{"next": "/%s"}' % (tcase.redirect_page.encode("ascii"),)
 
 def test_iomanager_05(mocker):
     """test IOManager.tracked_environ()"""
@@ -101,3 +106,48 @@ def test_iomanager_05(mocker):
         values={"ASAN_OPTIONS": "ignored=x"},
         clear=True)
     assert not IOManager.tracked_environ()
+
+def test_iomanager_06():
+    """test IOManager.next_testcase()"""
+    def generate(test, server_map):
+        test.add_from_data("data", test.landing_page)
+        server_map.set_dynamic_response(test.landing_page[:-5], lambda: b"")
+    with IOManager(look_ahead=2) as iom:
+        iom.server_map.set_dynamic_response("setup", lambda: b"")
+        tcase = iom.next_testcase("test-adapter", generate)
+        assert tcase.contains(tcase.landing_page)
+        assert list(iom.tests) == [tcase]
+        # test cases are being generated in the background
+        assert len(iom._ahead) == 2
+        assert iom._generated == 3
+        assert iom.server_map.redirect["grz_current_test"].target == tcase.landing_page
+        assert iom.server_map.redirect["grz_next_test"].target == tcase.redirect_page
+        # test cases are generated using a copy of the server map
+        assert set(iom.server_map.dynamic) == {"setup", tcase.landing_page[:-5]}
+        assert all(x[1] is not iom.server_map for x in iom._ahead)
+        # test cases are returned in order
+        next_tcase = iom.next_testcase("test-adapter", generate, look_ahead=False)
+        assert next_tcase.landing_page == tcase.redirect_page
+        assert next_tcase.contains(next_tcase.landing_page)
+        assert list(iom.tests) == [next_tcase]
+        assert iom.server_map.redirect["grz_current_test"].target == next_tcase.landing_page
+        # the server map used to generate the test case is used to serve it
+        # (changes made by generate() are kept as they are without a look-ahead)
+        assert set(iom.server_map.dynamic) == {
+            "setup", tcase.landing_page[:-5], next_tcase.landing_page[:-5]}
+        # no test cases are generated when look_ahead is False
+        assert len(iom._ahead) == 1
+        assert iom._generated == 3
+    # pending test cases are removed
+    assert not iom._ahead
+    assert iom._executor is None
+
+def test_iomanager_07(mocker):
+    """test IOManager.next_testcase() generate failure"""
+    generate = mocker.Mock(side_effect=RuntimeError("generate failed"))
+    with IOManager() as iom:
+        with raises(RuntimeError, match="generate failed"):
+            iom.next_testcase("test-adapter", generate)
+        assert not iom.tests
+        assert not iom._ahead
+        assert generate.call_count == 1
@@ -4,14 +4,16 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 # pylint: disable=protected-access
 from itertools import count
+from json import loads
 from os.path import join as pathjoin
+from threading import Event, Thread
 
 from pytest import raises
 
 from sapphire import Sapphire, SERVED_ALL, SERVED_NONE, SERVED_REQUEST, SERVED_TIMEOUT, ServerMap
 
 from .reporter import Report
-from .runner import _IdleChecker, Runner, RunResult
+from .runner import _IdleChecker, _TestCaseProvider, Runner, RunResult
 from .storage import TestCase
 from ..target import Target, TargetLaunchError, TargetLaunchTimeout
 
@@ -37,9 +39,13 @@ def test_runner_01(mocker, tmp_path):
     assert result.status is None
     assert result.served == serv_files
     assert not result.timeout
+    assert result.serve_stats is server.serve_path.call_args[1]["stats"]
     assert target.close.call_count == 0
     assert target.dump_coverage.call_count == 0
-    assert testcase.dump.call_count == 1
+    # test case is served from memory
+    assert testcase.dump.call_count == 0
+    assert server.serve_path.call_args[0][0] is None
+    assert server.serve_path.call_args[1]["provider"] is not None
     # some files served
     server.serve_path.return_value = (SERVED_REQUEST, serv_files)
     result = runner.run([], ServerMap(), testcase, coverage=True)
@@ -63,6 +69,8 @@ def test_runner_01(mocker, tmp_path):
     assert result.status is None
     assert target.close.call_count == 0
     assert testcase.dump.call_count == 0
+    assert server.serve_path.call_args[0][0] == str(tc_path)
+    assert server.serve_path.call_args[1]["provider"] is None
     tc_path.is_dir()
 
 def test_runner_02(mocker):
@@ -306,9 +314,73 @@ def test_runner_10(mocker, tmp_path):
         result = runner.run([], smap, tcase)
         assert result.attempted
         assert result.status is None
-        assert "inc_file.bin" in tcase._existing_paths
-        assert pathjoin("nested", "nested_inc.bin") in tcase._existing_paths
-        assert pathjoin("test", "inc_file3.txt") in tcase._existing_paths
+        assert tcase.contains("inc_file.bin")
+        assert tcase.contains(pathjoin("nested", "nested_inc.bin"))
+        assert tcase.contains(pathjoin("test", "inc_file3.txt"))
+
+def test_runner_11():
+    """test Runner.control_response()"""
+    smap = ServerMap()
+    assert loads(Runner.control_response(smap)) == {"next": None}
+    smap.set_redirect("grz_next_test", "test_0001.html")
+    assert loads(Runner.control_response(smap)) == {"next": "/test_0001.html"}
+    # relaunch
+    smap.set_redirect("grz_next_test", "grz_empty")
+    assert loads(Runner.control_response(smap)) == {"next": "/grz_empty"}
+
+def test_runner_12():
+    """test _TestCaseProvider"""
+    with TestCase("a.html", "x", "x") as tcase:
+        tcase.add_from_data("a", "a.html")
+        tcase.add_from_data("b", "nested/b.js", required=False)
+        provider = _TestCaseProvider(tcase)
+        assert set(provider.files()) == {"a.html", "nested/b.js"}
+        for url, data in (("a.html", b"a"), ("nested/b.js", b"b"), ("a.html", b"a")):
+            data_fp, size = provider.open(url)
+            with data_fp:
+                assert data_fp.read() == data
+            assert size == len(data)
+        # missing entry
+        with raises(KeyError):
+            provider.open("missing.html")
+
+def test_runner_13(mocker):
+    """test Runner.run() wakes the server when the target exits"""
+    server = mocker.Mock(spec=Sapphire)
+    woken = Event()
+    server.wake.side_effect = woken.set
+    # serve_path() returns once it is woken (continue_cb is called immediately)
+    server.serve_path.side_effect = lambda *_, **kw: (
+        (SERVED_TIMEOUT, []) if woken.wait(10) and not kw["continue_cb"]() else (SERVED_ALL, []))
+    target = mocker.Mock(spec=Target)
+    target.detect_failure.return_value = target.RESULT_FAILURE
+    target.monitor.is_healthy.return_value = False
+    # target exits while the test case is served
+    target.monitor.wait.side_effect = (False, True)
+    testcase = mocker.Mock(spec=TestCase, landing_page="a.html", optional=[])
+    result = Runner(server, target).run([], ServerMap(), testcase)
+    assert woken.is_set()
+    assert server.wake.call_count == 1
+    assert target.monitor.wait.call_count == 2
+    assert result.status == RunResult.FAILED
+    # the target is not watched once serving is complete
+    server.reset_mock()
+    woken.clear()
+    target.monitor.wait.reset_mock()
+    target.monitor.wait.side_effect = lambda _: woken.wait(10)
+    server.serve_path.side_effect = None
+    server.serve_path.return_value = (SERVED_ALL, ["a.html"])
+    watchers = list()
+    mocker.patch(
+        "grizzly.common.runner.Thread",
+        side_effect=lambda **kw: watchers.append(Thread(**kw)) or watchers[-1])
+    Runner(server, target).run([], ServerMap(), testcase)
+    # target exits after serving is complete
+    woken.set()
+    watchers[0].join(timeout=10)
+    assert not watchers[0].is_alive()
+    assert target.monitor.wait.call_count == 1
+    assert server.wake.call_count == 0
 
 def test_idle_check_01(mocker):
     """test simple _IdleChecker"""
@@ -10,6 +10,8 @@ from os import remove, stat
 from os.path import isfile
 from time import sleep, time
 
+from sapphire.stats import Histogram
+
 from .status import Status
 
 
@@ -264,3 +266,40 @@ def test_status_10(tmp_path):
     assert len(status._profiles) == 3
     assert "no-op" in status._profiles
     assert len(tuple(status.profile_entries())) == 3
+
+def test_status_11(tmp_path):
+    """test Status.record_histogram() and Status.histogram()"""
+    Status.PATH = str(tmp_path)
+    hist = Histogram()
+    hist.add(1.0)
+    hist.add(3.0)
+    # profiling disabled
+    status = Status.start(enable_profiling=False)
+    status.record_histogram("x", hist)
+    assert not status._profiles
+    status.cleanup()
+    # profiling enabled
+    status = Status.start(enable_profiling=True)
+    # empty histogram
+    status.record_histogram("x", Histogram())
+    assert not status._profiles
+    status.record_histogram("x", hist)
+    status.record("x", 0.5)
+    hist = Histogram()
+    hist.add(5.0)
+    status.record_histogram("x", hist)
+    entry = next(status.profile_entries())
+    assert entry.name == "x"
+    assert entry.count == 4
+    assert entry.max == 5.0
+    assert entry.min == 0.5
+    assert entry.total == 9.5
+    # the distribution is available
+    hist = status.histogram("x")
+    assert hist.count == 4
+    assert sum(hist.buckets) == 4
+    assert hist.max == 5.0
+    assert status.histogram("missing") is None
+    status.record("y", 1)
+    assert status.histogram("y") is None
+    status.cleanup()
@@ -10,6 +10,8 @@ import re
 
 import pytest
 
+from sapphire.stats import Histogram
+
 from .status_reporter import main, Status, StatusReporter, TracebackReport
 
 def _fake_sys_info():
@@ -310,6 +312,28 @@ def test_status_reporter_10(tmp_path):
     merged_log = rptr._summary(runtime=True, sysinfo=True, timestamp=True)
     assert len(merged_log) < StatusReporter.SUMMARY_LIMIT
 
+def test_status_reporter_11(tmp_path):
+    """test StatusReporter._specific() with distributions"""
+    Status.PATH = str(tmp_path)
+    for value in (0.5, 2.0):
+        hist = Histogram()
+        hist.add(value)
+        status = Status.start(enable_profiling=True)
+        status.iteration = 1
+        status.record_histogram("serve_total", hist)
+        status.record("generate", value)
+        status.report(force=True)
+    rptr = StatusReporter.load()
+    assert len(rptr.reports) == 2
+    merged = StatusReporter._merge_histograms(rptr.reports)
+    assert tuple(merged) == ("serve_total",)
+    assert merged["serve_total"].count == 2
+    assert merged["serve_total"].max == 2.0
+    output = rptr._specific()
+    assert "p50" in output
+    assert "Merged distributions" in output
+    assert "> serve_total: 2x" in output
+
 def test_traceback_report_01():
     """test simple TracebackReport"""
     tbr = TracebackReport("log.txt", ["0", "1", "2"], prev_lines=["-2", "-1"])
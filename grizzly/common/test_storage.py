@@ -4,6 +4,7 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 # pylint: disable=protected-access
 
+import hashlib
 from itertools import chain
 import json
 import re
@@ -12,7 +13,7 @@ import zipfile
 
 import pytest
 
-from .storage import TestCase, TestFile, TestCaseLoadFailure, TestFileExists
+from .storage import _BLOBS, TestCase, TestFile, TestCaseLoadFailure, TestFileExists
 
 
 def test_testcase_01(tmp_path):
@@ -29,12 +30,12 @@ def test_testcase_01(tmp_path):
         assert tcase.input_fname is None
         assert tcase.timestamp > 0
         assert not tcase.env_vars
-        assert not tcase._existing_paths
         assert not tcase._files.meta
         assert not tcase._files.optional
         assert not tcase._files.required
         assert not tcase.contains("no_file")
         assert not any(tcase.optional)
+        assert not any(tcase.required)
         tcase.dump(str(tmp_path))
         assert not any(tmp_path.glob("*"))
         tcase.dump(str(tmp_path), include_details=True)
@@ -59,6 +60,10 @@ def test_testcase_02(tmp_path):
         opt_files = list(tcase.optional)
         assert os.path.join("nested", "testfile2.bin") in opt_files
         assert len(opt_files) == 1
+        req_files = list(tcase.required)
+        assert "testfile1.bin" in req_files
+        assert "testfile3.bin" in req_files
+        assert len(req_files) == 3
         tcase.dump(str(tmp_path), include_details=True)
         assert (tmp_path / "nested").is_dir()
         test_info = json.loads((tmp_path / "test_info.json").read_text())
@@ -192,11 +197,11 @@ def test_testcase_08(tmp_path):
     # load test case from test_info.json
     with TestCase.load_single(str(src_dir), True) as dst:
         assert dst.landing_page == "target.bin"
-        assert "prefs.js" in (x.file_name for x in dst._files.meta)
-        assert "target.bin" in (x.file_name for x in dst._files.required)
-        assert "optional.bin" in (x.file_name for x in dst._files.optional)
-        assert "x.bin" in (x.file_name for x in dst._files.optional)
-        assert os.path.join("nested", "x.bin") in (x.file_name for x in dst._files.optional)
+        assert "prefs.js" in dst._files.meta
+        assert "target.bin" in dst._files.required
+        assert "optional.bin" in dst._files.optional
+        assert "x.bin" in dst._files.optional
+        assert os.path.join("nested", "x.bin") in dst._files.optional
         assert dst.env_vars["TEST_ENV_VAR"] == "100"
         assert dst.timestamp > 0
 
@@ -215,16 +220,16 @@ def test_testcase_09(tmp_path):
     # load single file test case
     with TestCase.load_single(str(entry_point), False) as tcase:
         assert tcase.landing_page == "target.bin"
-        assert "prefs.js" not in (x.file_name for x in tcase._files.meta)
-        assert "target.bin" in (x.file_name for x in tcase._files.required)
-        assert "optional.bin" not in (x.file_name for x in tcase._files.optional)
+        assert "prefs.js" not in tcase._files.meta
+        assert "target.bin" in tcase._files.required
+        assert "optional.bin" not in tcase._files.optional
         assert tcase.timestamp == 0
     # load full test case
     with TestCase.load_single(str(entry_point), True, adjacent=True) as tcase:
         assert tcase.landing_page == "target.bin"
-        assert "prefs.js" in (x.file_name for x in tcase._files.meta)
-        assert "target.bin" in (x.file_name for x in tcase._files.required)
-        assert "optional.bin" in (x.file_name for x in tcase._files.optional)
+        assert "prefs.js" in tcase._files.meta
+        assert "target.bin" in tcase._files.required
+        assert "optional.bin" in tcase._files.optional
 
 def test_testcase_10(tmp_path):
     """test TestCase.load() - missing file and empty directory"""
@@ -334,23 +339,23 @@ def test_testcase_16(tmp_path):
     with TestCase("a.b", "a.b", "simple") as tcase:
         # missing directory
         tcase.add_batch("/missing/path/", tuple())
-        assert not tcase._existing_paths
+        assert not any(tcase._files)
         # missing file
         with pytest.raises(IOError):
             tcase.add_batch(str(tmp_path), [str(tmp_path / "missing.bin")])
-        assert not tcase._existing_paths
+        assert not any(tcase._files)
         # relative file name
         tcase.add_batch(str(include), ["file.bin"])
-        assert not tcase._existing_paths
+        assert not any(tcase._files)
         # valid list
         tcase.add_batch(str(include), [str(inc_1), str(inc_2), str(tmp_path / "inc_path2" / "extra.bin")])
         assert tcase.contains("file.bin")
         assert tcase.contains(os.path.join("nested", "nested.js"))
-        assert len(tcase._existing_paths) == 2
+        assert sum(len(x) for x in tcase._files) == 2
         # nested url
         tcase.add_batch(str(include), [str(inc_1)], prefix="test")
         assert tcase.contains(os.path.join("test", "file.bin"))
-        assert len(tcase._existing_paths) == 3
+        assert sum(len(x) for x in tcase._files) == 3
         # collision
         with pytest.raises(TestFileExists, match="'file.bin' exists in test"):
             tcase.add_batch(str(include), [str(inc_1)])
@@ -402,12 +407,187 @@ def test_testcase_19():
             assert src.env_vars == {"foo": "bar", "go": "away"}
             assert tgt.env_vars == {"hello": "kitty", "go": "away"}
 
+def test_testcase_20(mocker, tmp_path):
+    """test TestCase.load() - archive content is read on demand"""
+    archive = tmp_path / "testcase.zip"
+    with zipfile.ZipFile(str(archive), mode="w", compression=zipfile.ZIP_DEFLATED) as zfp:
+        zfp.writestr("tc/test_info.json", json.dumps({"target": "a.html", "env": {}, "timestamp": 1}))
+        zfp.writestr("tc/a.html", b"entry")
+        zfp.writestr("tc/prefs.js", b"prefs")
+        zfp.writestr("tc/ubsan.supp", b"supp")
+        zfp.writestr("tc/sub/b.js", b"adjacent")
+    extract = mocker.patch("grizzly.common.storage.ZipFile.extractall", autospec=True)
+    testcases = TestCase.load(str(archive), True)
+    try:
+        assert len(testcases) == 1
+        tcase = testcases[0]
+        assert extract.call_count == 0
+        assert tcase.landing_page == "a.html"
+        assert tcase.timestamp == 1
+        assert set(tcase.required) == {"a.html"}
+        assert set(tcase.optional) == {"sub/b.js", "ubsan.supp"}
+        assert "ubsan.supp" in tcase.env_vars["UBSAN_OPTIONS"]
+        assert tcase.data_size == 22
+        # content is not read until it is needed
+        entry = tcase.get_file("a.html")
+        assert entry._blob._data is None
+        assert entry.data == b"entry"
+        assert tcase.get_file("prefs.js").data == b"prefs"
+        tcase.dump(str(tmp_path / "out"), include_details=True)
+        assert (tmp_path / "out" / "sub" / "b.js").read_bytes() == b"adjacent"
+        # copy on write
+        with tcase.clone() as cloned:
+            cloned.get_file("a.html").write(b"!")
+            assert cloned.get_file("a.html").data == b"entry!"
+        assert entry.data == b"entry"
+    finally:
+        for tcase in testcases:
+            tcase.cleanup()
+    # invalid entry point
+    with zipfile.ZipFile(str(archive), mode="w") as zfp:
+        zfp.writestr("test_info.json", json.dumps({"target": "missing.html"}))
+    with pytest.raises(TestCaseLoadFailure, match="Entry point 'missing.html' not found"):
+        TestCase.load(str(archive), True)
+    # invalid test_info.json
+    with zipfile.ZipFile(str(archive), mode="w") as zfp:
+        zfp.writestr("test_info.json", b"{")
+    with pytest.raises(TestCaseLoadFailure, match="Invalid 'test_info.json'"):
+        TestCase.load(str(archive), True)
+
+def test_testcase_21(mocker, tmp_path):
+    """test TestCase.load_many()"""
+    assert TestCase.load_many([], True) == []
+    paths = list()
+    for idx, timestamp in enumerate((3, 1, 2, 1)):
+        with TestCase("a.html", None, "adpt-%d" % (idx,), timestamp=timestamp) as src:
+            src.add_from_data("test-%d" % (idx,), "a.html")
+            src.dump(str(tmp_path / ("tc-%d" % (idx,))), include_details=True)
+        paths.append(str(tmp_path / ("tc-%d" % (idx,))))
+    # include an archive
+    archive = tmp_path / "tc.zip"
+    with zipfile.ZipFile(str(archive), mode="w") as zfp:
+        zfp.write(os.path.join(paths[0], "test_info.json"), arcname="test_info.json")
+        zfp.write(os.path.join(paths[0], "a.html"), arcname="a.html")
+    paths.append(str(archive))
+    mocker.patch.object(TestCase, "LOAD_WORKERS", 2)
+    testcases = TestCase.load_many(paths, False)
+    try:
+        # sorted by timestamp and then by order of paths
+        assert [x.adapter_name for x in testcases] == ["adpt-1", "adpt-3", "adpt-2", "adpt-0", "adpt-0"]
+        assert testcases[1].get_file("a.html").data == b"test-3"
+        assert testcases[4].get_file("a.html").data == b"test-0"
+    finally:
+        for tcase in testcases:
+            tcase.cleanup()
+    # failure
+    cleanup = mocker.patch.object(TestCase, "cleanup", autospec=True, side_effect=TestCase.cleanup)
+    with pytest.raises(TestCaseLoadFailure, match="Missing or invalid TestCase"):
+        TestCase.load_many(paths + [str(tmp_path / "missing")], False)
+    # loaded TestCases are closed
+    assert cleanup.call_count == 5
+    # no more paths are loaded after a failure
+    mocker.patch.object(TestCase, "LOAD_WORKERS", 1)
+    load_path = mocker.patch.object(
+        TestCase, "_load_path", side_effect=TestCaseLoadFailure("Missing or invalid TestCase"))
+    with pytest.raises(TestCaseLoadFailure, match="Missing or invalid TestCase"):
+        TestCase.load_many(paths, False)
+    assert load_path.call_count == 1
+
+def test_testcase_22(tmp_path):
+    """test TestCase.digests and hashes in test_info.json"""
+    with TestCase("a.html", None, "test-adapter") as src:
+        src.add_from_data("123", "a.html")
+        src.add_from_data("456", "b/c.html", required=False)
+        src.add_meta(TestFile.from_data("pref", "prefs.js"))
+        # modified data is hashed
+        src.get_file("a.html").write(b"4")
+        expected = {
+            "a.html": hashlib.sha512(b"1234").hexdigest(),
+            os.path.join("b", "c.html"): hashlib.sha512(b"456").hexdigest(),
+            "prefs.js": hashlib.sha512(b"pref").hexdigest()}
+        assert src.digests == expected
+        src.dump(str(tmp_path / "out"), include_details=True)
+    info = json.loads((tmp_path / "out" / "test_info.json").read_text())
+    assert info["hashes"] == expected
+    # archive content
+    archive = tmp_path / "tc.zip"
+    with zipfile.ZipFile(str(archive), mode="w") as zfp:
+        zfp.writestr("test_info.json", json.dumps({"target": "a.html"}))
+        zfp.writestr("a.html", b"1234")
+    testcases = TestCase.load(str(archive), False)
+    try:
+        assert testcases[0].digests == {"a.html": expected["a.html"]}
+    finally:
+        for tcase in testcases:
+            tcase.cleanup()
+
+def test_testcase_23(mocker, tmp_path):
+    """test TestCase.load() - archive is released on unexpected failures"""
+    archive = tmp_path / "testcase.zip"
+    with zipfile.ZipFile(str(archive), mode="w") as zfp:
+        for tc_dir in ("tc1", "tc2"):
+            zfp.writestr("%s/test_info.json" % (tc_dir,), json.dumps({"target": "a.html"}))
+            zfp.writestr("%s/a.html" % (tc_dir,), b"entry")
+    (tmp_path / "storage").mkdir()
+    mocker.patch("grizzly.common.storage.grz_tmp", return_value=str(tmp_path / "storage"))
+    cleanup = mocker.patch.object(TestCase, "cleanup", autospec=True, side_effect=TestCase.cleanup)
+    opened = list()
+    mocker.patch(
+        "grizzly.common.storage.ZipFile",
+        side_effect=lambda path: opened.append(zipfile.ZipFile(path)) or opened[-1])
+    # fail loading the second TestCase
+    mocker.patch.object(
+        TestCase, "load_environ", autospec=True, side_effect=(None, OSError("test")))
+    with pytest.raises(OSError, match="test"):
+        TestCase.load(str(archive), False)
+    # partially loaded TestCases are closed
+    assert cleanup.call_count == 2
+    # archive is closed
+    assert len(opened) == 1
+    assert opened[0].fp is None
+    # temporary files are removed
+    assert not any((tmp_path / "storage").iterdir())
+
+def test_testcase_24(tmp_path):
+    """test TestCase.load() - linked TestFiles"""
+    for tc_dir in ("tc1", "tc2"):
+        with TestCase("a.html", None, "test-adapter") as src:
+            src.add_from_data("entry", "a.html")
+            src.add_from_data("extra", "b/c.html", required=False)
+            src.add_meta(TestFile.from_data("pref", "prefs.js"))
+            src.dump(str(tmp_path / "in" / tc_dir), include_details=True)
+    testcases = TestCase.load(str(tmp_path / "in"), True, linked=True)
+    try:
+        assert len(testcases) == 2
+        for tcase in testcases:
+            assert tcase.get_file("a.html").linked
+            assert tcase.get_file("b/c.html").linked
+            assert tcase.get_file("prefs.js").linked
+            assert tcase.get_file("a.html").data == b"entry"
+            tcase.dump(str(tmp_path / "out"), include_details=True)
+            assert (tmp_path / "out" / "b" / "c.html").read_bytes() == b"extra"
+    finally:
+        for tcase in testcases:
+            tcase.cleanup()
+    # input is not removed
+    assert (tmp_path / "in" / "tc1" / "a.html").read_bytes() == b"entry"
+    # copies are used by default
+    testcases = TestCase.load(str(tmp_path / "in" / "tc1"), False)
+    try:
+        assert not testcases[0].get_file("a.html").linked
+    finally:
+        for tcase in testcases:
+            tcase.cleanup()
+
 def test_testfile_01():
     """test simple TestFile"""
     with TestFile("test_file.txt") as tfile:
         assert tfile.file_name == "test_file.txt"
-        assert not tfile._fp.closed
+        assert tfile._fp is None
         assert tfile.size == 0
+        assert tfile.data == b""
+        tfile.write(b"a")
+        assert not tfile._fp.closed
         tfile.close()
         assert tfile._fp.closed
 
@@ -513,3 +693,217 @@ def test_testfile_08(tmp_path):
     in_file.write_bytes(b"foobar")
     with TestFile.from_file(str(in_file), file_name="outfile.txt") as tfile:
         assert tfile.data == b"foobar"
+
+def test_testfile_09(tmp_path):
+    """test TestFile content is shared using the blob store"""
+    in_file = tmp_path / "infile.txt"
+    in_file.write_bytes(b"foobar")
+    blobs = len(_BLOBS)
+    with TestFile.from_file(str(in_file)) as tf1, TestFile.from_data("foobar", "a.txt") as tf2:
+        # identical content is stored once
+        assert tf1._blob is tf2._blob
+        assert tf1._blob.refs == 2
+        assert len(_BLOBS) == blobs + 1
+        tf3 = tf1.clone()
+        assert tf3._blob is tf1._blob
+        assert tf1._blob.refs == 3
+        # copy on write
+        tf3.write(b"123")
+        assert tf3._blob is None
+        assert tf1._blob.refs == 2
+        assert tf3.data == b"foobar123"
+        assert tf3.size == 9
+        assert tf1.data == b"foobar"
+        assert tf1.size == 6
+        # cloning modified content adds it to the store
+        tf4 = tf3.clone()
+        assert tf3._fp is None
+        assert tf4._blob is tf3._blob
+        assert len(_BLOBS) == blobs + 2
+        tf3.close()
+        tf4.dump(str(tmp_path))
+        assert (tmp_path / "infile.txt").read_bytes() == b"foobar123"
+        # blobs are removed once all references are released
+        tf4.close()
+        assert len(_BLOBS) == blobs + 1
+        blob = tf1._blob
+    assert blob.refs == 0
+    assert len(_BLOBS) == blobs
+
+def test_testfile_10(tmp_path):
+    """test TestFile data held in memory is limited"""
+    limit = TestFile.memory_stats().limit
+    # spill data from previous tests
+    TestFile.set_memory_limit(0)
+    TestFile.set_memory_limit(10)
+    try:
+        start = TestFile.memory_stats()
+        with TestFile.from_data(b"aaaaaa", "a.bin") as tf1, \
+                TestFile.from_data(b"bbbbbb", "b.bin") as tf2, \
+                TestFile.from_data(b"c" * 11, "c.bin") as tf3:
+            # least recently used data is spilled to disk
+            assert tf1._blob._data is None
+            assert tf1._blob._fp is not None
+            assert tf2._blob._data is not None
+            # too large to be held in memory
+            assert tf3._blob._data is None
+            stats = TestFile.memory_stats()
+            assert stats.limit == 10
+            assert stats.used == 6
+            assert stats.spills == start.spills + 1
+            # read from memory
+            assert tf2.data == b"bbbbbb"
+            assert TestFile.memory_stats().hits == start.hits + 1
+            # read from disk and kept in memory (tf2 is spilled)
+            assert tf1.data == b"aaaaaa"
+            assert tf1._blob._data is not None
+            assert tf2._blob._data is None
+            stats = TestFile.memory_stats()
+            assert stats.misses == start.misses + 1
+            assert stats.spills == start.spills + 2
+            assert tf2.data == b"bbbbbb"
+            assert tf3.data == b"c" * 11
+            tf3.dump(str(tmp_path))
+            assert (tmp_path / "c.bin").read_bytes() == b"c" * 11
+        assert TestFile.memory_stats().used == 0
+    finally:
+        TestFile.set_memory_limit(limit)
+
+@pytest.mark.parametrize("fast", [True, False])
+def test_testfile_11(mocker, tmp_path, fast):
+    """test TestFile.from_file() and TestFile.dump() with large files"""
+    if not fast:
+        mocker.patch("grizzly.common.storage.copy_file_range", None)
+        mocker.patch("grizzly.common.storage.ioctl", None)
+    data = b"".join(b"%08d" % (x,) for x in range(TestFile.CACHE_LIMIT // 4))
+    in_file = tmp_path / "in.bin"
+    in_file.write_bytes(data)
+    with TestFile.from_file(str(in_file), file_name="a.bin") as tfile:
+        assert tfile.size == len(data)
+        # content is not held in memory
+        assert tfile._blob._data is None
+        tfile.dump(str(tmp_path))
+        assert (tmp_path / "a.bin").read_bytes() == data
+        # copy on write
+        tfile.write(b"123")
+        tfile.dump(str(tmp_path))
+        assert (tmp_path / "a.bin").read_bytes() == data + b"123"
+
+
+def test_testfile_12(tmp_path):
+    """test linked TestFile"""
+    in_file = tmp_path / "in.txt"
+    in_file.write_bytes(b"linked-data")
+    with TestFile.from_file(str(in_file), file_name="a/b.txt", linked=True) as tf1:
+        assert tf1.linked
+        assert tf1._fp is None
+        assert tf1._blob.path == str(in_file)
+        assert tf1.data == b"linked-data"
+        assert tf1.size == 11
+        # a copy is made (not a hard link)
+        (tmp_path / "out" / "a").mkdir(parents=True)
+        (tmp_path / "out" / "a" / "b.txt").write_bytes(b"existing")
+        tf1.dump(str(tmp_path / "out"))
+        assert (tmp_path / "out" / "a" / "b.txt").stat().st_ino != in_file.stat().st_ino
+        assert (tmp_path / "out" / "a" / "b.txt").read_bytes() == b"linked-data"
+        # modifying the output does not modify the linked file
+        with (tmp_path / "out" / "a" / "b.txt").open("r+b") as out_fp:
+            out_fp.write(b"X")
+        assert in_file.read_bytes() == b"linked-data"
+        tf1.dump(str(tmp_path / "out"))
+        assert (tmp_path / "out" / "a" / "b.txt").read_bytes() == b"linked-data"
+        # dump to the linked file
+        with TestFile.from_file(str(in_file), linked=True) as tf2:
+            tf2.dump(str(tmp_path))
+        assert in_file.read_bytes() == b"linked-data"
+        # linked TestFiles are read-only
+        with pytest.raises(IOError, match="Cannot write to linked TestFile"):
+            tf1.write(b"a")
+        with tf1.clone() as tf2:
+            assert tf2.linked
+            assert tf2._blob is tf1._blob
+        # content is shared with other TestFiles
+        with TestFile.from_data(b"linked-data", "c.txt") as tf3:
+            assert not tf3.linked
+            assert tf3._blob is tf1._blob
+            tf3.dump(str(tmp_path / "out"))
+            assert (tmp_path / "out" / "c.txt").stat().st_ino != in_file.stat().st_ino
+            tf3.write(b"!")
+            assert tf3.data == b"linked-data!"
+        assert in_file.read_bytes() == b"linked-data"
+
+def test_testfile_13(tmp_path):
+    """test TestFile.open()"""
+    limit = TestFile.memory_stats().limit
+    in_file = tmp_path / "in.txt"
+    in_file.write_bytes(b"linked-data")
+    try:
+        # held in memory
+        with TestFile.from_data(b"in-memory", "a.txt") as tfile:
+            with tfile.open() as data_fp:
+                assert data_fp.read() == b"in-memory"
+        # linked
+        with TestFile.from_file(str(in_file), linked=True) as tfile:
+            with tfile.open() as data_fp:
+                assert data_fp.read() == b"linked-data"
+        # modified data is added to the blob store
+        with TestFile.from_data(b"abc", "a.txt") as tfile:
+            tfile.write(b"123")
+            assert tfile._blob is None
+            with tfile.open() as data_fp:
+                assert data_fp.read() == b"abc123"
+            assert tfile._blob is not None
+        # spilled to disk
+        TestFile.set_memory_limit(0)
+        with TestFile.from_data(b"on-disk", "a.txt") as tfile:
+            assert tfile._blob._data is None
+            with tfile.open() as data_fp, tfile.open() as other_fp:
+                assert data_fp.read(3) == b"on-"
+                # readers do not share a position
+                assert other_fp.read() == b"on-disk"
+                assert data_fp.read() == b"disk"
+                data_fp.seek(0)
+                assert data_fp.tell() == 0
+                assert data_fp.read() == b"on-disk"
+            # content is not brought into memory
+            assert tfile._blob._data is None
+            with pytest.raises(ValueError, match="closed file"):
+                data_fp.read()
+    finally:
+        TestFile.set_memory_limit(limit)
+
+def test_testfile_14():
+    """test TestFile private data and large data are limited by the memory budget"""
+    limit = TestFile.memory_stats().limit
+    # spill data from previous tests
+    TestFile.set_memory_limit(0)
+    TestFile.set_memory_limit(TestFile.CACHE_LIMIT * 3)
+    try:
+        start = TestFile.memory_stats()
+        # data larger than CACHE_LIMIT is held in memory
+        with TestFile.from_data(b"a" * (TestFile.CACHE_LIMIT * 2), "a.bin") as tf1:
+            assert tf1._blob._data is not None
+            assert TestFile.memory_stats().used == TestFile.CACHE_LIMIT * 2
+            # private data is counted
+            with TestFile("b.bin") as tf2:
+                tf2.write(b"b" * 10)
+                assert TestFile.memory_stats().used == TestFile.CACHE_LIMIT * 2 + 10
+                # least recently used data is spilled to make room
+                tf2.write(b"b" * TestFile.CACHE_LIMIT)
+                assert tf1._blob._data is None
+                assert TestFile.memory_stats().used == TestFile.CACHE_LIMIT + 10
+                # private data is spilled to make room
+                assert tf1.data
+                assert TestFile.memory_stats().used == TestFile.CACHE_LIMIT * 2
+                assert tf2.data == b"b" * (TestFile.CACHE_LIMIT + 10)
+                assert TestFile.memory_stats().spills == start.spills + 2
+                # spilled private data remains on disk
+                tf2.write(b"b" * TestFile.CACHE_LIMIT * 3)
+                assert TestFile.memory_stats().used == TestFile.CACHE_LIMIT * 2
+            # private data is released
+            with TestFile("c.bin") as tf3:
+                tf3.write(b"c")
+            assert TestFile.memory_stats().used == TestFile.CACHE_LIMIT * 2
+        assert TestFile.memory_stats().used == 0
+    finally:
+        TestFile.set_memory_limit(limit)
@@ -16,6 +16,7 @@ Constants:
 """
 from abc import ABC, abstractmethod
 from hashlib import sha512
+from json import loads as json_loads
 from logging import DEBUG, getLogger
 from pathlib import Path
 from shutil import rmtree
@@ -94,11 +95,20 @@ class Strategy(ABC):
                 testcases.
         """
         self._tried = set()  # set of tuple(tuple(str(Path), SHA512))
+        # files in testcase root that have been modified since they were dumped
+        # (hashes recorded in test_info.json are not valid for these files)
+        self._modified = set()
+        # hashes recorded in test_info.json by `dump_testcases` and the size and
+        # mtime of each file when it was dumped (Path -> tuple(int, int, bytes))
+        self._recorded = {}
         self._testcase_root = Path(mkdtemp(prefix="tc_", dir=grz_tmp("reduce")))
         self.dump_testcases(testcases)
 
     def _calculate_testcase_hash(self):
-        """Calculate hashes of all files in testcase root.
+        """Calculate hashes of all files in testcase root. Hashes recorded in
+        test_info.json by `dump_testcases` are used for files that have not been
+        modified. A file is hashed if its size or mtime has changed since it was
+        dumped or if it is in `_modified`.
 
         Returns:
             tuple(tuple(str, str)): A tuple of 2-tuples mapping str(Path) to SHA-512 of
@@ -107,11 +117,17 @@ class Strategy(ABC):
         result = []
         for path in self._testcase_root.glob("**/*"):
             if path.is_file():
-                tf_hash = sha512()
-                tf_hash.update(path.read_bytes())
-                result.append(
-                    (str(path.relative_to(self._testcase_root)), tf_hash.digest())
-                )
+                digest = None
+                recorded = self._recorded.get(path)
+                if recorded is not None and path not in self._modified:
+                    stat = path.stat()
+                    if (stat.st_size, stat.st_mtime_ns) == recorded[:2]:
+                        digest = recorded[2]
+                if digest is None:
+                    tf_hash = sha512()
+                    tf_hash.update(path.read_bytes())
+                    digest = tf_hash.digest()
+                result.append((str(path.relative_to(self._testcase_root)), digest))
         result = tuple(sorted(result))
 
         if LOG.getEffectiveLevel() == DEBUG:
@@ -125,6 +141,30 @@ class Strategy(ABC):
 
         return result
 
+    def _record_hashes(self, testpath):
+        """Record the hashes in test_info.json along with the size and mtime of
+        each file so they can be used by `_calculate_testcase_hash`.
+
+        Arguments:
+            testpath (Path): Path of a dumped testcase.
+
+        Returns:
+            None
+        """
+        try:
+            hashes = json_loads((testpath / "test_info.json").read_text()).get("hashes")
+        except (OSError, ValueError):
+            return
+        if not isinstance(hashes, dict):
+            return
+        for file_name, digest in hashes.items():
+            path = testpath / file_name
+            try:
+                stat = path.stat()
+                self._recorded[path] = (stat.st_size, stat.st_mtime_ns, bytes.fromhex(digest))
+            except (OSError, TypeError, ValueError):
+                continue
+
     def update_tried(self, tried):
         """Update the list of tried testcase/hash sets. Testcases are hashed with
         SHA-512 and digested to bytes (`hashlib.sha512(testcase).digest()`)
@@ -161,10 +201,13 @@ class Strategy(ABC):
         if recreate_tcroot:
             rmtree(str(self._testcase_root))
             self._testcase_root.mkdir()
+            self._modified.clear()
+            self._recorded.clear()
         for idx, testcase in enumerate(testcases):
             LOG.debug("Extracting testcase %d/%d", idx + 1, len(testcases))
             testpath = self._testcase_root / ("%03d" % (idx,))
             testcase.dump(str(testpath), include_details=True)
+            self._record_hashes(testpath)
 
     @classmethod
     def sanity_check_cls_attrs(cls):
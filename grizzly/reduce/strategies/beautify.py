@@ -202,6 +202,7 @@ class _BeautifyStrategy(Strategy, ABC):
             lith_tc.load(file)
             raw = b"".join(lith_tc.parts)
 
+            self._modified.add(file)
             with file.open("wb") as testcase_fp:
                 last = 0
                 any_beautified = False
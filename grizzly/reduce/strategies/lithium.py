@@ -116,6 +116,8 @@ class _LithiumStrategy(Strategy, ABC):
             LOG.info("[%s] Reducing %s (file %d/%d)", self.name,
                      file.relative_to(self._testcase_root), file_no,
                      len(self._files_to_reduce))
+            # file is modified by the reductions
+            self._modified.add(file)
             lithium_testcase = self.testcase_cls()  # pylint: disable=not-callable
             lithium_testcase.load(file)
             strategy = self.strategy_cls()  # pylint: disable=not-callable
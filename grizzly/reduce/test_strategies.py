@@ -6,7 +6,10 @@
 """Unit tests for `grizzly.reduce.strategies`.
 """
 from collections import namedtuple
+from hashlib import sha512
 from logging import getLogger
+from os import utime
+from pathlib import Path
 
 import pytest
 from pytest import raises
@@ -16,6 +19,7 @@ from ..common import TestCase, TestFile, Report
 from ..replay import ReplayResult
 from ..target import Target
 from .strategies import _load_strategies
+from .strategies.lithium import Check
 from .strategies.beautify import \
     HAVE_CSSBEAUTIFIER, HAVE_JSBEAUTIFIER, CSSBeautify, JSBeautify
 from . import ReduceManager
@@ -746,3 +750,43 @@ def test_dd_only(mocker, tmp_path):
         list((log_path / "reports").iterdir())
     others = {test.read_text() for test in log_path.glob("reports/*-*/other.html")}
     assert others == {"blah\n"}
+
+
+def test_testcase_hash(mocker):
+    """test that hashes recorded in test_info.json are used for unmodified files"""
+    with TestCase("test.html", None, "test-adapter") as test:
+        test.add_from_data("123", "test.html")
+        test.add_from_data("456", "other.html", required=False)
+        with Check([test]) as strategy:
+            read = mocker.spy(Path, "read_bytes")
+            result = dict(strategy._calculate_testcase_hash())
+            assert result["000/test.html"] == sha512(b"123").digest()
+            assert result["000/other.html"] == sha512(b"456").digest()
+            assert "000/test_info.json" in result
+            # only test_info.json is read
+            assert read.call_count == 1
+            # modified files are hashed
+            modified = strategy._testcase_root / "000" / "test.html"
+            modified.write_bytes(b"abc")
+            strategy._modified.add(modified)
+            result = dict(strategy._calculate_testcase_hash())
+            assert result["000/test.html"] == sha512(b"abc").digest()
+            assert result["000/other.html"] == sha512(b"456").digest()
+            assert read.call_count == 3
+            # files modified without updating _modified are detected by size
+            other = strategy._testcase_root / "000" / "other.html"
+            other.write_bytes(b"4567")
+            result = dict(strategy._calculate_testcase_hash())
+            assert result["000/other.html"] == sha512(b"4567").digest()
+            # ... and by mtime
+            mtime = other.stat().st_mtime_ns
+            other.write_bytes(b"456")
+            utime(str(other), ns=(mtime + 1000, mtime + 1000))
+            result = dict(strategy._calculate_testcase_hash())
+            assert result["000/other.html"] == sha512(b"456").digest()
+            # ... even if the size is unchanged
+            mtime = other.stat().st_mtime_ns
+            other.write_bytes(b"789")
+            utime(str(other), ns=(mtime + 1000, mtime + 1000))
+            result = dict(strategy._calculate_testcase_hash())
+            assert result["000/other.html"] == sha512(b"789").digest()
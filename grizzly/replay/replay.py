@@ -3,6 +3,7 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+from functools import partial
 from logging import getLogger
 from os.path import dirname, join as pathjoin
 from tempfile import mkdtemp
@@ -95,7 +96,8 @@ class ReplayManager:
             list(TestCase): Loaded TestCases.
         """
         LOG.debug("loading the TestCases")
-        testcases = TestCase.load(path, load_prefs)
+        # the input is not modified, use it in place of copies
+        testcases = TestCase.load(path, load_prefs, linked=True)
         if not testcases:
             raise TestCaseLoadFailure("Failed to load TestCases")
         if subset:
@@ -177,6 +179,10 @@ class ReplayManager:
         server_map = ServerMap()
         if self._harness is not None:
             server_map.set_dynamic_response("grz_harness", lambda: self._harness, mime_type="text/html")
+            server_map.set_dynamic_response(
+                "grz_control",
+                partial(Runner.control_response, server_map),
+                mime_type="application/json")
 
         # track unprocessed results
         reports = dict()
@@ -618,6 +618,8 @@ def test_replay_21(mocker, tmp_path):
     fake_load.return_value = [test0, test1]
     tests = ReplayManager.load_testcases(str(tmp_path), False)
     assert len(tests) == 2
+    # the input is used in place
+    assert fake_load.call_args[1]["linked"]
     assert tests[0].cleanup.call_count == 0
     assert tests[1].cleanup.call_count == 0
     # success select
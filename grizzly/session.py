@@ -82,6 +82,13 @@ class Session:
     def __exit__(self, *exc):
         self.close()
 
+    def _populate(self, test, server_map):
+        LOG.debug("calling self.adapter.generate()")
+        self.adapter.generate(test, server_map)
+        if self.target.prefs is not None:
+            # TODO: this can likely be improved
+            test.add_meta(TestFile.from_file(self.target.prefs, "prefs.js"))
+
     def close(self):
         self.status.cleanup()
 
@@ -96,16 +103,20 @@ class Session:
         elif log_limiter.ready(self.status.iteration, self.target.monitor.launches):
             LOG.info("I%04d-R%02d ", self.status.iteration, self.status.results)
 
-    def generate_testcase(self):
-        LOG.debug("calling iomanager.create_testcase()")
-        test = self.iomanager.create_testcase(self.adapter.NAME)
-        LOG.debug("calling self.adapter.generate()")
-        with self.status.measure("generate"):
-            self.adapter.generate(test, self.iomanager.server_map)
+    def generate_testcase(self, look_ahead=True):
+        # the number of test cases must be known by the adapter when replaying
+        if self.adapter.PIPELINED and self.adapter.remaining is None:
+            # the next test case is generated while the current test case runs
+            LOG.debug("calling iomanager.next_testcase()")
+            with self.status.measure("generate"):
+                test = self.iomanager.next_testcase(
+                    self.adapter.NAME, self._populate, look_ahead=look_ahead)
+        else:
+            LOG.debug("calling iomanager.create_testcase()")
+            test = self.iomanager.create_testcase(self.adapter.NAME)
+            with self.status.measure("generate"):
+                self._populate(test, self.iomanager.server_map)
         self.status.test_name = test.input_fname
-        if self.target.prefs is not None:
-            # TODO: this can likely be improved
-            test.add_meta(TestFile.from_file(self.target.prefs, "prefs.js"))
         return test
 
     def run(self, ignore, iteration_limit=0, display_mode=DISPLAY_NORMAL):
@@ -153,7 +164,9 @@ class Session:
                     raise TargetLaunchError(str(exc), None) from None
 
             # create and populate a test case
-            current_test = self.generate_testcase()
+            # (the following test case is not needed if the iteration limit is hit)
+            current_test = self.generate_testcase(
+                look_ahead=not iteration_limit or self.status.iteration < iteration_limit)
             # display status
             self.display_status(log_limiter=log_limiter)
 
@@ -165,6 +178,10 @@ class Session:
                     current_test,
                     coverage=self.coverage)
             current_test.duration = result.duration
+            if result.serve_stats is not None:
+                # include request timings in profiling data
+                for name, histogram in result.serve_stats.histograms():
+                    self.status.record_histogram("serve_%s" % (name,), histogram)
             # adapter callbacks
             if result.timeout:
                 LOG.debug("calling self.adapter.on_timeout()")
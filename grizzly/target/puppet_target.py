@@ -106,6 +106,8 @@ class PuppetTarget(Target):
                     return self._puppet.launches
                 def log_length(_, log_id):
                     return self._puppet.log_length(log_id)
+                def wait(_, timeout):
+                    return self._puppet.wait(timeout=timeout)
             self._monitor = _PuppetMonitor()
         return self._monitor
 
@@ -4,6 +4,7 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 from abc import ABCMeta, abstractmethod, abstractproperty
 from os import remove
+from time import sleep, time
 
 
 __all__ = ("TargetMonitor",)
@@ -41,3 +42,20 @@ class TargetMonitor(metaclass=ABCMeta):
     @abstractmethod
     def log_length(self, log_id):
         pass
+
+    def wait(self, timeout):
+        """Wait for the target to exit. Targets that can block on the process
+        should override this, by default is_running() is polled.
+
+        Args:
+            timeout (float): Maximum number of seconds to wait.
+
+        Returns:
+            bool: True if the target is not running otherwise False.
+        """
+        deadline = time() + timeout
+        while self.is_running():
+            if time() >= deadline:
+                return False
+            sleep(min(0.1, timeout))
+        return True
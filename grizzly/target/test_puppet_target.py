@@ -291,6 +291,9 @@ def test_puppet_target_06(mocker, tmp_path):
         assert target.monitor.log_length("stdout") == 100
         target.monitor.clone_log("somelog")
         assert fake_ffp.return_value.clone_log.call_count == 1
+        fake_ffp.return_value.wait.return_value = True
+        assert target.monitor.wait(1)
+        fake_ffp.return_value.wait.assert_called_once_with(timeout=1)
 
 def test_puppet_target_07(mocker, tmp_path):
     """test PuppetTarget.prefs"""
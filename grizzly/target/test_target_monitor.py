@@ -30,3 +30,8 @@ def test_target_monitor_01(tmp_path):
     assert mon.launches == 1
     assert mon.log_data("test_log") == b"test"
     assert mon.log_length("test_log") == 100
+    # default wait() polls is_running()
+    assert not mon.wait(0)
+    running = iter((True, False))
+    mon.is_running = lambda: next(running)
+    assert mon.wait(10)
@@ -135,7 +135,7 @@ def test_session_04(tmp_path, mocker):
 def test_session_05(tmp_path, mocker):
     """test basic Session functions"""
     Status.PATH = str(tmp_path)
-    fake_adapter = mocker.Mock(spec=Adapter, remaining=None)
+    fake_adapter = mocker.Mock(spec=Adapter, remaining=None, PIPELINED=False)
     fake_adapter.IGNORE_UNSERVED = True
     fake_adapter.TEST_DURATION = 10
     fake_testcase = mocker.Mock(spec=TestCase, landing_page="page.htm", optional=[])
@@ -167,7 +167,7 @@ def test_session_06(tmp_path, mocker):
     """test Session.generate_testcase()"""
     Status.PATH = str(tmp_path)
     mocker.patch("grizzly.session.TestFile", autospec=True)
-    fake_adapter = mocker.Mock(spec=Adapter)
+    fake_adapter = mocker.Mock(spec=Adapter, PIPELINED=False)
     fake_adapter.NAME = "fake_adapter"
     fake_iomgr = mocker.Mock(spec=IOManager, server_map=ServerMap())
     fake_iomgr.create_testcase.return_value = mocker.Mock(spec=TestCase)
@@ -186,7 +186,7 @@ def test_session_07(tmp_path, mocker):
     Status.PATH = str(tmp_path)
     fake_runner = mocker.patch("grizzly.session.Runner", autospec=True)
     mocker.patch("grizzly.session.TestFile", autospec=True)
-    fake_adapter = mocker.Mock(spec=Adapter, remaining=None)
+    fake_adapter = mocker.Mock(spec=Adapter, remaining=None, PIPELINED=False)
     fake_adapter.TEST_DURATION = 10
     fake_iomgr = mocker.Mock(spec=IOManager, harness=None, server_map=ServerMap())
     fake_iomgr.create_testcase.return_value = mocker.Mock(spec=TestCase)
@@ -256,7 +256,7 @@ def test_session_08(tmp_path, mocker):
     fake_runner = mocker.patch("grizzly.session.Runner", autospec=True)
     fake_runner.return_value.run.return_value = result
     mocker.patch("grizzly.session.TestFile", autospec=True)
-    fake_adapter = mocker.Mock(spec=Adapter, remaining=None)
+    fake_adapter = mocker.Mock(spec=Adapter, remaining=None, PIPELINED=False)
     fake_adapter.IGNORE_UNSERVED = False
     fake_adapter.TEST_DURATION = 10
     fake_iomgr = mocker.Mock(spec=IOManager, harness=None, server_map=ServerMap())
@@ -286,7 +286,7 @@ def test_session_09(tmp_path, mocker):
     fake_runner = mocker.patch("grizzly.session.Runner", autospec=True)
     fake_runner.return_value.launch.side_effect = TargetLaunchError("test", fake_report)
     mocker.patch("grizzly.session.TestFile", autospec=True)
-    fake_adapter = mocker.Mock(spec=Adapter, remaining=None)
+    fake_adapter = mocker.Mock(spec=Adapter, remaining=None, PIPELINED=False)
     fake_iomgr = mocker.Mock(spec=IOManager, harness=None, server_map=ServerMap())
     fake_serv = mocker.Mock(spec=Sapphire, port=0x1337)
     fake_target = mocker.Mock(spec=Target)
@@ -298,6 +298,32 @@ def test_session_09(tmp_path, mocker):
         assert session.status.results == 1
         assert session.status.ignored == 0
 
+def test_session_10(tmp_path, mocker):
+    """test Session with pipelined fuzzer Adapter"""
+    class FuzzAdapter(Adapter):
+        NAME = "fuzz"
+        PIPELINED = True
+        def setup(self, input_path, server_map):
+            pass
+        def generate(self, testcase, server_map):
+            assert testcase.adapter_name == self.NAME
+            testcase.add_from_data("test", testcase.landing_page)
+    Status.PATH = str(tmp_path)
+    adapter = FuzzAdapter()
+    adapter.setup(None, None)
+    fake_serv = mocker.Mock(spec=Sapphire, port=0x1337)
+    fake_target = mocker.Mock(spec=Target, launch_timeout=30, prefs=None)
+    fake_target.log_size.return_value = 1000
+    fake_target.monitor.launches = 1
+    with IOManager() as iomgr:
+        fake_serv.serve_path = lambda *a, **kv: (SERVED_ALL, [iomgr.tests[-1].landing_page])
+        with Session(adapter, iomgr, None, fake_serv, fake_target, relaunch=10) as session:
+            session.run([], iteration_limit=10)
+            assert session.status.iteration == 10
+            # no test case is generated after the last iteration
+            assert not iomgr._ahead
+            assert iomgr._generated == 10
+
 def test_log_output_limiter_01(mocker):
     """test LogOutputLimiter.ready() not ready"""
     fake_time = mocker.patch("grizzly.session.time", autospec=True)
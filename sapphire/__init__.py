@@ -9,7 +9,10 @@ Sapphire HTTP server
 from .core import Sapphire
 from .job import SERVED_ALL, SERVED_NONE, SERVED_REQUEST, SERVED_TIMEOUT
 from .server_map import ServerMap
+from .stats import ServeStats
 
-__all__ = ("Sapphire", "SERVED_ALL", "SERVED_NONE", "SERVED_REQUEST", "SERVED_TIMEOUT", "ServerMap")
+__all__ = (
+    "Sapphire", "SERVED_ALL", "SERVED_NONE", "SERVED_REQUEST", "SERVED_TIMEOUT", "ServerMap",
+    "ServeStats")
 __author__ = "Tyson Smith"
 __credits__ = ["Tyson Smith"]
@@ -0,0 +1,372 @@
+# coding=utf-8
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+Sapphire HTTP server benchmark
+
+Run with: python -m sapphire.benchmark --help
+"""
+from argparse import ArgumentParser
+from collections import namedtuple
+from http.client import HTTPConnection, HTTPException
+from json import dump, load
+from logging import getLogger
+from math import ceil
+from multiprocessing import Event, Process, Queue
+from os import makedirs
+from os.path import join as pathjoin
+from shutil import rmtree
+from socket import error as sock_error
+from tempfile import mkdtemp
+from threading import Lock, Thread
+from time import perf_counter
+
+try:
+    from resource import getrusage, RUSAGE_SELF
+except ImportError:  # pragma: no cover
+    # not available on Windows (CPU time is not reported)
+    getrusage = None
+
+from .core import Sapphire
+from .server_map import Resource, ServerMap
+from .stats import ServeStats
+
+__all__ = ("LoadGenerator", "SCENARIOS", "run_scenario")
+__author__ = "Tyson Smith"
+__credits__ = ["Tyson Smith"]
+
+LOG = getLogger(__name__)
+
+
+# create (callable): Creates content in a directory and returns the URLs to request.
+# limit (int): Maximum number of requests to perform (None for no limit).
+# server_map (callable): Returns the ServerMap to use for a directory (or None).
+Scenario = namedtuple("Scenario", "create description limit name server_map")
+
+
+def _create_files(path, count, size, prefix="file_"):
+    data = b"A" * size
+    urls = list()
+    for idx in range(count):
+        name = "%s%04d.bin" % (prefix, idx)
+        with open(pathjoin(path, name), "wb") as out_fp:
+            out_fp.write(data)
+        urls.append(name)
+    return urls
+
+
+def _create_index(path):
+    # required file that is never requested, this keeps the job active
+    with open(pathjoin(path, "index.html"), "wb") as out_fp:
+        out_fp.write(b"<html></html>")
+
+
+def _huge_create(path):
+    _create_index(path)
+    return _create_files(path, 4, 0x2000000)  # 32MB
+
+
+def _includes_create(path):
+    _create_index(path)
+    urls = list()
+    for depth in range(1, 21):
+        inc_path = pathjoin(path, "inc", "%02d" % (depth,))
+        makedirs(inc_path)
+        url = "/".join("d%d" % (x,) for x in range(depth))
+        urls.extend("%s/%s" % (url, x) for x in _create_files(inc_path, 5, 0x400))
+    return urls
+
+
+def _includes_map(path):
+    server_map = ServerMap()
+    for depth in range(1, 21):
+        # ServerMap.set_include() does not accept "/" in URLs so mappings are added directly
+        url = "/".join("d%d" % (x,) for x in range(depth))
+        server_map.include[url] = Resource(
+            Resource.URL_INCLUDE, pathjoin(path, "inc", "%02d" % (depth,)))
+    return server_map
+
+
+def _missing_create(path):
+    _create_index(path)
+    return ["missing_%04d.html" % (x,) for x in range(100)]
+
+
+def _redirect_create(path):
+    _create_index(path)
+    return ["grz_next_test"]
+
+
+def _redirect_map(_):
+    server_map = ServerMap()
+    server_map.set_redirect("grz_next_test", "grz_empty", required=False)
+    server_map.set_dynamic_response("grz_empty", lambda: b"", mime_type="text/html")
+    return server_map
+
+
+def _tiny_create(path):
+    _create_index(path)
+    return _create_files(path, 1000, 64)
+
+
+SCENARIOS = {x.name: x for x in (
+    Scenario(_tiny_create, "many tiny files (1000 x 64B)", None, "tiny", None),
+    Scenario(_huge_create, "a few huge files (4 x 32MB)", 64, "huge", None),
+    Scenario(
+        _includes_create, "deep include maps (20 nested mappings)", None, "includes",
+        _includes_map),
+    Scenario(_redirect_create, "harness polling (307 redirects)", None, "redirects", _redirect_map),
+    Scenario(_missing_create, "404 storm", None, "missing", None),
+)}
+
+
+class LoadGenerator:
+    """LoadGenerator requests URLs from a local server using multiple threads.
+
+    Attributes:
+        errors (int): Number of failed requests.
+        latencies (list(float)): Duration of each successful request in seconds.
+        received (int): Number of response body bytes received.
+    """
+
+    __slots__ = ("_clients", "_keep_alive", "_lock", "_port", "_requests", "_urls",
+                 "errors", "latencies", "received")
+
+    def __init__(self, port, urls, clients=4, requests=1000, keep_alive=True):
+        assert clients > 0
+        assert requests > 0
+        assert urls
+        self._clients = clients
+        self._keep_alive = keep_alive
+        self._lock = Lock()
+        self._port = port
+        self._requests = requests
+        self._urls = urls
+        self.errors = 0
+        self.latencies = list()
+        self.received = 0
+
+    def _client(self, count, offset):
+        headers = {"Connection": "keep-alive" if self._keep_alive else "close"}
+        conn = HTTPConnection("127.0.0.1", self._port, timeout=60)
+        errors = 0
+        latencies = list()
+        received = 0
+        try:
+            for idx in range(offset, offset + count):
+                url = "/" + self._urls[idx % len(self._urls)]
+                start = perf_counter()
+                try:
+                    conn.request("GET", url, headers=headers)
+                    received += len(conn.getresponse().read())
+                except (HTTPException, sock_error):
+                    errors += 1
+                    conn.close()
+                    continue
+                latencies.append(perf_counter() - start)
+        finally:
+            conn.close()
+        with self._lock:
+            self.errors += errors
+            self.latencies.extend(latencies)
+            self.received += received
+
+    def run(self):
+        """Perform requests.
+
+        Args:
+            None
+
+        Returns:
+            float: Number of seconds elapsed.
+        """
+        per_client, extra = divmod(self._requests, self._clients)
+        threads = list()
+        for idx in range(self._clients):
+            count = per_client + (1 if idx < extra else 0)
+            threads.append(Thread(target=self._client, args=(count, idx * per_client)))
+        start = perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return perf_counter() - start
+
+
+def percentile(values, pct):
+    """Calculate the value at a percentile using the nearest rank method.
+
+    Args:
+        values (list(float)): Sorted values.
+        pct (float): Percentile (0-100).
+
+    Returns:
+        float: Value at percentile.
+    """
+    if not values:
+        return 0
+    rank = max(int(ceil(pct / 100.0 * len(values))), 1)
+    return values[min(rank, len(values)) - 1]
+
+
+def _cpu_time():
+    # CPU time used by this process
+    if getrusage is None:  # pragma: no cover
+        return 0
+    usage = getrusage(RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _serve(path, scenario, use_event_loop, port_queue, result_queue, stop):
+    # server process
+    server_map = SCENARIOS[scenario].server_map
+    with Sapphire(timeout=0, use_event_loop=use_event_loop) as serv:
+        def _wake():
+            # wake the server as soon as the benchmark is complete
+            stop.wait()
+            serv.wake()
+        waker = Thread(target=_wake)
+        waker.start()
+        stats = ServeStats()
+        port_queue.put(serv.port)
+        cpu = _cpu_time()
+        serv.serve_path(
+            path,
+            continue_cb=lambda: not stop.is_set(),
+            forever=True,
+            server_map=server_map(path) if server_map is not None else None,
+            stats=stats)
+        cpu = _cpu_time() - cpu
+        waker.join()
+    result_queue.put((cpu, stats.requests, stats.sent))
+
+
+def run_scenario(name, clients=4, requests=1000, keep_alive=True, use_event_loop=False):
+    """Run a benchmark scenario. The server runs in a separate process so the
+    CPU time it uses can be measured.
+
+    Args:
+        name (str): Scenario to run.
+        clients (int): Number of concurrent clients.
+        requests (int): Total number of requests to perform (scenarios can
+                        specify a lower limit).
+        keep_alive (bool): Use persistent connections.
+        use_event_loop (bool): Use the Sapphire event loop engine.
+
+    Returns:
+        dict: Results.
+    """
+    scenario = SCENARIOS[name]
+    if scenario.limit is not None:
+        requests = min(requests, scenario.limit)
+    path = mkdtemp(prefix="sapphire_bench_")
+    try:
+        urls = scenario.create(path)
+        port_queue = Queue()
+        result_queue = Queue()
+        stop = Event()
+        server = Process(
+            target=_serve,
+            args=(path, name, use_event_loop, port_queue, result_queue, stop))
+        server.start()
+        try:
+            port = port_queue.get(timeout=60)
+            loadgen = LoadGenerator(
+                port, urls, clients=clients, requests=requests, keep_alive=keep_alive)
+            elapsed = loadgen.run()
+        finally:
+            stop.set()
+        cpu, handled, sent = result_queue.get(timeout=60)
+        server.join(timeout=60)
+    finally:
+        rmtree(path, ignore_errors=True)
+    latencies = sorted(loadgen.latencies)
+    return {
+        "bytes": sent,
+        "clients": clients,
+        "cpu_per_request_us": cpu / handled * 1e6 if handled else 0,
+        "errors": loadgen.errors,
+        "event_loop": use_event_loop,
+        "keep_alive": keep_alive,
+        "p50_ms": percentile(latencies, 50) * 1e3,
+        "p99_ms": percentile(latencies, 99) * 1e3,
+        "requests": len(latencies),
+        "rps": len(latencies) / elapsed if elapsed > 0 else 0,
+        "scenario": name,
+    }
+
+
+def _format(result, baseline=None):
+    fields = (
+        "%-10s" % (result["scenario"],),
+        "%10.1f" % (result["rps"],),
+        "%9.3f" % (result["p50_ms"],),
+        "%9.3f" % (result["p99_ms"],),
+        "%11.1f" % (result["cpu_per_request_us"],),
+        "%7d" % (result["errors"],),
+    )
+    line = " ".join(fields)
+    if baseline and baseline.get("rps"):
+        line += " %+7.1f%%" % ((result["rps"] / baseline["rps"] - 1) * 100,)
+    return line
+
+
+def parse_args(argv=None):
+    parser = ArgumentParser(description="Sapphire benchmark")
+    parser.add_argument(
+        "--baseline",
+        help="Compare results to a file created with --output.")
+    parser.add_argument(
+        "--clients", default=4, type=int,
+        help="Number of concurrent clients (default: %(default)s)")
+    parser.add_argument(
+        "--event-loop", action="store_true",
+        help="Use the event loop engine instead of worker threads.")
+    parser.add_argument(
+        "--no-keep-alive", action="store_true",
+        help="Open a new connection for each request.")
+    parser.add_argument(
+        "--output",
+        help="Save results to a JSON file.")
+    parser.add_argument(
+        "--requests", default=2000, type=int,
+        help="Number of requests per scenario (default: %(default)s)")
+    parser.add_argument(
+        "--scenario", action="append", choices=sorted(SCENARIOS),
+        help="Scenario to run, can be specified multiple times (default: all)")
+    args = parser.parse_args(argv)
+    if args.clients < 1:
+        parser.error("--clients must be greater than 0")
+    if args.requests < 1:
+        parser.error("--requests must be greater than 0")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    baseline = dict()
+    if args.baseline:
+        with open(args.baseline, "r") as in_fp:
+            baseline = {x["scenario"]: x for x in load(in_fp)}
+    print("%-10s %10s %9s %9s %11s %7s%s" % (
+        "scenario", "req/s", "p50(ms)", "p99(ms)", "cpu/req(us)", "errors",
+        " vs base" if baseline else ""))
+    results = list()
+    for name in args.scenario or SCENARIOS:
+        result = run_scenario(
+            name,
+            clients=args.clients,
+            requests=args.requests,
+            keep_alive=not args.no_keep_alive,
+            use_event_loop=args.event_loop)
+        results.append(result)
+        print(_format(result, baseline.get(name)))
+    if args.output:
+        with open(args.output, "w") as out_fp:
+            dump(results, out_fp, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -3,8 +3,10 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 from logging import getLogger
+from select import select
+from socket import error as sock_error, socketpair, timeout as sock_timeout
 from sys import exc_info
-from threading import active_count, Thread, ThreadError
+from threading import active_count, Event, Thread, ThreadError
 from time import sleep, time
 from traceback import format_exception
 
@@ -19,13 +21,15 @@ LOG = getLogger(__name__)
 class ConnectionManager:
     SHUTDOWN_DELAY = 0.5  # allow extra time before closing socket if needed
 
-    __slots__ = ("_job", "_listener", "_socket", "_workers")
+    __slots__ = ("_job", "_listener", "_pool", "_socket", "_wakeup", "_workers")
 
-    def __init__(self, job, sock, max_workers=1):
+    def __init__(self, job, sock, max_workers=1, pool=None):
         assert max_workers > 0
         self._job = job
         self._listener = None
+        self._pool = pool  # WorkerPool to use instead of launching worker threads
         self._socket = sock
+        self._wakeup = None  # socket pair used to wake the pool listener
         self._workers = max_workers
 
     def __enter__(self):
@@ -37,9 +41,16 @@ class ConnectionManager:
 
     def close(self):
         self._job.finish()
+        if self._wakeup is not None:
+            # unblock the pool listener
+            self._wakeup[1].send(b"\x00")
         if self._listener is not None:
             self._listener.join()
             self._listener = None
+        if self._wakeup is not None:
+            for wake_sock in self._wakeup:
+                wake_sock.close()
+            self._wakeup = None
         if not self._job.exceptions.empty():
             exc_type, exc_obj, exc_tb = self._job.exceptions.get()
             LOG.error(
@@ -51,10 +62,18 @@ class ConnectionManager:
     def start(self):
         assert self._job.pending
         # create the listener thread to handle incoming requests
-        listener = Thread(
-            target=self.listener,
-            args=(self._socket, self._job, self._workers),
-            kwargs={"shutdown_delay": self.SHUTDOWN_DELAY})
+        if self._pool is not None:
+            self._pool.start()
+            self._wakeup = socketpair()
+            listener = Thread(
+                target=self.pool_listener,
+                args=(self._socket, self._job, self._pool),
+                kwargs={"shutdown_delay": self.SHUTDOWN_DELAY, "wake_sock": self._wakeup[0]})
+        else:
+            listener = Thread(
+                target=self.listener,
+                args=(self._socket, self._job, self._workers),
+                kwargs={"shutdown_delay": self.SHUTDOWN_DELAY})
         # launch listener thread and handle thread errors
         for retry in reversed(range(10)):
             try:
@@ -71,42 +90,84 @@ class ConnectionManager:
 
     def wait(self, timeout, continue_cb=None, poll=0.5):
         assert self._listener is not None
+        return self.wait_for_job(self._job, timeout, continue_cb=continue_cb, poll=poll)
+
+    @staticmethod
+    def wait_for_job(job, timeout, continue_cb=None, poll=0.5):
+        """Wait for a job to complete.
+
+        Args:
+            job (Job): Job to wait on.
+            timeout (float): Maximum number of seconds to wait (0 for no limit).
+            continue_cb (callable): Returns False to stop waiting.
+            poll (float): Interval used to call continue_cb.
+
+        Returns:
+            bool: False if a timeout occurred otherwise True.
+        """
+        now = time()
         if timeout > 0:
-            deadline = time() + timeout
+            deadline = now + timeout
         else:
             deadline = None
         if continue_cb is not None and not callable(continue_cb):
             raise TypeError("continue_cb must be callable")
         # it is important to keep this loop fast because it can limit
         # the total iteration rate of Grizzly
-        while not self._job.is_complete(wait=poll):
+        # the job signals completion and wake() requests so there is no need
+        # to wait for the next poll to detect them
+        next_poll = now + poll
+        while not job.is_complete():
+            now = time()
             # check for a timeout
-            if deadline and deadline <= time():
+            if deadline and deadline <= now:
                 return False
-            # check if callback returns False
-            if continue_cb is not None and not continue_cb():
-                LOG.debug("continue_cb() returned False")
-                break
+            if next_poll <= now:
+                # check if callback returns False
+                if continue_cb is not None and not continue_cb():
+                    LOG.debug("continue_cb() returned False")
+                    break
+                next_poll = now + poll
+            wake = min(next_poll, deadline) if deadline else next_poll
+            if job.wait_signal(max(wake - now, 0)):
+                # check continue_cb immediately
+                next_poll = 0
         return True
 
+    def wake(self):
+        """Wake the thread in wait() to check the job and call continue_cb.
+        This can be called from any thread.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        self._job.wake()
+
     @staticmethod
     def listener(serv_sock, serv_job, max_workers, shutdown_delay=0):
         assert max_workers > 0
         assert shutdown_delay >= 0
         worker_pool = list()
         pool_size = 0
+        # set while waiting for a worker, idle persistent connections are closed
+        # so they cannot hold every worker for Worker.KEEP_ALIVE_TIMEOUT
+        saturated = Event()
         LOG.debug("starting listener")
         try:
             while not serv_job.is_complete():
                 if not serv_job.accepting.wait(0.05):
                     continue
-                worker = Worker.launch(serv_sock, serv_job)
+                worker = Worker.launch(serv_sock, serv_job, release=saturated.is_set)
                 if worker is not None:
                     worker_pool.append(worker)
                     pool_size += 1
                 # manage worker pool
                 if pool_size >= max_workers:
                     LOG.debug("pool size: %d, waiting for worker to finish...", pool_size)
+                    saturated.set()
                     serv_job.worker_complete.wait()
                     serv_job.worker_complete.clear()
                     # remove complete workers
@@ -122,6 +183,7 @@ class ConnectionManager:
                     else:  # pragma: no cover
                         # this should never happen
                         raise RuntimeError("Failed to trim worker pool!")
+                    saturated.clear()
                     LOG.debug("trimmed worker pool (size: %d)", pool_size)
         except Exception:  # pylint: disable=broad-except
             if serv_job.exceptions.empty():
@@ -141,3 +203,35 @@ class ConnectionManager:
                 LOG.debug("closing remaining workers")
                 for worker in (w for w in worker_pool if not w.done):
                     worker.close()
+
+    @staticmethod
+    def pool_listener(serv_sock, serv_job, pool, shutdown_delay=0, wake_sock=None):
+        assert shutdown_delay >= 0
+        LOG.debug("starting listener (pool size: %d)", pool.size)
+        try:
+            while not serv_job.is_complete():
+                if wake_sock is not None:
+                    # block until a connection is pending or wake_sock is signaled
+                    if wake_sock in select((serv_sock, wake_sock), (), ())[0]:
+                        continue
+                # wait for the previous request to be processed
+                if not serv_job.accepting.wait(0.05):
+                    continue
+                try:
+                    conn, _ = serv_sock.accept()
+                except (sock_error, sock_timeout):
+                    continue
+                conn.settimeout(None)
+                Worker.set_nodelay(conn)
+                serv_job.accepting.clear()
+                pool.submit(conn, serv_job)
+        except Exception:  # pylint: disable=broad-except
+            if serv_job.exceptions.empty():
+                serv_job.exceptions.put(exc_info())
+            serv_job.finish()
+        finally:
+            LOG.debug("listener waiting for pool (active: %d)", pool.active)
+            # avoid cutting off connections
+            if not pool.wait(timeout=shutdown_delay):  # pragma: no cover
+                LOG.debug("closing remaining connections")
+                pool.close_connections()
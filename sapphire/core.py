@@ -11,10 +11,15 @@ from os.path import abspath
 from random import randint
 from socket import AF_INET, SOCK_STREAM, SOL_SOCKET, SO_REUSEADDR
 from socket import gethostname, socket
+from threading import Lock
 from time import sleep, time
+from traceback import format_exception
 
-from .job import Job, SERVED_ALL, SERVED_NONE, SERVED_TIMEOUT
+from .job import Job, JobTemplate, SERVED_ALL, SERVED_NONE, SERVED_TIMEOUT
 from .connection_manager import ConnectionManager
+from .multiplexer import JobMultiplexer
+from .selector_manager import SelectorManager
+from .worker import WorkerPool
 
 
 __author__ = "Tyson Smith"
@@ -26,14 +31,31 @@ LOG = getLogger(__name__)
 
 class Sapphire:
     LISTEN_TIMEOUT = 0.25
+    TEMPLATE_LIMIT = 8  # maximum number of cached JobTemplates
 
-    __slots__ = ("_auto_close", "_max_workers", "_socket", "_timeout")
+    __slots__ = (
+        "_auto_close", "_loadmgr", "_lock", "_max_workers", "_mux", "_pool", "_socket",
+        "_templates", "_timeout", "_use_event_loop")
 
-    def __init__(self, allow_remote=False, auto_close=-1, max_workers=10, port=None, timeout=60):
+    def __init__(self, allow_remote=False, auto_close=-1, max_workers=10, port=None,
+                 queue_size=10, timeout=60, use_event_loop=False, use_worker_pool=True):
         self._auto_close = auto_close  # call 'window.close()' on 4xx error pages
+        self._loadmgr = None  # connection manager of the active call to serve_path()
+        self._lock = Lock()
         self._max_workers = max_workers  # limit worker threads
+        self._mux = None  # JobMultiplexer used to serve namespaced jobs
+        # long-lived worker threads that are used by all calls to serve_path(),
+        # this is the default (use_worker_pool=False to launch a thread per connection)
+        # queue_size limits the number of accepted connections waiting for a worker
+        if use_worker_pool:
+            self._pool = WorkerPool(max_workers, queue_size=queue_size)
+        else:
+            self._pool = None
         self._socket = Sapphire._create_listening_socket(allow_remote, port)
+        self._templates = dict()  # JobTemplates of recently served paths
         self._timeout = None
+        # handle connections with a single event loop instead of worker threads
+        self._use_event_loop = use_event_loop
         self.timeout = timeout
 
     def __enter__(self):
@@ -42,6 +64,21 @@ class Sapphire:
     def __exit__(self, *exc):
         self.close()
 
+    def _close_mux(self):
+        """Stop serving namespaced jobs.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        with self._lock:
+            mux = self._mux
+            self._mux = None
+        if mux is not None:
+            mux.close()
+
     @classmethod
     def _create_listening_socket(cls, remote, port=None, retries=20):
         """Create listening socket. Search for an open socket if needed and
@@ -78,6 +115,76 @@ class Sapphire:
             break
         return sock
 
+    def _lookup_template(self, path, optional_files):
+        """Find a JobTemplate for path. A cached JobTemplate is used if the
+        contents of path have not been modified since it was created otherwise
+        a new JobTemplate is created and cached.
+
+        Args:
+            path (str): Directory to use as wwwroot.
+            optional_files (list(str)): Files that do not need to be served.
+
+        Returns:
+            JobTemplate: Template of path.
+        """
+        key = (abspath(path), frozenset(optional_files) if optional_files else None)
+        with self._lock:
+            # remove entry so it is re-added as the most recently used
+            template = self._templates.pop(key, None)
+        if template is None or not template.is_current():
+            template = JobTemplate(path, optional_files=optional_files)
+        else:
+            LOG.debug("using cached template of %r", path)
+        with self._lock:
+            self._templates[key] = template
+            # remove least recently used templates
+            while len(self._templates) > self.TEMPLATE_LIMIT:
+                self._templates.pop(next(iter(self._templates)))
+        return template
+
+    def _serve_multiplexed(self, job, namespace, continue_cb):
+        """Serve a Job under a namespace. Multiple Jobs can be served
+        concurrently (from different threads) using the same listening socket.
+
+        Args:
+            job (Job): Job to serve.
+            namespace (str): First segment of the URL path of the Job.
+            continue_cb (callable): A callback that can be used to exit the serve loop.
+
+        Returns:
+            bool: True if a timeout occurred otherwise False.
+        """
+        with self._lock:
+            if self._mux is None:
+                self._mux = JobMultiplexer(
+                    self._socket,
+                    auto_close=self._auto_close,
+                    max_workers=self._max_workers,
+                    pool=self._pool)
+                self._mux.start()
+            mux = self._mux
+        mux.register(namespace, job)
+        try:
+            was_timeout = not ConnectionManager.wait_for_job(
+                job, self.timeout, continue_cb=continue_cb)
+        finally:
+            mux.unregister(namespace)
+            job.finish()
+            if mux.is_complete():
+                # the listener failed, the exception is raised by close()
+                with self._lock:
+                    if self._mux is mux:
+                        self._mux = None
+                mux.close()
+        if not job.exceptions.empty():
+            exc_type, exc_obj, exc_tb = job.exceptions.get()
+            LOG.error(
+                "Unexpected exception:\n%s",
+                "".join(format_exception(exc_type, exc_obj, exc_tb)))
+            # re-raise exception from worker
+            raise exc_obj
+        return was_timeout
+
     def clear_backlog(self):
         """Remove all pending connections from backlog. This should only be
         called when there isn't anything actively trying to connect.
@@ -104,8 +211,20 @@ class Sapphire:
             assert deadline > time()
         self._socket.settimeout(self.LISTEN_TIMEOUT)
 
+    def clear_templates(self):
+        """Remove all cached JobTemplates. This forces the next call to
+        serve_path() to scan the path.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        self._templates.clear()
+
     def close(self):
-        """Close listening server socket.
+        """Close listening server socket and stop worker threads.
 
         Args:
             None
@@ -113,9 +232,25 @@ class Sapphire:
         Returns:
             None
         """
+        self._close_mux()
+        if self._pool is not None:
+            self._pool.close()
         if self._socket is not None:
             self._socket.close()
 
+    @property
+    def pool(self):
+        """WorkerPool used to handle connections. This can be used to collect
+        pool statistics.
+
+        Args:
+            None
+
+        Returns:
+            WorkerPool: Pool in use or None if a pool is not used.
+        """
+        return self._pool
+
     @property
     def port(self):
         """Port number of listening socket.
@@ -128,40 +263,79 @@ class Sapphire:
         """
         return self._socket.getsockname()[1]
 
-    def serve_path(self, path, continue_cb=None, forever=False, optional_files=None, server_map=None):
+    def serve_path(self, path, continue_cb=None, forever=False, namespace=None, optional_files=None,
+                   provider=None, server_map=None, stats=None):
         """Serve files in path. On completion a list served files and a status
         code will be returned.
+        Content can be served from memory by passing a provider instead of a
+        path. A provider must implement files(), which returns the URLs of the
+        content to serve, and open(url), which returns a binary file object
+        containing the content of a URL and the size of the content. The file
+        object is streamed and closed once it is sent. open() is called from
+        worker threads.
+        When a namespace is given requests must be prefixed with the namespace
+        ("/<namespace>/<file>"). Multiple namespaced calls can run concurrently
+        (in separate threads) and each has its own pending files and timeout.
+        Namespaced and non-namespaced calls must not run concurrently.
         The status codes include:
             - SERVED_ALL: All files excluding files in optional_files were served
             - SERVED_NONE: No files were served
             - SERVED_REQUEST: Some files were requested
 
         Args:
-            path (str): Directory to use as wwwroot.
+            path (str): Directory to use as wwwroot (None if provider is used).
             continue_cb (callable): A callback that can be used to exit the serve loop.
                                     This must be a callable that returns a bool.
             forever (bool): Continue to handle requests even after all files have
                             been served. This is meant to be used with continue_cb.
+            namespace (str): Serve path under this URL path segment using the
+                             shared listener (worker pool and event loop settings
+                             are ignored, a worker pool is always used).
             optional_files (list(str)): Files that do not need to be served in order
                                         to exit the serve loop.
+            provider (object): Supplies the content to serve instead of path.
             server_map (ServerMap):
+            stats (ServeStats): Used to record a Timeline for each request.
 
         Returns:
             tuple(int, tuple(str)): Status code and files served.
         """
-        LOG.debug("serving %r (forever=%r)", path, forever)
+        LOG.debug("serving %r (forever=%r, namespace=%r)", path, forever, namespace)
+        if provider is None:
+            template = self._lookup_template(path, optional_files)
+        else:
+            assert path is None
+            # the content of a provider is not cached
+            template = JobTemplate(None, optional_files=optional_files, provider=provider)
         job = Job(
             path,
             auto_close=self._auto_close,
             forever=forever,
             optional_files=optional_files,
-            server_map=server_map)
+            provider=provider,
+            server_map=server_map,
+            stats=stats,
+            template=template)
         if not job.pending:
             job.finish()
             LOG.debug("nothing to serve")
             return (SERVED_NONE, tuple())
-        with ConnectionManager(job, self._socket, self._max_workers) as loadmgr:
-            was_timeout = not loadmgr.wait(self.timeout, continue_cb=continue_cb)
+        if namespace is not None:
+            was_timeout = self._serve_multiplexed(job, namespace, continue_cb)
+            LOG.debug("status: %r, timeout: %r", job.status, was_timeout)
+            return (SERVED_TIMEOUT if was_timeout else job.status, tuple(job.served))
+        # the listener must not be shared
+        self._close_mux()
+        if self._use_event_loop:
+            loadmgr = SelectorManager(job, self._socket)
+        else:
+            loadmgr = ConnectionManager(job, self._socket, self._max_workers, pool=self._pool)
+        with loadmgr:
+            self._loadmgr = loadmgr
+            try:
+                was_timeout = not loadmgr.wait(self.timeout, continue_cb=continue_cb)
+            finally:
+                self._loadmgr = None
         LOG.debug("status: %r, timeout: %r", job.status, was_timeout)
         return (SERVED_TIMEOUT if was_timeout else job.status, tuple(job.served))
 
@@ -194,6 +368,25 @@ class Sapphire:
         else:
             self._timeout = max(value, 1)
 
+    def wake(self):
+        """Wake the active serve_path() call to check the job and call
+        continue_cb immediately instead of waiting for the next poll. This is
+        intended to be called from other threads when an event that affects
+        continue_cb occurs (for example the target process exits).
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        loadmgr = self._loadmgr
+        if loadmgr is not None:
+            loadmgr.wake()
+        mux = self._mux
+        if mux is not None:
+            mux.wake()
+
     @classmethod
     def main(cls, args):
         try:
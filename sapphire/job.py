@@ -5,11 +5,12 @@
 """
 Sapphire HTTP server job
 """
-from mimetypes import guess_type
 from collections import defaultdict, namedtuple
+from functools import lru_cache
 from logging import getLogger
-from os import walk
-from os.path import abspath, isdir, isfile, join as pathjoin, normpath, relpath, splitext
+import mimetypes  # not "from mimetypes import ...", init() replaces the module maps
+from os import sep, stat, walk
+from os.path import abspath, basename, isfile, join as pathjoin, normpath, relpath, splitext
 from queue import Queue
 from threading import Event, Lock
 
@@ -31,6 +32,12 @@ SERVED_TIMEOUT = 3  # timeout occurred
 Tracker = namedtuple("Tracker", "files lock")
 
 
+@lru_cache(maxsize=512)
+def _guess_ext_mime(ext):
+    # cache mimetypes.guess_type() results since they only depend on the extension
+    return mimetypes.guess_type("file%s" % (ext,))[0]
+
+
 class Job:
     # MIME_MAP is used to support new or uncommon mime types.
     # Definitions in here take priority over mimetypes.guess_type().
@@ -43,42 +50,58 @@ class Job:
     }
 
     __slots__ = (
-        "_complete", "_pending", "_served", "auto_close", "accepting", "base_path",
-        "exceptions", "forever", "initial_queue_size", "server_map", "worker_complete")
+        "_complete", "_files", "_include_roots", "_include_trie", "_pending", "_served", "_signal",
+        "auto_close", "accepting", "base_path", "exceptions", "forever", "initial_queue_size",
+        "provider", "server_map", "stats", "worker_complete")
 
-    def __init__(self, base_path, auto_close=-1, forever=False, optional_files=None, server_map=None):
+    def __init__(self, base_path, auto_close=-1, forever=False, optional_files=None,
+                 provider=None, server_map=None, stats=None, template=None):
         self._complete = Event()
+        self._files = dict()  # request -> (file path, mime type) of files in wwwroot
+        self._include_roots = tuple()  # targets of include mappings
+        self._include_trie = dict()  # include mappings indexed by URL path segment
         self._pending = Tracker(files=set(), lock=Lock())
         self._served = Tracker(files=defaultdict(int), lock=Lock())
+        self._signal = Event()  # used to wake the thread in wait_signal()
         self.accepting = Event()
         self.accepting.set()
         self.auto_close = auto_close
-        self.base_path = abspath(base_path)  # wwwroot
+        # wwwroot (None when content is supplied by provider)
+        self.base_path = abspath(base_path) if provider is None else None
         self.exceptions = Queue()
         self.forever = forever
         self.initial_queue_size = 0
+        self.provider = provider  # supplies content instead of the filesystem
         self.server_map = server_map
+        self.stats = stats  # ServeStats used to record request Timelines
         self.worker_complete = Event()
-        self._build_queue(optional_files)
+        if template is None:
+            template = JobTemplate(
+                self.base_path, optional_files=optional_files, provider=provider)
+        else:
+            assert template.base_path == self.base_path
+        self._build_queue(template)
+        self._build_include_index()
+
+    def _build_include_index(self):
+        # build a trie of include mappings (keyed on URL path segments)
+        # this is intended to only be called once by __init__()
+        if not self.server_map:
+            return
+        for url, resource in self.server_map.include.items():
+            node = self._include_trie
+            for segment in url.split("/") if url else ():
+                node = node.setdefault(segment, dict())
+            # None is never a valid path segment so it is used to store the mapping
+            node[None] = (url, resource)
+        self._include_roots = tuple(x.target for x in self.server_map.include.values())
 
-    def _build_queue(self, optional_files):
+    def _build_queue(self, template):
         # build file list to track files that must be served
         # this is intended to only be called once by __init__()
-        for d_name, _, filenames in walk(self.base_path, followlinks=False):
-            for f_name in filenames:
-                # do not add optional files to queue of required files
-                if optional_files and f_name in optional_files:
-                    LOG.debug("optional: %r", f_name)
-                    continue
-                file_path = abspath(pathjoin(d_name, f_name))
-                if "?" in file_path:
-                    LOG.warning("Cannot add files with '?' in path. Skipping %r", file_path)
-                    continue
-                self._pending.files.add(file_path)
-                LOG.debug("required: %r", f_name)
-        # if nothing was found check if the path exists
-        if not self._pending.files and not isdir(self.base_path):
-            raise OSError("%r does not exist" % (self.base_path),)
+        # the file index is shared with the template and must not be modified
+        self._files = template.files
+        self._pending.files.update(template.required)
         if self.server_map:
             for redirect, resource in self.server_map.redirect.items():
                 if resource.required:
@@ -92,22 +115,84 @@ class Job:
                 if resource.required:
                     self._pending.files.add(dyn_resp)
                     LOG.debug("%s: %r -> %r", "required", dyn_resp, resource.target)
+            for upload, resource in self.server_map.upload.items():
+                if resource.required:
+                    self._pending.files.add(upload)
+                    LOG.debug("%s: %r -> %r", "required", upload, resource.target)
         self.initial_queue_size = len(self._pending.files)
         LOG.debug("%d files required to serve", self.initial_queue_size)
 
+    def _check_include(self, request):
+        # collect include mappings that are a prefix of the request
+        # the longest match is the last entry
+        segments = request.split("/")
+        matches = list()
+        node = self._include_trie
+        if None in node:
+            matches.append((0, node[None]))
+        for depth, segment in enumerate(segments, start=1):
+            node = node.get(segment)
+            if node is None:
+                break
+            if None in node:
+                matches.append((depth, node[None]))
+        # attempt to find match
+        for depth, (url, include) in reversed(matches):
+            location = "/".join(segments[depth:]).lstrip("/") if url else request
+            # check location points to something
+            if not location:
+                continue
+            LOG.debug("found include match %r", url)
+            target = pathjoin(include.target, location)
+            # if the mapping url is empty check the file exists
+            if url or isfile(target):
+                return Resource(
+                    Resource.URL_INCLUDE,
+                    normpath(target),
+                    max_age=include.max_age,
+                    mime=include.mime or self.lookup_mime(request),
+                    required=include.required)
+        return None
+
     @classmethod
     def lookup_mime(cls, url):
-        mime = cls.MIME_MAP.get(splitext(url)[-1].lower())
+        ext = splitext(url)[-1]
+        mime = cls.MIME_MAP.get(ext.lower())
         if mime is None:
+            if ext in mimetypes.encodings_map or ext in mimetypes.suffix_map:
+                # result depends on more than the last extension (".tar.gz", etc)
+                mime = mimetypes.guess_type(url)[0]
+            else:
+                mime = _guess_ext_mime(ext)
             # default to "application/octet-stream"
-            mime = guess_type(url)[0] or "application/octet-stream"
+            mime = mime or "application/octet-stream"
         return mime
 
     def check_request(self, request):
         if "?" in request:
             request = request.split("?", 1)[0]
-        to_serve = normpath(pathjoin(self.base_path, request))
-        if "\x00" not in to_serve and isfile(to_serve):
+        indexed = self._files.get(request)
+        if indexed is None and self.provider is not None:
+            # fallback for requests that are not normalized
+            indexed = self._files.get(normpath(request).replace(sep, "/"))
+        if indexed is not None and self.provider is None and not isfile(indexed[0]):
+            # the file was removed after the Job was created
+            LOG.debug("indexed file %r is missing", indexed[0])
+            indexed = None
+        if indexed is not None:
+            res = Resource(
+                Resource.URL_FILE if self.provider is None else Resource.URL_DATA,
+                indexed[0],
+                mime=indexed[1])
+            with self._pending.lock:
+                res.required = indexed[0] in self._pending.files
+            return res
+        if self.provider is not None:
+            to_serve = None
+        else:
+            # fallback for requests that are not in the index (not normalized, etc)
+            to_serve = normpath(pathjoin(self.base_path, request))
+        if to_serve is not None and "\x00" not in to_serve and isfile(to_serve):
             res = Resource(Resource.URL_FILE, to_serve, mime=self.lookup_mime(to_serve))
             with self._pending.lock:
                 res.required = to_serve in self._pending.files
@@ -117,43 +202,14 @@ class Job:
                 return self.server_map.redirect[request]
             if request in self.server_map.dynamic:
                 return self.server_map.dynamic[request]
-            # collect possible include matches
-            includes = tuple(x for x in self.server_map.include if request.startswith(x))
-            if includes:
-                LOG.debug("potential include matches %r", includes)
-                # attempt to find match
-                url = request
-                while True:
-                    if url in includes:
-                        LOG.debug("found include match %r", url)
-                        location = request.split(url, 1)[-1].lstrip("/") if url else request
-                        # check location points to something
-                        if location:
-                            target = pathjoin(
-                                self.server_map.include[url].target,
-                                location)
-                            # if the mapping url is empty check the file exists
-                            if url or isfile(target):
-                                mime = self.server_map.include[url].mime
-                                if mime is None:
-                                    mime = self.lookup_mime(to_serve)
-                                return Resource(
-                                    Resource.URL_INCLUDE,
-                                    normpath(target),
-                                    mime=mime,
-                                    required=self.server_map.include[url].required)
-                    if "/" in url:
-                        url = url.rsplit("/", 1)[0]
-                    elif url:
-                        # try empty mount point
-                        url = ""
-                    else:
-                        # include does not exist
-                        break
+            if request in self.server_map.upload:
+                return self.server_map.upload[request]
+            return self._check_include(request)
         return None
 
     def finish(self):
         self._complete.set()
+        self._signal.set()
 
     def increment_served(self, target):
         # update list of served files
@@ -168,11 +224,9 @@ class Job:
     def is_forbidden(self, target_file):
         target_file = abspath(target_file)
         # check if target_file lives somewhere in wwwroot
-        if not target_file.startswith(self.base_path):
-            if self.server_map:
-                for resources in self.server_map.include.values():
-                    if target_file.startswith(resources.target):
-                        return False  # this is a valid include path
+        if self.base_path is None or not target_file.startswith(self.base_path):
+            if self._include_roots and target_file.startswith(self._include_roots):
+                return False  # this is a valid include path
             return True  # this is NOT a valid include path
         return False  # this is a valid path
 
@@ -193,18 +247,23 @@ class Job:
     def served(self):
         # served files
         # files served from www root will have a path relative to www root
+        # files supplied by a provider are identified by the request
         # include files will have an absolute path
         with self._served.lock:
             # make a copy of what is available (maybe a copy not necessary?)
             served = tuple(self._served.files.keys())
         for fname in served:
-            if fname.startswith(self.base_path):
+            if self.base_path is not None and fname.startswith(self.base_path):
                 # file is in www root
                 yield relpath(fname, self.base_path)
             else:
                 # include file
                 yield fname
 
+    def route(self, request):
+        # a Job handles all requests it receives (see JobMultiplexer.route())
+        return self, request
+
     @property
     def status(self):
         with self._pending.lock:
@@ -214,3 +273,114 @@ class Job:
         if queue_size < self.initial_queue_size:
             return SERVED_REQUEST
         return SERVED_NONE
+
+    def wait_signal(self, timeout=None):
+        """Wait for the job to complete or wake() to be called. This is intended
+        to be used by a single thread.
+
+        Args:
+            timeout (float): Maximum number of seconds to wait.
+
+        Returns:
+            bool: True if a signal was received otherwise False.
+        """
+        signaled = self._signal.wait(timeout)
+        self._signal.clear()
+        return signaled
+
+    def wake(self):
+        """Wake the thread waiting in wait_signal().
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        self._signal.set()
+
+
+class JobTemplate:
+    """JobTemplate holds the results of scanning a wwwroot. A template can be
+    used to create multiple Jobs that serve the same (unmodified) directory
+    without scanning it each time.
+
+    Attributes:
+        base_path (str): wwwroot that was scanned (None if a provider was used).
+        files (dict): Request mapped to (file path, mime type) of each file.
+                      The request is used in place of the file path for
+                      files supplied by a provider.
+        required (frozenset): Files that must be served.
+    """
+
+    __slots__ = ("_dirs", "base_path", "files", "required")
+
+    def __init__(self, base_path, optional_files=None, provider=None):
+        self._dirs = list()  # (path, inode, mtime) of scanned directories
+        self.base_path = abspath(base_path) if provider is None else None
+        self.files = dict()
+        self.required = frozenset()
+        if provider is None:
+            self._scan(optional_files)
+        else:
+            self._scan_provider(optional_files, provider)
+
+    def _scan(self, optional_files):
+        # this is intended to only be called once by __init__()
+        required = set()
+        for d_name, _, filenames in walk(self.base_path, followlinks=False):
+            d_stat = stat(d_name)
+            self._dirs.append((d_name, d_stat.st_ino, d_stat.st_mtime_ns))
+            for f_name in filenames:
+                file_path = abspath(pathjoin(d_name, f_name))
+                if "?" in file_path:
+                    LOG.warning("Cannot add files with '?' in path. Skipping %r", file_path)
+                    continue
+                # index all files to avoid filesystem lookups when handling requests
+                url = relpath(file_path, self.base_path)
+                if sep != "/":  # pragma: no cover
+                    url = url.replace(sep, "/")
+                self.files[url] = (file_path, Job.lookup_mime(file_path))
+                # do not add optional files to queue of required files
+                if optional_files and f_name in optional_files:
+                    LOG.debug("optional: %r", f_name)
+                    continue
+                required.add(file_path)
+                LOG.debug("required: %r", f_name)
+        # if nothing was found check if the path exists
+        if not self._dirs:
+            raise OSError("%r does not exist" % (self.base_path),)
+        self.required = frozenset(required)
+
+    def _scan_provider(self, optional_files, provider):
+        # this is intended to only be called once by __init__()
+        required = set()
+        for url in provider.files():
+            self.files[url] = (url, Job.lookup_mime(url))
+            if optional_files and (url in optional_files or basename(url) in optional_files):
+                LOG.debug("optional: %r", url)
+                continue
+            required.add(url)
+            LOG.debug("required: %r", url)
+        self.required = frozenset(required)
+
+    def is_current(self):
+        """Check if the scanned directories have been modified. Adding,
+        removing or renaming entries updates the modification time of a
+        directory. Modifying the content of existing files is not detected
+        and does not need to be.
+
+        Args:
+            None
+
+        Returns:
+            bool: True if no modifications are detected otherwise False.
+        """
+        for d_name, inode, mtime in self._dirs:
+            try:
+                d_stat = stat(d_name)
+            except OSError:
+                return False
+            if d_stat.st_ino != inode or d_stat.st_mtime_ns != mtime:
+                return False
+        return True
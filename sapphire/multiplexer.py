@@ -0,0 +1,221 @@
+# coding=utf-8
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+Sapphire HTTP server job multiplexer
+"""
+from logging import getLogger
+from queue import Queue
+from socket import socketpair
+from threading import Event, Lock, Thread
+from traceback import format_exception
+
+from .connection_manager import ConnectionManager
+from .server_map import InvalidURLError, MapCollisionError, ServerMap
+from .worker import WorkerPool
+
+__all__ = ("JobMultiplexer",)
+__author__ = "Tyson Smith"
+__credits__ = ["Tyson Smith"]
+
+LOG = getLogger(__name__)
+
+
+class JobMultiplexer:
+    """JobMultiplexer serves multiple concurrent Jobs using a single listening
+    socket. Each Job is registered under a namespace (the first segment of the
+    URL path) and requests are routed to the Job of the namespace. Jobs keep
+    their own pending files, completion status and exceptions.
+
+    JobMultiplexer is used as the serv_job of the listener and the workers,
+    only the attributes used to manage connections are provided.
+
+    Attributes:
+        accepting (threading.Event): Listener can accept a connection.
+        auto_close (int): Used by error pages of requests without a Job.
+        exceptions (queue.Queue): Exceptions raised by the listener.
+        stats (ServeStats): Not used (Jobs record their own stats).
+        worker_complete (threading.Event): Set when a worker completes.
+    """
+
+    __slots__ = (
+        "_complete", "_jobs", "_listener", "_lock", "_owns_pool", "_pool", "_socket",
+        "_wakeup", "accepting", "auto_close", "exceptions", "stats", "worker_complete")
+
+    def __init__(self, sock, auto_close=-1, max_workers=10, pool=None):
+        self._complete = Event()
+        self._jobs = dict()  # namespace -> Job
+        self._listener = None
+        self._lock = Lock()
+        # a WorkerPool is required since workers are shared by all Jobs
+        self._owns_pool = pool is None
+        self._pool = WorkerPool(max_workers) if pool is None else pool
+        self._socket = sock
+        self._wakeup = None  # socket pair used to wake the listener
+        self.accepting = Event()
+        self.accepting.set()
+        self.auto_close = auto_close
+        self.exceptions = Queue()
+        self.stats = None
+        self.worker_complete = Event()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Stop the listener and finish all registered Jobs. Exceptions raised
+        by the listener are re-raised.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        self.finish()
+        if self._wakeup is not None:
+            # unblock the listener
+            self._wakeup[1].send(b"\x00")
+        if self._listener is not None:
+            self._listener.join()
+            self._listener = None
+        if self._wakeup is not None:
+            for wake_sock in self._wakeup:
+                wake_sock.close()
+            self._wakeup = None
+        if self._owns_pool:
+            self._pool.close()
+        if not self.exceptions.empty():
+            exc_type, exc_obj, exc_tb = self.exceptions.get()
+            LOG.error(
+                "Unexpected exception:\n%s",
+                "".join(format_exception(exc_type, exc_obj, exc_tb)))
+            raise exc_obj
+
+    def finish(self):
+        """Stop accepting connections and finish all registered Jobs.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        self._complete.set()
+        with self._lock:
+            jobs = tuple(self._jobs.values())
+        for job in jobs:
+            job.finish()
+
+    def is_complete(self, wait=None):
+        if wait is not None:
+            return self._complete.wait(wait)
+        return self._complete.is_set()
+
+    @property
+    def jobs(self):
+        """Number of registered Jobs.
+
+        Args:
+            None
+
+        Returns:
+            int: Registered Jobs.
+        """
+        with self._lock:
+            return len(self._jobs)
+
+    @property
+    def pending(self):
+        # number of pending files of all registered Jobs
+        with self._lock:
+            jobs = tuple(self._jobs.values())
+        return sum(x.pending for x in jobs)
+
+    def register(self, namespace, job):
+        """Route requests that start with namespace to job.
+
+        Args:
+            namespace (str): First segment of the URL path of requests to route.
+            job (Job): Job to handle requests.
+
+        Returns:
+            None
+        """
+        namespace = ServerMap._check_url(namespace)  # pylint: disable=protected-access
+        if not namespace:
+            raise InvalidURLError("namespace must not be empty")
+        with self._lock:
+            if namespace in self._jobs:
+                raise MapCollisionError("namespace %r is in use" % (namespace,))
+            self._jobs[namespace] = job
+        LOG.debug("registered job %r (%d active)", namespace, len(self._jobs))
+
+    def route(self, request):
+        """Find the Job that handles a request.
+
+        Args:
+            request (str): Unquoted request (without the leading "/").
+
+        Returns:
+            tuple(Job, str): Job and request with the namespace removed.
+                             Job is None if no active Job matches.
+        """
+        namespace, _, remainder = request.partition("/")
+        with self._lock:
+            job = self._jobs.get(namespace)
+        if job is None or job.is_complete():
+            return None, request
+        return job, remainder
+
+    def start(self):
+        """Start the listener.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        assert self._listener is None
+        self._pool.start()
+        self._wakeup = socketpair()
+        listener = Thread(
+            target=ConnectionManager.pool_listener,
+            args=(self._socket, self, self._pool),
+            kwargs={
+                "shutdown_delay": ConnectionManager.SHUTDOWN_DELAY,
+                "wake_sock": self._wakeup[0]})
+        listener.start()
+        self._listener = listener
+
+    def unregister(self, namespace):
+        """Stop routing requests to the Job registered under namespace.
+
+        Args:
+            namespace (str): Namespace of the Job.
+
+        Returns:
+            Job: Job that was registered or None.
+        """
+        with self._lock:
+            return self._jobs.pop(namespace.strip("/"), None)
+
+    def wake(self):
+        """Wake the threads waiting on registered Jobs.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        with self._lock:
+            jobs = tuple(self._jobs.values())
+        for job in jobs:
+            job.wake()
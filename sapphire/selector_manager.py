@@ -0,0 +1,415 @@
+# coding=utf-8
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+Sapphire HTTP server event loop
+"""
+from errno import EINVAL, ENOSYS, ENOTSOCK, EOPNOTSUPP
+from logging import getLogger
+from os import fstat
+from selectors import DefaultSelector, EVENT_READ, EVENT_WRITE
+from socket import error as sock_error, socketpair
+from tempfile import SpooledTemporaryFile
+from time import time
+
+from .stats import Timeline
+from .worker import Worker
+
+try:
+    from os import sendfile
+except ImportError:  # pragma: no cover
+    # not available on Windows
+    sendfile = None
+
+__author__ = "Tyson Smith"
+__credits__ = ["Tyson Smith"]
+
+LOG = getLogger(__name__)
+
+
+class _Client:
+    """State of a client connection handled by SelectorManager."""
+
+    __slots__ = (
+        "body", "body_remaining", "chunks", "conn", "in_fp", "in_size", "last_active", "offset",
+        "request", "response", "rx_buf", "timeline", "tx_buf", "zero_copy")
+
+    def __init__(self, conn):
+        self.body = None  # spooled body of the request that is being received
+        self.body_remaining = 0  # bytes of the body that have not been received
+        self.chunks = None  # encoded chunks of the response that is being sent
+        self.conn = conn
+        self.in_fp = None  # file that is being sent
+        self.in_size = 0  # size of file that is being sent
+        self.last_active = time()
+        self.offset = 0  # offset in file that is being sent
+        self.request = None  # header of the request that is being received
+        self.response = None  # response that is being sent
+        self.rx_buf = b""  # received data that has not been processed
+        self.timeline = Timeline(self.last_active)  # timeline of the current request
+        self.tx_buf = None  # data waiting to be sent
+        self.zero_copy = sendfile is not None  # use sendfile() to send files
+
+    def close(self):
+        if self.body is not None:
+            self.body.close()
+            self.body = None
+        if self.chunks is not None:
+            self.chunks.close()
+            self.chunks = None
+        if self.in_fp is not None:
+            self.in_fp.close()
+            self.in_fp = None
+        self.conn.close()
+
+
+class SelectorManager:
+    """SelectorManager is an alternative to ConnectionManager that handles all
+    client connections using non-blocking sockets and a single event loop.
+    The event loop is run by the thread that calls wait(), no additional
+    threads are created.
+    Request bodies are spooled (to disk once BODY_SPOOL_LIMIT is exceeded)
+    before the request is processed.
+    """
+    BODY_SPOOL_LIMIT = 0x100000  # 1MB
+
+    __slots__ = ("_clients", "_job", "_selector", "_sock_timeout", "_socket", "_wakeup")
+
+    def __init__(self, job, sock):
+        self._clients = dict()
+        self._job = job
+        self._selector = None
+        self._sock_timeout = None
+        self._socket = sock
+        self._wakeup = None  # socket pair used to wake the event loop
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _accept(self):
+        """Accept all pending connections.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        while True:
+            try:
+                conn, _ = self._socket.accept()
+            except (BlockingIOError, sock_error):
+                break
+            conn.setblocking(False)
+            Worker.set_nodelay(conn)
+            self._clients[conn] = _Client(conn)
+            self._selector.register(conn, EVENT_READ)
+
+    def _drop(self, client):
+        """Stop tracking and close a client connection.
+
+        Args:
+            client (_Client): Client to close.
+
+        Returns:
+            None
+        """
+        self._selector.unregister(client.conn)
+        self._clients.pop(client.conn, None)
+        client.close()
+
+    def _next_response(self, client):
+        """Prepare a response if a complete request has been received.
+
+        Args:
+            client (_Client): Client to process.
+
+        Returns:
+            bool: True if a response was prepared otherwise False.
+        """
+        if client.request is None:
+            if not client.rx_buf:
+                return False
+            end = Worker.header_end(client.rx_buf)
+            if end is None:
+                # wait for the remainder of the header
+                return False
+            client.request = client.rx_buf[:end]
+            client.rx_buf = client.rx_buf[end:]
+            length = Worker.body_length(client.request)
+            if length is not None:
+                client.body = SpooledTemporaryFile(max_size=self.BODY_SPOOL_LIMIT)
+                client.body_remaining = length
+        if client.body is not None:
+            if client.body_remaining > 0:
+                data = client.rx_buf[:client.body_remaining]
+                client.rx_buf = client.rx_buf[len(data):]
+                client.body.write(data)
+                client.body_remaining -= len(data)
+                if client.body_remaining > 0:
+                    # wait for the remainder of the body
+                    return False
+            client.body.seek(0)
+        raw_request = client.request
+        client.request = None
+        client.timeline.parsed = time()
+        try:
+            client.response = Worker.prepare_response(raw_request, self._job, body=client.body)
+        finally:
+            if client.body is not None:
+                client.body.close()
+                client.body = None
+        client.timeline.resolved = time()
+        client.chunks = client.response.chunks
+        if client.response.body:
+            client.tx_buf = memoryview(client.response.header + client.response.body)
+        else:
+            client.tx_buf = memoryview(client.response.header)
+        if client.response.path is not None:
+            client.in_fp = open(client.response.path, "rb")
+            client.in_size = fstat(client.in_fp.fileno()).st_size
+            client.offset = 0
+        elif client.response.fp is not None:
+            client.in_fp = client.response.fp
+            client.in_size = client.response.size
+            client.offset = 0
+        self._selector.modify(client.conn, EVENT_WRITE)
+        return True
+
+    def _on_readable(self, client):
+        """Receive data from a client.
+
+        Args:
+            client (_Client): Client to receive data from.
+
+        Returns:
+            None
+        """
+        if client.body_remaining > Worker.DEFAULT_RX_SIZE:
+            # receive the body of a request using larger reads
+            data = client.conn.recv(min(client.body_remaining, Worker.DEFAULT_TX_SIZE))
+        else:
+            data = client.conn.recv(Worker.DEFAULT_RX_SIZE)
+        if not data:
+            LOG.debug("connection closed by client")
+            self._drop(client)
+            return
+        client.last_active = time()
+        client.rx_buf += data
+        self._next_response(client)
+
+    def _on_writable(self, client):
+        """Send pending response data to a client.
+
+        Args:
+            client (_Client): Client to send data to.
+
+        Returns:
+            None
+        """
+        client.last_active = time()
+        if not client.tx_buf and client.chunks is not None:
+            chunk = next(client.chunks, None)
+            if chunk is None:
+                client.chunks = None
+            else:
+                client.tx_buf = memoryview(chunk)
+        if not client.tx_buf and client.in_fp is not None:
+            if self._send_file(client):
+                return
+            client.in_fp.close()
+            client.in_fp = None
+        if client.tx_buf:
+            sent = client.conn.send(client.tx_buf)
+            client.tx_buf = client.tx_buf[sent:]
+            client.timeline.sent += sent
+            if client.timeline.first_byte is None:
+                client.timeline.first_byte = client.last_active
+            return
+        # response is complete
+        response = client.response
+        client.response = None
+        client.tx_buf = None
+        if response.served is not None:
+            self._job.increment_served(response.served)
+        if self._job.stats is not None:
+            client.timeline.complete = client.last_active
+            client.timeline.target = response.served
+            self._job.stats.record(client.timeline)
+        # the next request on a persistent connection starts now
+        client.timeline = Timeline(client.last_active)
+        if response.finish:
+            self._drop(client)
+            self._job.finish()
+        elif not response.keep_alive:
+            self._drop(client)
+        elif not self._next_response(client):
+            # wait for the next request
+            self._selector.modify(client.conn, EVENT_READ)
+
+    @staticmethod
+    def _send_file(client):
+        """Send data from the file that is being served. sendfile() is used to
+        avoid copying data when possible otherwise data is read from the file
+        and queued.
+
+        Args:
+            client (_Client): Client to send data to.
+
+        Returns:
+            bool: False if the end of the file has been reached otherwise True.
+        """
+        if client.offset >= client.in_size:
+            return False
+        try:
+            in_fd = client.in_fp.fileno()
+        except (AttributeError, OSError):
+            # content is not backed by a file (see Response.fp)
+            in_fd = None
+        if client.zero_copy and in_fd is not None:
+            try:
+                sent = sendfile(
+                    client.conn.fileno(),
+                    in_fd,
+                    client.offset,
+                    client.in_size - client.offset)
+            except OSError as exc:
+                if exc.errno not in (EINVAL, ENOSYS, ENOTSOCK, EOPNOTSUPP):
+                    raise
+                LOG.debug("sendfile() failed (%r), using fallback", exc)
+                client.zero_copy = False
+            else:
+                # zero indicates the file is shorter than expected
+                client.offset += sent
+                client.timeline.sent += sent
+                return sent > 0
+        client.in_fp.seek(client.offset)
+        data = client.in_fp.read(Worker.DEFAULT_TX_SIZE)
+        if not data:
+            return False
+        client.offset += len(data)
+        client.tx_buf = memoryview(data)
+        return True
+
+    def _service(self, client, mask):
+        """Handle an event for a client connection.
+
+        Args:
+            client (_Client): Client that is ready.
+            mask (int): Selector event mask.
+
+        Returns:
+            None
+        """
+        try:
+            if mask & EVENT_READ:
+                self._on_readable(client)
+            elif mask & EVENT_WRITE:
+                self._on_writable(client)
+        except BlockingIOError:
+            pass
+        except sock_error as exc:
+            LOG.debug("%r", exc)
+            if client.response is not None and client.response.finish:
+                self._job.finish()
+            self._drop(client)
+
+    def _sweep_idle(self, now):
+        """Close persistent connections that have been idle for too long.
+
+        Args:
+            now (float): Current time.
+
+        Returns:
+            None
+        """
+        limit = now - Worker.KEEP_ALIVE_TIMEOUT
+        for client in tuple(self._clients.values()):
+            if client.response is None and client.last_active < limit:
+                LOG.debug("closing idle connection")
+                self._drop(client)
+
+    def close(self):
+        self._job.finish()
+        if self._selector is not None:
+            for client in tuple(self._clients.values()):
+                self._drop(client)
+            self._selector.close()
+            self._selector = None
+            self._socket.settimeout(self._sock_timeout)
+            for wake_sock in self._wakeup:
+                wake_sock.close()
+            self._wakeup = None
+
+    def start(self):
+        assert self._job.pending
+        self._sock_timeout = self._socket.gettimeout()
+        self._socket.setblocking(False)
+        self._selector = DefaultSelector()
+        self._selector.register(self._socket, EVENT_READ)
+        self._wakeup = socketpair()
+        for wake_sock in self._wakeup:
+            wake_sock.setblocking(False)
+        self._selector.register(self._wakeup[0], EVENT_READ)
+
+    def wait(self, timeout, continue_cb=None, poll=0.5):
+        assert self._selector is not None
+        if timeout > 0:
+            deadline = time() + timeout
+        else:
+            deadline = None
+        if continue_cb is not None and not callable(continue_cb):
+            raise TypeError("continue_cb must be callable")
+        next_poll = time() + poll
+        while not self._job.is_complete():
+            now = time()
+            # check for a timeout
+            if deadline and deadline <= now:
+                return False
+            if next_poll <= now:
+                # check if callback returns False
+                if continue_cb is not None and not continue_cb():
+                    LOG.debug("continue_cb() returned False")
+                    break
+                self._sweep_idle(now)
+                next_poll = now + poll
+            wake = min(next_poll, deadline) if deadline else next_poll
+            for key, mask in self._selector.select(timeout=max(wake - now, 0)):
+                if key.fileobj is self._socket:
+                    self._accept()
+                elif key.fileobj is self._wakeup[0]:
+                    # drain pending wake requests and check continue_cb
+                    try:
+                        while self._wakeup[0].recv(64):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    next_poll = 0
+                else:
+                    self._service(self._clients[key.fileobj], mask)
+                if self._job.is_complete():
+                    break
+        return True
+
+    def wake(self):
+        """Wake the event loop to check the job and call continue_cb.
+        This can be called from any thread.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        wakeup = self._wakeup
+        if wakeup is not None:
+            try:
+                wakeup[1].send(b"\x00")
+            except (BlockingIOError, sock_error):
+                # a wake request is already pending or the loop is closed
+                pass
@@ -27,10 +27,14 @@ class Resource:
     URL_FILE = 1
     URL_INCLUDE = 2
     URL_REDIRECT = 3
+    URL_DATA = 4  # content is supplied by the provider of the Job
+    URL_UPLOAD = 5  # body of POST requests is passed to a sink
 
-    __slots__ = ("mime", "required", "target", "type")
+    __slots__ = ("max_age", "mime", "required", "target", "type")
 
-    def __init__(self, resource_type, target, mime=None, required=False):
+    def __init__(self, resource_type, target, max_age=None, mime=None, required=False):
+        # max_age is only used by includes, None indicates the resource is not cacheable
+        self.max_age = max_age
         self.mime = mime
         self.required = required
         self.target = target
@@ -38,12 +42,13 @@ class Resource:
 
 
 class ServerMap:
-    __slots__ = ("dynamic", "include", "redirect")
+    __slots__ = ("dynamic", "include", "redirect", "upload")
 
     def __init__(self):
         self.dynamic = dict()
         self.include = dict()  # mapping of directories that can be requested
         self.redirect = dict()  # document paths to map to file names using 307s
+        self.upload = dict()  # document paths that accept POST requests
 
     @staticmethod
     def _check_url(url):
@@ -59,7 +64,7 @@ class ServerMap:
             raise TypeError("callback must be callable")
         if not isinstance(mime_type, str):
             raise TypeError("mime_type must be of type 'str'")
-        if url in self.include or url in self.redirect:
+        if url in self.include or url in self.redirect or url in self.upload:
             raise MapCollisionError("URL collision on %r" % (url,))
         LOG.debug("mapping dynamic response %r -> %r (%r)", url, callback, mime_type)
         self.dynamic[url] = Resource(
@@ -68,11 +73,15 @@ class ServerMap:
             mime=mime_type,
             required=required)
 
-    def set_include(self, url, target_path):
+    def set_include(self, url, target_path, cacheable=False, max_age=0):
+        # files from cacheable includes are sent with a strong ETag and can be
+        # used by the client for max_age seconds without revalidation
         url = self._check_url(url)
+        if not isinstance(max_age, int) or max_age < 0:
+            raise TypeError("max_age must be an 'int' >= 0")
         if not isdir(target_path):
             raise IOError("Include path not found: %s" % (target_path,))
-        if url in self.dynamic or url in self.redirect:
+        if url in self.dynamic or url in self.redirect or url in self.upload:
             raise MapCollisionError("URL collision on %r" % (url,))
         target_path = abspath(target_path)
         # sanity check to prevent mapping overlapping paths
@@ -92,7 +101,8 @@ class ServerMap:
         LOG.debug("mapping include %r -> %r", url, target_path)
         self.include[url] = Resource(
             Resource.URL_INCLUDE,
-            target_path)
+            target_path,
+            max_age=max_age if cacheable else None)
 
     def set_redirect(self, url, target, required=True):
         url = self._check_url(url)
@@ -100,9 +110,28 @@ class ServerMap:
             raise TypeError("target must be of type 'str'")
         if not target:
             raise TypeError("target must not be an empty string")
-        if url in self.dynamic or url in self.include:
+        if url in self.dynamic or url in self.include or url in self.upload:
             raise MapCollisionError("URL collision on %r" % (url,))
         self.redirect[url] = Resource(
             Resource.URL_REDIRECT,
             target,
             required=required)
+
+    def set_upload(self, url, sink, mime_type="text/plain", required=False):
+        # the body of POST requests is streamed to the sink as it is received
+        # sink is either a callback that is passed a file-like object (the body)
+        # and returns the response data ('bytes' or None) or the path of a file
+        # that the body is written to (replaced by each request)
+        url = self._check_url(url)
+        if not callable(sink) and not isinstance(sink, str):
+            raise TypeError("sink must be callable or of type 'str'")
+        if not isinstance(mime_type, str):
+            raise TypeError("mime_type must be of type 'str'")
+        if url in self.dynamic or url in self.include or url in self.redirect:
+            raise MapCollisionError("URL collision on %r" % (url,))
+        LOG.debug("mapping upload %r -> %r", url, sink)
+        self.upload[url] = Resource(
+            Resource.URL_UPLOAD,
+            sink if callable(sink) else abspath(sink),
+            mime=mime_type,
+            required=required)
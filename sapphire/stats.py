@@ -0,0 +1,183 @@
+# coding=utf-8
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+Sapphire HTTP server request instrumentation
+"""
+from bisect import bisect_left
+from threading import Lock
+
+__all__ = ("Histogram", "ServeStats", "Timeline")
+__author__ = "Tyson Smith"
+__credits__ = ["Tyson Smith"]
+
+
+class Timeline:
+    """Timestamps (from time.time()) recorded while handling a single request.
+
+    Attributes:
+        accepted (float): Connection was accepted or the previous response on
+                          a persistent connection was complete.
+        complete (float): Response was sent.
+        first_byte (float): Response header was sent.
+        parsed (float): Request was received and parsed.
+        resolved (float): Response was prepared.
+        sent (int): Number of bytes sent.
+        target (str): File that was served (None if the response was not a file).
+    """
+
+    __slots__ = ("accepted", "complete", "first_byte", "parsed", "resolved", "sent", "target")
+
+    def __init__(self, accepted):
+        self.accepted = accepted
+        self.complete = None
+        self.first_byte = None
+        self.parsed = None
+        self.resolved = None
+        self.sent = 0
+        self.target = None
+
+
+class Histogram:
+    """Histogram of durations using logarithmic buckets.
+
+    Attributes:
+        buckets (list(int)): Number of values in each bucket.
+        count (int): Number of values added.
+        max (float): Largest value added.
+        min (float): Smallest value added.
+        total (float): Sum of values added.
+    """
+    # upper bounds of the buckets in seconds (100us to ~100s), the last bucket
+    # holds everything larger
+    BOUNDS = tuple(0.0001 * 2 ** x for x in range(21))
+
+    __slots__ = ("buckets", "count", "max", "min", "total")
+
+    def __init__(self):
+        self.buckets = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.max = 0
+        self.min = 0
+        self.total = 0
+
+    def add(self, value):
+        """Add a value to the histogram.
+
+        Args:
+            value (float): Duration in seconds.
+
+        Returns:
+            None
+        """
+        self.buckets[bisect_left(self.BOUNDS, value)] += 1
+        if self.count == 0 or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.count += 1
+        self.total += value
+
+    def merge(self, other):
+        """Add the values of another histogram.
+
+        Args:
+            other (Histogram): Histogram to add.
+
+        Returns:
+            None
+        """
+        assert len(other.buckets) == len(self.buckets)
+        if other.count < 1:
+            return
+        for idx, count in enumerate(other.buckets):
+            self.buckets[idx] += count
+        if self.count == 0 or other.min < self.min:
+            self.min = other.min
+        if other.max > self.max:
+            self.max = other.max
+        self.count += other.count
+        self.total += other.total
+
+    def percentile(self, pct):
+        """Calculate an approximate percentile. The result is the upper bound of
+        the bucket that contains the percentile (limited to the maximum value).
+
+        Args:
+            pct (float): Percentile to calculate (0-100).
+
+        Returns:
+            float: Approximate value at the percentile.
+        """
+        assert 0 <= pct <= 100
+        if self.count == 0:
+            return 0
+        target = max(pct * self.count / 100.0, 1)
+        seen = 0
+        for bound, count in zip(self.BOUNDS, self.buckets):
+            seen += count
+            if seen >= target:
+                return min(bound, self.max)
+        return self.max
+
+
+class ServeStats:
+    """ServeStats aggregates the Timelines of the requests handled while
+    serving. It can be shared by multiple Jobs and is thread safe.
+
+    Attributes:
+        requests (int): Number of requests handled.
+        sent (int): Number of bytes sent.
+        timelines (list(Timeline)): Recorded Timelines (if keep_timelines is set).
+    """
+    # phases of a request that are tracked (name, start, end)
+    PHASES = (
+        ("wait", "accepted", "parsed"),  # waiting for and receiving the request
+        ("resolve", "parsed", "resolved"),  # processing the request
+        ("first_byte", "accepted", "first_byte"),  # time to first byte
+        ("transfer", "first_byte", "complete"),  # sending the response
+        ("total", "accepted", "complete"),
+    )
+
+    __slots__ = ("_histograms", "_keep", "_lock", "requests", "sent", "timelines")
+
+    def __init__(self, keep_timelines=False):
+        self._histograms = {name: Histogram() for name, _, _ in self.PHASES}
+        self._keep = keep_timelines
+        self._lock = Lock()
+        self.requests = 0
+        self.sent = 0
+        self.timelines = list()
+
+    def histograms(self):
+        """Histograms of the duration of each phase of handling a request.
+
+        Args:
+            None
+
+        Yields:
+            tuple(str, Histogram): Phase name and histogram.
+        """
+        for name, _, _ in self.PHASES:
+            yield name, self._histograms[name]
+
+    def record(self, timeline):
+        """Add a complete request Timeline.
+
+        Args:
+            timeline (Timeline): Timeline to add.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            for name, start, end in self.PHASES:
+                start = getattr(timeline, start)
+                end = getattr(timeline, end)
+                if start is not None and end is not None:
+                    self._histograms[name].add(max(end - start, 0))
+            self.requests += 1
+            self.sent += timeline.sent
+            if self._keep:
+                self.timelines.append(timeline)
@@ -0,0 +1,64 @@
+# coding=utf-8
+"""
+Sapphire benchmark unit tests
+"""
+# pylint: disable=protected-access
+
+from json import load
+from threading import Thread
+
+from .benchmark import LoadGenerator, main, percentile, run_scenario, SCENARIOS
+from .core import Sapphire
+
+
+def test_benchmark_01():
+    """test percentile()"""
+    assert percentile([], 50) == 0
+    assert percentile([1], 99) == 1
+    values = list(range(1, 101))
+    assert percentile(values, 0) == 1
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile(values, 100) == 100
+
+def test_benchmark_02(tmp_path):
+    """test LoadGenerator"""
+    (tmp_path / "index.html").write_bytes(b"a")
+    with Sapphire(timeout=10) as serv:
+        loadgen = LoadGenerator(serv.port, ["missing", "index.html"], clients=2, requests=5)
+        thread = Thread(target=loadgen.run)
+        thread.start()
+        try:
+            serv.serve_path(str(tmp_path), forever=True, continue_cb=thread.is_alive)
+        finally:
+            thread.join()
+    assert loadgen.errors == 0
+    assert len(loadgen.latencies) == 5
+    assert loadgen.received > 0
+
+def test_benchmark_03(tmp_path):
+    """test scenarios"""
+    for scenario in SCENARIOS.values():
+        if scenario.name == "huge":
+            # avoid writing large files to disk
+            continue
+        path = tmp_path / scenario.name
+        path.mkdir()
+        urls = scenario.create(str(path))
+        assert urls
+        assert (path / "index.html").is_file()
+        if scenario.server_map is not None:
+            assert scenario.server_map(str(path)) is not None
+
+def test_benchmark_04(tmp_path):
+    """test run_scenario() and main()"""
+    result = run_scenario("redirects", clients=2, requests=10)
+    assert result["errors"] == 0
+    assert result["requests"] == 10
+    assert result["rps"] > 0
+    assert result["scenario"] == "redirects"
+    output = tmp_path / "results.json"
+    assert main(["--requests", "5", "--scenario", "missing", "--output", str(output)]) == 0
+    assert main(["--requests", "5", "--scenario", "missing", "--baseline", str(output)]) == 0
+    with output.open() as in_fp:
+        assert load(in_fp)[0]["scenario"] == "missing"
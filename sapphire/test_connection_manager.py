@@ -5,12 +5,13 @@ ConnectionManager unit tests
 # pylint: disable=protected-access
 
 from socket import socket
-from threading import ThreadError
+from threading import ThreadError, Timer
 
 from pytest import raises
 
 from .connection_manager import ConnectionManager
 from .job import Job
+from .worker import WorkerPool
 
 
 def test_connection_manager_01(mocker, tmp_path):
@@ -18,7 +19,8 @@ def test_connection_manager_01(mocker, tmp_path):
     (tmp_path / "testfile").write_bytes(b"test")
     job = Job(str(tmp_path))
     clnt_sock = mocker.Mock(spec=socket)
-    clnt_sock.recv.return_value = b"GET /testfile HTTP/1.1"
+    clnt_sock.recv.return_value = b"GET /testfile HTTP/1.1\r\n\r\n"
+    clnt_sock.sendfile.return_value = 4
     serv_sock = mocker.Mock(spec=socket)
     serv_sock.accept.return_value = (clnt_sock, None)
     assert not job.is_complete()
@@ -49,15 +51,16 @@ def test_connection_manager_03(mocker, tmp_path):
     (tmp_path / "test3").touch()
     job = Job(str(tmp_path))
     clnt_sock = mocker.Mock(spec=socket)
+    clnt_sock.sendfile.return_value = 0
     clnt_sock.recv.side_effect = (
-        b"GET /test1 HTTP/1.1",
-        b"GET /missing HTTP/1.1",
+        b"GET /test1 HTTP/1.1\r\n\r\n",
+        b"GET /missing HTTP/1.1\r\n\r\n",
         b"badrequest",
         b"",
-        b"GET /test2 HTTP/1.1",
-        b"GET /test1 HTTP/1.1",
-        b"GET /test1 HTTP/1.1",
-        b"GET /test3 HTTP/1.1")
+        b"GET /test2 HTTP/1.1\r\n\r\n",
+        b"GET /test1 HTTP/1.1\r\n\r\n",
+        b"GET /test1 HTTP/1.1\r\n\r\n",
+        b"GET /test3 HTTP/1.1\r\n\r\n")
     serv_sock = mocker.Mock(spec=socket)
     serv_sock.accept.return_value = (clnt_sock, None)
     assert not job.is_complete()
@@ -113,3 +116,82 @@ def test_connection_manager_06(mocker, tmp_path):
             loadmgr.wait(1)
     assert job.is_complete()
     assert job.exceptions.empty()
+
+def test_connection_manager_07(mocker, tmp_path):
+    """test ConnectionManager using a WorkerPool"""
+    mocker.patch(
+        "sapphire.connection_manager.select",
+        autospec=True,
+        side_effect=lambda rlist, *_: (rlist[:1], [], []))
+    (tmp_path / "test1").touch()
+    (tmp_path / "test2").touch()
+    clnt_sock = mocker.Mock(spec=socket)
+    clnt_sock.sendfile.return_value = 0
+    serv_sock = mocker.Mock(spec=socket)
+    serv_sock.accept.side_effect = ((clnt_sock, None), OSError, (clnt_sock, None))
+    clnt_sock.recv.side_effect = (b"GET /test1 HTTP/1.1\r\n\r\n", b"GET /test2 HTTP/1.1\r\n\r\n")
+    with WorkerPool(2) as pool:
+        job = Job(str(tmp_path))
+        with ConnectionManager(job, serv_sock, pool=pool) as loadmgr:
+            assert loadmgr.wait(10)
+        assert job.is_complete()
+        assert job.exceptions.empty()
+        assert clnt_sock.close.call_count == 2
+        assert pool.handled == 2
+        # pool is reused by next job
+        serv_sock.accept.side_effect = ((clnt_sock, None),)
+        clnt_sock.recv.side_effect = (b"GET /test1 HTTP/1.1\r\n\r\n",)
+        job = Job(str(tmp_path), optional_files=["test2"])
+        with ConnectionManager(job, serv_sock, pool=pool) as loadmgr:
+            assert loadmgr.wait(10)
+        assert pool.handled == 3
+        assert pool.size == 2
+
+def test_connection_manager_08(mocker, tmp_path):
+    """test ConnectionManager using a WorkerPool re-raise listener exceptions"""
+    mocker.patch(
+        "sapphire.connection_manager.select",
+        autospec=True,
+        side_effect=lambda rlist, *_: (rlist[:1], [], []))
+    (tmp_path / "test1").touch()
+    serv_sock = mocker.Mock(spec=socket)
+    serv_sock.accept.side_effect = Exception("listener exception")
+    with WorkerPool(1) as pool:
+        job = Job(str(tmp_path))
+        with raises(Exception, match="listener exception"):
+            with ConnectionManager(job, serv_sock, pool=pool) as loadmgr:
+                loadmgr.wait(1)
+    assert job.is_complete()
+
+def test_connection_manager_09(mocker, tmp_path):
+    """test ConnectionManager.wait() is woken by ConnectionManager.wake()"""
+    (tmp_path / "test1").touch()
+    serv_sock = mocker.Mock(spec=socket)
+    serv_sock.accept.side_effect = OSError
+    mocker.patch(
+        "sapphire.connection_manager.select",
+        autospec=True,
+        side_effect=lambda rlist, *_: (rlist[:1], [], []))
+    with WorkerPool(1) as pool:
+        job = Job(str(tmp_path))
+        with ConnectionManager(job, serv_sock, pool=pool) as loadmgr:
+            # continue_cb is only called after wake() since poll is large
+            callback = mocker.Mock(return_value=False)
+            timer = Timer(0.1, loadmgr.wake)
+            timer.start()
+            try:
+                assert loadmgr.wait(60, continue_cb=callback, poll=60)
+            finally:
+                timer.join()
+            assert callback.call_count == 1
+        assert job.is_complete()
+    # job completion wakes wait()
+    job = Job(str(tmp_path))
+    loadmgr = ConnectionManager(job, serv_sock)
+    loadmgr._listener = mocker.Mock()
+    timer = Timer(0.1, job.finish)
+    timer.start()
+    try:
+        assert loadmgr.wait(60, poll=60)
+    finally:
+        timer.join()
@@ -8,7 +8,7 @@ import platform
 
 import pytest
 
-from .job import Job, SERVED_ALL, SERVED_NONE, SERVED_REQUEST
+from .job import Job, JobTemplate, SERVED_ALL, SERVED_NONE, SERVED_REQUEST
 from .server_map import Resource, ServerMap
 
 
@@ -247,3 +247,122 @@ def test_job_11():
     assert Job.lookup_mime("test.avif") == "image/avif"
     # look up known ext
     assert Job.lookup_mime("test.html") == "text/html"
+    assert Job.lookup_mime("test.HTML") == "text/html"
+    # look up ext that depends on previous ext
+    assert Job.lookup_mime("test.js.gz") == Job.lookup_mime("test.js")
+
+def test_job_12(mocker, tmp_path):
+    """test Job.check_request() using index"""
+    srv_root = tmp_path / "root"
+    (srv_root / "sub").mkdir(parents=True)
+    (srv_root / "sub" / "test.html").write_bytes(b"a")
+    (srv_root / "opt.js").write_bytes(b"b")
+    inc_a = tmp_path / "inc_a"
+    inc_a.mkdir()
+    inc_b = tmp_path / "inc_b"
+    inc_b.mkdir()
+    smap = ServerMap()
+    smap.include["a"] = Resource(Resource.URL_INCLUDE, str(inc_a))
+    smap.include["a/b"] = Resource(Resource.URL_INCLUDE, str(inc_b), mime="text/plain")
+    job = Job(str(srv_root), optional_files=["opt.js"], server_map=smap)
+    fake_isfile = mocker.patch("sapphire.job.isfile", autospec=True, return_value=True)
+    # indexed files (only checked for existence)
+    resource = job.check_request("sub/test.html?x=1")
+    assert resource.type == Resource.URL_FILE
+    assert resource.target == str(srv_root / "sub" / "test.html")
+    assert resource.mime == "text/html"
+    assert resource.required
+    resource = job.check_request("opt.js")
+    assert resource.type == Resource.URL_FILE
+    assert not resource.required
+    assert fake_isfile.call_count == 2
+    # request that is not normalized
+    resource = job.check_request("sub/../opt.js")
+    assert resource.type == Resource.URL_FILE
+    assert resource.target == str(srv_root / "opt.js")
+    assert fake_isfile.call_count == 3
+    # longest include match
+    fake_isfile.return_value = False
+    resource = job.check_request("a/b/c/file.js")
+    assert resource.type == Resource.URL_INCLUDE
+    assert resource.target == str(inc_b / "c" / "file.js")
+    assert resource.mime == "text/plain"
+    resource = job.check_request("a/c/file.js")
+    assert resource.type == Resource.URL_INCLUDE
+    assert resource.target == str(inc_a / "c" / "file.js")
+    assert resource.mime == Job.lookup_mime("file.js")
+    # include mapping only
+    assert job.check_request("a") is None
+    assert not job.is_forbidden(str(inc_b / "c" / "file.js"))
+    assert job.is_forbidden(str(tmp_path / "file.js"))
+
+def test_job_13(tmp_path):
+    """test JobTemplate"""
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "test.html").write_bytes(b"a")
+    (tmp_path / "opt.js").write_bytes(b"b")
+    template = JobTemplate(str(tmp_path), optional_files=["opt.js"])
+    assert template.is_current()
+    assert template.required == frozenset((str(tmp_path / "sub" / "test.html"),))
+    assert "opt.js" in template.files
+    assert "sub/test.html" in template.files
+    # create multiple jobs from a template
+    job_a = Job(str(tmp_path), template=template)
+    job_b = Job(str(tmp_path), template=template)
+    assert job_a.pending == 1
+    assert job_a.remove_pending(str(tmp_path / "sub" / "test.html"))
+    assert job_b.pending == 1
+    assert job_b.check_request("opt.js").type == Resource.URL_FILE
+    # modify content of existing file
+    (tmp_path / "opt.js").write_bytes(b"bb")
+    assert template.is_current()
+    # add file to sub directory
+    (tmp_path / "sub" / "new.html").write_bytes(b"c")
+    assert not template.is_current()
+    # remove directory
+    template = JobTemplate(str(tmp_path))
+    (tmp_path / "sub" / "new.html").unlink()
+    (tmp_path / "sub" / "test.html").unlink()
+    (tmp_path / "sub").rmdir()
+    assert not template.is_current()
+    # missing directory
+    with pytest.raises(OSError, match="does not exist"):
+        JobTemplate(str(tmp_path / "missing"))
+
+def test_job_14(mocker, tmp_path):
+    """test Job with a provider"""
+    provider = mocker.Mock(**{"files.return_value": ("a.html", "sub/b.js", "sub/opt.js")})
+    job = Job(None, optional_files=["opt.js"], provider=provider)
+    assert job.base_path is None
+    assert job.pending == 2
+    resource = job.check_request("a.html")
+    assert resource.type == Resource.URL_DATA
+    assert resource.target == "a.html"
+    assert resource.mime == "text/html"
+    assert resource.required
+    # request that is not normalized
+    assert job.check_request("sub/../sub/b.js").target == "sub/b.js"
+    assert not job.check_request("sub/opt.js").required
+    # the filesystem is not used
+    (tmp_path / "c.html").touch()
+    assert job.check_request(str(tmp_path / "c.html")) is None
+    assert job.check_request("missing.html") is None
+    assert job.is_forbidden(str(tmp_path / "c.html"))
+    assert not job.remove_pending("a.html")
+    job.increment_served("a.html")
+    assert job.remove_pending("sub/b.js")
+    job.increment_served("sub/b.js")
+    assert job.status == SERVED_ALL
+    assert set(job.served) == {"a.html", "sub/b.js"}
+
+def test_job_15(tmp_path):
+    """test Job.check_request() with an indexed file that has been removed"""
+    (tmp_path / "a.html").write_bytes(b"a")
+    (tmp_path / "b.html").write_bytes(b"b")
+    job = Job(str(tmp_path))
+    assert job.pending == 2
+    (tmp_path / "a.html").unlink()
+    assert job.check_request("a.html") is None
+    assert job.check_request("b.html").type == Resource.URL_FILE
+    # the file is still pending
+    assert job.pending == 2
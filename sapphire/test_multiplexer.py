@@ -0,0 +1,99 @@
+# coding=utf-8
+"""
+JobMultiplexer unit tests
+"""
+# pylint: disable=protected-access
+
+from socket import socket
+
+from pytest import raises
+
+from .job import Job
+from .multiplexer import JobMultiplexer
+from .server_map import InvalidURLError, MapCollisionError
+from .worker import Worker, WorkerPool
+
+
+def test_multiplexer_01(mocker, tmp_path):
+    """test JobMultiplexer.register(), route() and unregister()"""
+    (tmp_path / "test.html").touch()
+    mux = JobMultiplexer(mocker.Mock(spec=socket), pool=mocker.Mock(spec=WorkerPool))
+    job_a = Job(str(tmp_path))
+    job_b = Job(str(tmp_path))
+    mux.register("/a/", job_a)
+    mux.register("b", job_b)
+    assert mux.jobs == 2
+    assert mux.pending == 2
+    with raises(MapCollisionError, match="namespace 'a' is in use"):
+        mux.register("a", job_b)
+    with raises(InvalidURLError, match="namespace must not be empty"):
+        mux.register("/", job_b)
+    with raises(InvalidURLError):
+        mux.register("a/b", job_b)
+    assert mux.route("a/test.html") == (job_a, "test.html")
+    assert mux.route("b/x/test.html") == (job_b, "x/test.html")
+    assert mux.route("b") == (job_b, "")
+    assert mux.route("c/test.html") == (None, "c/test.html")
+    # complete jobs are not routed
+    job_b.finish()
+    assert mux.route("b/test.html") == (None, "b/test.html")
+    assert mux.unregister("b") is job_b
+    assert mux.unregister("b") is None
+    assert mux.jobs == 1
+    # finish() completes registered jobs
+    mux.finish()
+    assert mux.is_complete()
+    assert job_a.is_complete()
+
+def test_multiplexer_02(mocker, tmp_path):
+    """test Worker.prepare_response() using a JobMultiplexer"""
+    (tmp_path / "test.html").write_bytes(b"a")
+    mux = JobMultiplexer(mocker.Mock(spec=socket), auto_close=1, pool=mocker.Mock(spec=WorkerPool))
+    job = Job(str(tmp_path))
+    mux.register("a", job)
+    mux.accepting.clear()
+    # request without a job
+    response = Worker.prepare_response(b"GET /test.html HTTP/1.1\r\n\r\n", mux)
+    assert response.header.startswith(b"HTTP/1.1 404 Not Found")
+    assert b"window.close" in response.header
+    assert response.job is None
+    assert mux.accepting.is_set()
+    # request handled by a job
+    mux.accepting.clear()
+    response = Worker.prepare_response(b"GET /a/test.html HTTP/1.1\r\n\r\n", mux)
+    assert response.header.startswith(b"HTTP/1.1 200 OK")
+    assert response.finish
+    assert response.job is job
+    assert response.path == str(tmp_path / "test.html")
+    assert mux.accepting.is_set()
+    assert not mux.is_complete()
+
+def test_multiplexer_03(mocker, tmp_path):
+    """test JobMultiplexer listener with WorkerPool"""
+    mocker.patch(
+        "sapphire.connection_manager.select",
+        autospec=True,
+        side_effect=lambda rlist, *_: (rlist[:1], [], []))
+    (tmp_path / "test.html").touch()
+    clnt_sock = mocker.Mock(spec=socket)
+    clnt_sock.recv.side_effect = (b"GET /a/test.html HTTP/1.1\r\n\r\n", b"GET /b/test.html HTTP/1.1\r\n\r\n")
+    clnt_sock.sendfile.return_value = 0
+    serv_sock = mocker.Mock(spec=socket)
+    conns = [(clnt_sock, None), (clnt_sock, None)]
+    def _accept():
+        if not conns:
+            raise OSError()
+        return conns.pop()
+    serv_sock.accept.side_effect = _accept
+    job_a = Job(str(tmp_path))
+    job_b = Job(str(tmp_path))
+    mux = JobMultiplexer(serv_sock, max_workers=1)
+    mux.register("a", job_a)
+    mux.register("b", job_b)
+    with mux:
+        assert job_a.is_complete(wait=10)
+        assert job_b.is_complete(wait=10)
+        assert tuple(job_a.served) == ("test.html",)
+        assert tuple(job_b.served) == ("test.html",)
+        assert not mux.is_complete()
+    assert mux.is_complete()
@@ -5,6 +5,8 @@ Sapphire unit tests
 # pylint: disable=protected-access
 
 import hashlib
+import http.client
+import io
 import os
 import random
 import socket
@@ -16,6 +18,7 @@ from .core import Sapphire
 from .job import SERVED_ALL, SERVED_NONE, SERVED_REQUEST, SERVED_TIMEOUT
 from .worker import Worker
 from .server_map import ServerMap
+from .stats import ServeStats
 
 
 class _TestFile:
@@ -56,12 +59,13 @@ def test_sapphire_00(client, tmp_path):
     assert test.code == 200
     assert test.len_srv == test.len_org
 
-def test_sapphire_01(client, tmp_path):
+@pytest.mark.parametrize("use_event_loop", [False, True])
+def test_sapphire_01(client, tmp_path, use_event_loop):
     """test requesting multiple files (test cleanup code)"""
     to_serve = list()
     for i in range(100):
         to_serve.append(_create_test("test_%03d.html" % i, tmp_path, data=os.urandom(5), calc_hash=True))
-    with Sapphire(timeout=30) as serv:
+    with Sapphire(timeout=30, use_event_loop=use_event_loop) as serv:
         client.launch("127.0.0.1", serv.port, to_serve)
         status, files_served = serv.serve_path(str(tmp_path))
     assert status == SERVED_ALL
@@ -650,6 +654,327 @@ def test_sapphire_33(mocker):
         assert serv._socket.settimeout.call_count == 2
     assert pending.close.call_count == 1
 
+@pytest.mark.parametrize("use_event_loop", [False, True])
+def test_sapphire_34(tmp_path, use_event_loop):
+    """test Sapphire.serve_path() with persistent connection and pipelined requests"""
+    _create_test("test1.html", tmp_path, data=b"a")
+    _create_test("test2.html", tmp_path, data=b"b")
+    requests = b"".join(
+        b"GET /%s HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: keep-alive\r\n\r\n" % (x,)
+        for x in (b"test1.html", b"missing.html", b"test2.html"))
+    with Sapphire(timeout=10, use_event_loop=use_event_loop) as serv:
+        def _client():
+            with socket.create_connection(("127.0.0.1", serv.port), timeout=10) as sock:
+                sock.sendall(requests)
+                while sock.recv(0x1000):
+                    pass
+        thread = threading.Thread(target=_client)
+        thread.start()
+        try:
+            status, served = serv.serve_path(str(tmp_path))
+        finally:
+            thread.join()
+    assert status == SERVED_ALL
+    assert sorted(served) == ["test1.html", "test2.html"]
+
+def test_sapphire_35(client, mocker, tmp_path):
+    """test Sapphire.serve_path() using cached JobTemplates"""
+    test = _create_test("test_case.html", tmp_path)
+    with Sapphire(timeout=10) as serv:
+        templates = set()
+        for _ in range(3):
+            test.code = None
+            client.launch("127.0.0.1", serv.port, [test])
+            assert serv.serve_path(str(tmp_path))[0] == SERVED_ALL
+            assert client.wait(timeout=10)
+            client.close()
+            assert test.code == 200
+            assert len(serv._templates) == 1
+            templates.update(id(x) for x in serv._templates.values())
+        assert len(templates) == 1
+        # directory contents changed
+        _create_test("other.html", tmp_path)
+        optional = ["other.html", "test_case.html"]
+        assert serv.serve_path(str(tmp_path), optional_files=optional)[0] == SERVED_NONE
+        assert len(serv._templates) == 2
+        # cache limit
+        mocker.patch.object(Sapphire, "TEMPLATE_LIMIT", 1)
+        (tmp_path / "new").mkdir()
+        assert serv.serve_path(str(tmp_path / "new"))[0] == SERVED_NONE
+        assert len(serv._templates) == 1
+        serv.clear_templates()
+        assert not serv._templates
+
+def test_sapphire_36(client, tmp_path):
+    """test Sapphire worker pool is reused by serve_path()"""
+    test = _create_test("test_case.html", tmp_path)
+    with Sapphire(max_workers=3, timeout=10) as serv:
+        assert serv.pool.size == 0
+        for _ in range(2):
+            test.code = None
+            client.launch("127.0.0.1", serv.port, [test])
+            assert serv.serve_path(str(tmp_path))[0] == SERVED_ALL
+            assert client.wait(timeout=10)
+            client.close()
+            assert test.code == 200
+            assert serv.pool.size == 3
+        assert serv.pool.handled == 2
+    assert serv.pool.size == 0
+    with Sapphire(timeout=10, use_worker_pool=False) as serv:
+        assert serv.pool is None
+
+@pytest.mark.parametrize("use_event_loop", [False, True])
+def test_sapphire_37(mocker, tmp_path, use_event_loop):
+    """test Sapphire.wake()"""
+    _create_test("test_case.html", tmp_path)
+    with Sapphire(timeout=60, use_event_loop=use_event_loop) as serv:
+        # no active serve_path() call
+        serv.wake()
+        # wake() causes continue_cb to be called without waiting for the next poll
+        callback = mocker.Mock(return_value=False)
+        timer = threading.Timer(0.1, serv.wake)
+        timer.start()
+        try:
+            assert serv.serve_path(str(tmp_path), continue_cb=callback)[0] == SERVED_NONE
+        finally:
+            timer.join()
+        assert callback.call_count == 1
+        assert serv._loadmgr is None
+
+@pytest.mark.parametrize("use_event_loop", [False, True])
+def test_sapphire_38(tmp_path, use_event_loop):
+    """test Sapphire.serve_path() with chunked dynamic responses"""
+    _create_test("test_case.html", tmp_path, data=b"a")
+    smap = ServerMap()
+    smap.set_dynamic_response(
+        "gen", lambda: (x for x in (b"abc", b"", b"d" * 0x20000)), required=True)
+    smap.set_dynamic_response("file", lambda: io.BytesIO(b"x" * 0x20001), required=True)
+    results = dict()
+    with Sapphire(timeout=10, use_event_loop=use_event_loop) as serv:
+        def _client():
+            conn = http.client.HTTPConnection("127.0.0.1", serv.port, timeout=10)
+            try:
+                for url in ("gen", "file", "test_case.html"):
+                    conn.request("GET", "/" + url, headers={"Connection": "keep-alive"})
+                    resp = conn.getresponse()
+                    results[url] = (resp.getheader("Transfer-Encoding"), resp.read())
+            finally:
+                conn.close()
+        thread = threading.Thread(target=_client)
+        thread.start()
+        try:
+            status, _ = serv.serve_path(str(tmp_path), server_map=smap)
+        finally:
+            thread.join()
+    assert status == SERVED_ALL
+    assert results["gen"] == ("chunked", b"abc" + b"d" * 0x20000)
+    assert results["file"] == ("chunked", b"x" * 0x20001)
+    assert results["test_case.html"] == (None, b"a")
+
+@pytest.mark.parametrize("use_event_loop", [False, True])
+def test_sapphire_39(client, tmp_path, use_event_loop):
+    """test Sapphire.serve_path() collecting ServeStats"""
+    test = _create_test("test_case.html", tmp_path, data=b"a" * 100)
+    stats = ServeStats(keep_timelines=True)
+    with Sapphire(timeout=10, use_event_loop=use_event_loop) as serv:
+        client.launch("127.0.0.1", serv.port, [test])
+        assert serv.serve_path(str(tmp_path), stats=stats)[0] == SERVED_ALL
+        assert client.wait(timeout=10)
+    assert stats.requests == 1
+    assert stats.sent > 100
+    timeline = stats.timelines[0]
+    assert timeline.target == str(tmp_path / "test_case.html")
+    assert timeline.accepted <= timeline.parsed <= timeline.resolved
+    assert timeline.resolved <= timeline.first_byte <= timeline.complete
+    assert all(x.count == 1 for _, x in stats.histograms())
+
+def test_sapphire_40(tmp_path):
+    """test Sapphire.serve_path() serving concurrent namespaced jobs"""
+    results = dict()
+    statuses = dict()
+    with Sapphire(timeout=10) as serv:
+        def _serve(name):
+            wwwroot = tmp_path / name
+            wwwroot.mkdir()
+            (wwwroot / "test.html").write_bytes(name.encode("ascii"))
+            (wwwroot / "opt.html").write_bytes(b"optional")
+            statuses[name] = serv.serve_path(
+                str(wwwroot), namespace=name, optional_files=["opt.html"])
+
+        def _client(name):
+            conn = http.client.HTTPConnection("127.0.0.1", serv.port, timeout=10)
+            try:
+                for url in ("missing/test.html", "%s/test.html" % (name,)):
+                    conn.request("GET", "/" + url, headers={"Connection": "keep-alive"})
+                    resp = conn.getresponse()
+                    results[(name, url)] = (resp.status, resp.read())
+            finally:
+                conn.close()
+        servers = [threading.Thread(target=_serve, args=(x,)) for x in ("job_a", "job_b")]
+        for thread in servers:
+            thread.start()
+        # wait for jobs to be registered
+        while serv._mux is None or serv._mux.jobs < 2:
+            threading.Event().wait(0.01)
+        clients = [threading.Thread(target=_client, args=(x,)) for x in ("job_b", "job_a")]
+        for thread in clients:
+            thread.start()
+        for thread in clients + servers:
+            thread.join()
+    for name in ("job_a", "job_b"):
+        assert statuses[name] == (SERVED_ALL, ("test.html",))
+        assert results[(name, "missing/test.html")][0] == 404
+        assert results[(name, "%s/test.html" % (name,))] == (200, name.encode("ascii"))
+    assert serv._mux is None
+
+def test_sapphire_41(tmp_path):
+    """test Sapphire.serve_path() namespaced job timeout and failure"""
+    (tmp_path / "test.html").touch()
+    smap = ServerMap()
+    smap.set_dynamic_response("bad", lambda: "str", required=True)
+    with Sapphire(timeout=1) as serv:
+        # timeout
+        status, served = serv.serve_path(str(tmp_path), namespace="a")
+        assert status == SERVED_TIMEOUT
+        assert not served
+        assert serv._mux.jobs == 0
+        # exception in a worker only fails the job that handled the request
+        def _client():
+            conn = http.client.HTTPConnection("127.0.0.1", serv.port, timeout=10)
+            try:
+                conn.request("GET", "/b/bad")
+                results.append(conn.getresponse().status)
+            finally:
+                conn.close()
+        results = list()
+        thread = threading.Timer(0.1, _client)
+        thread.start()
+        try:
+            with pytest.raises(TypeError, match="dynamic request callback must return"):
+                serv.serve_path(str(tmp_path), namespace="b", server_map=smap)
+        finally:
+            thread.join()
+        assert results == [500]
+        assert serv._mux is not None
+        assert not serv._mux.is_complete()
+        # non-namespaced serving stops the multiplexer
+        serv.timeout = 0.1
+        assert serv.serve_path(str(tmp_path))[0] == SERVED_TIMEOUT
+        assert serv._mux is None
+
+@pytest.mark.parametrize("use_event_loop", [False, True])
+def test_sapphire_42(client, use_event_loop):
+    """test Sapphire.serve_path() serving content from a provider"""
+    class _Provider:
+        def __init__(self, content):
+            self.content = content
+
+        def open(self, url):
+            return io.BytesIO(self.content[url]), len(self.content[url])
+
+        def files(self):
+            return tuple(self.content)
+
+    content = {"nested/opt.js": b"optional"}
+    content.update({"test_%d.html" % (x,): os.urandom(5) for x in range(5)})
+    to_serve = list()
+    for url, data in content.items():
+        test = _TestFile(url)
+        test.len_org = len(data)
+        test.md5_org = hashlib.md5(data).hexdigest()
+        to_serve.append(test)
+    missing = _TestFile("missing.html")
+    with Sapphire(timeout=10, use_event_loop=use_event_loop) as serv:
+        # request the optional file and the missing file before the required files
+        client.launch("127.0.0.1", serv.port, to_serve[:1] + [missing] + to_serve[1:], in_order=True)
+        status, served = serv.serve_path(
+            None, optional_files=["opt.js"], provider=_Provider(content))
+        assert client.wait(timeout=10)
+    assert status == SERVED_ALL
+    assert set(served) == set(content)
+    assert missing.code == 404
+    for test in to_serve:
+        assert test.code == 200
+        assert test.len_srv == test.len_org
+        assert test.md5_srv == test.md5_org
+
+@pytest.mark.parametrize("use_event_loop", [False, True])
+def test_sapphire_43(tmp_path, use_event_loop):
+    """test Sapphire.serve_path() with uploads and large headers"""
+    wwwroot = tmp_path / "www"
+    wwwroot.mkdir()
+    (wwwroot / "test.html").write_bytes(b"test")
+    upload = os.urandom(0x300000)
+    received = list()
+    def _sink(body):
+        content_hash = hashlib.md5()
+        for chunk in iter(lambda: body.read(0x10000), b""):
+            content_hash.update(chunk)
+        received.append(content_hash.hexdigest())
+        return b"done"
+    smap = ServerMap()
+    smap.set_upload("report", _sink, required=True)
+    smap.set_upload("save", str(tmp_path / "saved.bin"), required=True)
+    results = list()
+    with Sapphire(timeout=10, use_event_loop=use_event_loop) as serv:
+        def _client():
+            conn = http.client.HTTPConnection("127.0.0.1", serv.port, timeout=10)
+            try:
+                headers = {"Connection": "keep-alive", "X-Large": "A" * 0x8000}
+                conn.request("GET", "/test.html", headers=headers)
+                resp = conn.getresponse()
+                results.append((resp.status, resp.read()))
+                conn.request("POST", "/save", body=b"saved", headers=headers)
+                resp = conn.getresponse()
+                results.append((resp.status, resp.read()))
+                conn.request("POST", "/report", body=upload)
+                resp = conn.getresponse()
+                results.append((resp.status, resp.read()))
+            finally:
+                conn.close()
+        thread = threading.Thread(target=_client)
+        thread.start()
+        try:
+            status, served = serv.serve_path(str(wwwroot), server_map=smap)
+        finally:
+            thread.join()
+    assert status == SERVED_ALL
+    assert served == ("test.html",)
+    assert results == [(200, b"test"), (200, b""), (200, b"done")]
+    assert received == [hashlib.md5(upload).hexdigest()]
+    assert (tmp_path / "saved.bin").read_bytes() == b"saved"
+
+@pytest.mark.parametrize("use_worker_pool", [True, False])
+def test_sapphire_44(mocker, tmp_path, use_worker_pool):
+    """test Sapphire releases idle persistent connections when workers are saturated"""
+    mocker.patch.object(Worker, "KEEP_ALIVE_TIMEOUT", 60)
+    _create_test("test1.html", tmp_path, data=b"a")
+    _create_test("test2.html", tmp_path, data=b"b")
+    with Sapphire(max_workers=1, queue_size=1, timeout=10, use_worker_pool=use_worker_pool) as serv:
+        def _client():
+            with socket.create_connection(("127.0.0.1", serv.port), timeout=10) as idle:
+                idle.sendall(
+                    b"GET /test1.html HTTP/1.1\r\nHost: 127.0.0.1\r\n"
+                    b"Connection: keep-alive\r\n\r\n")
+                data = b""
+                while not data.endswith(b"a"):
+                    data += idle.recv(0x1000)
+                # the only worker is held by the idle connection
+                with socket.create_connection(("127.0.0.1", serv.port), timeout=10) as sock:
+                    sock.sendall(b"GET /test2.html HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n")
+                    while sock.recv(0x1000):
+                        pass
+                # the idle connection was closed by the server
+                assert idle.recv(0x1000) == b""
+        thread = threading.Thread(target=_client)
+        thread.start()
+        try:
+            status, served = serv.serve_path(str(tmp_path))
+        finally:
+            thread.join()
+    assert status == SERVED_ALL
+    assert sorted(served) == ["test1.html", "test2.html"]
+
 def test_main_01(mocker, tmp_path):
     """test Sapphire.main()"""
     args = mocker.Mock(
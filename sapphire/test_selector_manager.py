@@ -0,0 +1,165 @@
+# coding=utf-8
+"""
+SelectorManager unit tests
+"""
+# pylint: disable=protected-access
+
+from errno import EINVAL
+from socket import create_connection
+from threading import Timer
+
+from pytest import raises
+
+from .core import Sapphire
+from .job import Job
+from .selector_manager import SelectorManager
+from .server_map import ServerMap
+
+
+def test_selector_manager_01(tmp_path):
+    """test basic SelectorManager"""
+    (tmp_path / "testfile").write_bytes(b"test")
+    job = Job(str(tmp_path))
+    serv_sock = Sapphire._create_listening_socket(False)
+    try:
+        port = serv_sock.getsockname()[1]
+        # connection is queued before the event loop starts
+        with create_connection(("127.0.0.1", port), timeout=10) as sock:
+            sock.sendall(b"GET /testfile HTTP/1.1\r\n\r\n")
+            with SelectorManager(job, serv_sock) as loadmgr:
+                assert loadmgr.wait(1)
+            assert sock.recv(0x1000).endswith(b"\r\n\r\ntest")
+        assert job.is_complete()
+        assert not job.pending
+        # listening socket is restored
+        assert serv_sock.gettimeout() == Sapphire.LISTEN_TIMEOUT
+    finally:
+        serv_sock.close()
+
+
+def test_selector_manager_02(mocker, tmp_path):
+    """test SelectorManager.wait()"""
+    (tmp_path / "test1").touch()
+    serv_sock = Sapphire._create_listening_socket(False)
+    try:
+        job = Job(str(tmp_path))
+        with SelectorManager(job, serv_sock) as loadmgr:
+            # invalid callback
+            with raises(TypeError, match="continue_cb must be callable"):
+                loadmgr.wait(0, continue_cb="test")
+            # callback abort
+            assert loadmgr.wait(1, continue_cb=lambda: False, poll=0.01)
+        # timeout
+        job = Job(str(tmp_path))
+        fake_time = mocker.patch("sapphire.selector_manager.time", autospec=True)
+        fake_time.side_effect = (1, 1, 1, 2)
+        with SelectorManager(job, serv_sock) as loadmgr:
+            assert not loadmgr.wait(1, poll=10)
+    finally:
+        serv_sock.close()
+
+
+def test_selector_manager_03(tmp_path):
+    """test SelectorManager large file, persistent connection and errors"""
+    (tmp_path / "test1").write_bytes(b"A" * 0x100000)
+    (tmp_path / "test2").write_bytes(b"B")
+    smap = ServerMap()
+    smap.set_redirect("redirect", "test2", required=True)
+    job = Job(str(tmp_path), server_map=smap)
+    serv_sock = Sapphire._create_listening_socket(False)
+    try:
+        port = serv_sock.getsockname()[1]
+        with create_connection(("127.0.0.1", port), timeout=10) as sock:
+            sock.sendall(
+                b"GET /test1 HTTP/1.1\r\nConnection: keep-alive\r\n\r\n"
+                b"bad request\r\n\r\n")
+            with create_connection(("127.0.0.1", port), timeout=10) as other:
+                other.sendall(
+                    b"GET /redirect HTTP/1.1\r\nConnection: keep-alive\r\n\r\n"
+                    b"GET /test2 HTTP/1.1\r\nConnection: keep-alive\r\n\r\n")
+                with SelectorManager(job, serv_sock) as loadmgr:
+                    assert loadmgr.wait(10)
+                received = b""
+                while True:
+                    chunk = other.recv(0x10000)
+                    if not chunk:
+                        break
+                    received += chunk
+            assert b"307 Temporary Redirect" in received
+            assert received.endswith(b"Connection: close\r\n\r\nB")
+        assert job.is_complete()
+        assert not job.pending
+    finally:
+        serv_sock.close()
+
+
+def test_selector_manager_04(tmp_path):
+    """test SelectorManager re-raise exceptions"""
+    smap = ServerMap()
+    smap.set_dynamic_response("test", lambda: None, required=True)
+    job = Job(str(tmp_path), server_map=smap)
+    serv_sock = Sapphire._create_listening_socket(False)
+    try:
+        port = serv_sock.getsockname()[1]
+        with create_connection(("127.0.0.1", port), timeout=10) as sock:
+            sock.sendall(b"GET /test HTTP/1.1\r\n\r\n")
+            with raises(TypeError, match="dynamic request callback must return 'bytes'"):
+                with SelectorManager(job, serv_sock) as loadmgr:
+                    loadmgr.wait(1)
+        assert job.is_complete()
+    finally:
+        serv_sock.close()
+
+
+def test_selector_manager_05(mocker, tmp_path):
+    """test SelectorManager sendfile() fallback"""
+    fake_sendfile = mocker.patch(
+        "sapphire.selector_manager.sendfile",
+        autospec=True,
+        side_effect=OSError(EINVAL, "Invalid argument"))
+    data = b"".join(b"%d" % (x,) for x in range(0x10000))
+    (tmp_path / "testfile").write_bytes(data)
+    job = Job(str(tmp_path))
+    serv_sock = Sapphire._create_listening_socket(False)
+    try:
+        port = serv_sock.getsockname()[1]
+        with create_connection(("127.0.0.1", port), timeout=10) as sock:
+            sock.sendall(b"GET /testfile HTTP/1.1\r\n\r\n")
+            with SelectorManager(job, serv_sock) as loadmgr:
+                assert loadmgr.wait(10)
+            received = b""
+            while True:
+                chunk = sock.recv(0x10000)
+                if not chunk:
+                    break
+                received += chunk
+        assert received.split(b"\r\n\r\n", 1)[-1] == data
+        assert fake_sendfile.call_count == 1
+        assert job.is_complete()
+    finally:
+        serv_sock.close()
+
+
+def test_selector_manager_06(mocker, tmp_path):
+    """test SelectorManager.wait() is woken by SelectorManager.wake()"""
+    (tmp_path / "testfile").touch()
+    job = Job(str(tmp_path))
+    serv_sock = Sapphire._create_listening_socket(False)
+    try:
+        loadmgr = SelectorManager(job, serv_sock)
+        # no effect before start()
+        loadmgr.wake()
+        with loadmgr:
+            # continue_cb is only called after wake() since poll is large
+            callback = mocker.Mock(return_value=False)
+            timer = Timer(0.1, loadmgr.wake)
+            timer.start()
+            try:
+                assert loadmgr.wait(60, continue_cb=callback, poll=60)
+            finally:
+                timer.join()
+            assert callback.call_count == 1
+        # no effect after close()
+        loadmgr.wake()
+    finally:
+        serv_sock.close()
@@ -15,6 +15,7 @@ def test_servermap_01():
     assert not srv_map.dynamic
     assert not srv_map.include
     assert not srv_map.redirect
+    assert not srv_map.upload
 
 def test_servermap_02(tmp_path):
     """test ServerMap dynamic responses"""
@@ -69,6 +70,14 @@ def test_servermap_03(tmp_path):
     inc3.mkdir()
     with pytest.raises(MapCollisionError, match=r"'url_01' and '\w+' include"):
         srv_map.set_include("url_01", str(inc3))
+    # includes are not cacheable by default
+    assert srv_map.include["url_02"].max_age is None
+    srv_map.set_include("url_02", str(inc2), cacheable=True)
+    assert srv_map.include["url_02"].max_age == 0
+    srv_map.set_include("url_02", str(inc2), cacheable=True, max_age=60)
+    assert srv_map.include["url_02"].max_age == 60
+    with pytest.raises(TypeError, match="max_age must be an 'int' >= 0"):
+        srv_map.set_include("url_02", str(inc2), cacheable=True, max_age=-1)
 
 def test_servermap_04(tmp_path):
     """test ServerMap redirects"""
@@ -101,3 +110,33 @@ def test_servermap_05():
     # cannot map more than one '/' deep
     with pytest.raises(InvalidURLError):
         ServerMap._check_url("/test/test")
+
+def test_servermap_06(tmp_path):
+    """test ServerMap uploads"""
+    srv_map = ServerMap()
+    srv_map.set_upload("url_01", lambda _: None, required=True)
+    assert callable(srv_map.upload["url_01"].target)
+    assert srv_map.upload["url_01"].mime == "text/plain"
+    assert srv_map.upload["url_01"].required
+    assert srv_map.upload["url_01"].type == Resource.URL_UPLOAD
+    # file sink
+    srv_map.set_upload("url_02", str(tmp_path / "upload.bin"), mime_type="test/type")
+    assert srv_map.upload["url_02"].target == str(tmp_path / "upload.bin")
+    assert srv_map.upload["url_02"].mime == "test/type"
+    assert not srv_map.upload["url_02"].required
+    with pytest.raises(TypeError, match="sink must be callable or of type 'str'"):
+        srv_map.set_upload("url_03", None)
+    with pytest.raises(TypeError, match="mime_type must be of type 'str'"):
+        srv_map.set_upload("url_03", "sink", mime_type=None)
+    assert not srv_map.dynamic
+    assert not srv_map.include
+    assert not srv_map.redirect
+    with pytest.raises(MapCollisionError):
+        srv_map.set_dynamic_response("url_01", lambda: 0)
+    with pytest.raises(MapCollisionError):
+        srv_map.set_include("url_01", str(tmp_path))
+    with pytest.raises(MapCollisionError):
+        srv_map.set_redirect("url_01", "test_file")
+    srv_map.set_redirect("url_04", "test_file")
+    with pytest.raises(MapCollisionError):
+        srv_map.set_upload("url_04", "sink")
@@ -0,0 +1,84 @@
+# coding=utf-8
+"""
+Sapphire request instrumentation unit tests
+"""
+# pylint: disable=protected-access
+
+from .stats import Histogram, ServeStats, Timeline
+
+
+def test_histogram_01():
+    """test empty Histogram"""
+    hist = Histogram()
+    assert hist.count == 0
+    assert hist.total == 0
+    assert hist.percentile(50) == 0
+    assert sum(hist.buckets) == 0
+
+def test_histogram_02():
+    """test Histogram.add() and Histogram.percentile()"""
+    hist = Histogram()
+    for value in (0.01, 0.00005, 1.5, 0.01, 1000):
+        hist.add(value)
+    assert hist.count == 5
+    assert hist.min == 0.00005
+    assert hist.max == 1000
+    assert hist.total == 0.00005 + 0.01 + 0.01 + 1.5 + 1000
+    assert sum(hist.buckets) == 5
+    # values larger than the last bound are added to the last bucket
+    assert hist.buckets[-1] == 1
+    assert hist.percentile(0) == Histogram.BOUNDS[0]
+    assert 0.01 <= hist.percentile(50) < 0.02
+    assert 1.5 <= hist.percentile(80) < 3
+    assert hist.percentile(100) == 1000
+
+def test_histogram_03():
+    """test Histogram.merge()"""
+    hist = Histogram()
+    other = Histogram()
+    hist.merge(other)
+    assert hist.count == 0
+    for value in (0.5, 2.0):
+        other.add(value)
+    hist.merge(other)
+    hist.merge(other)
+    assert hist.count == 4
+    assert hist.min == 0.5
+    assert hist.max == 2.0
+    assert hist.total == 5.0
+    assert sum(hist.buckets) == 4
+    assert hist.buckets == [x * 2 for x in other.buckets]
+
+def test_serve_stats_01():
+    """test ServeStats.record()"""
+    stats = ServeStats()
+    assert stats.requests == 0
+    assert all(x.count == 0 for _, x in stats.histograms())
+    timeline = Timeline(1.0)
+    timeline.parsed = 1.5
+    timeline.resolved = 1.75
+    timeline.first_byte = 2.0
+    timeline.complete = 4.0
+    timeline.sent = 10
+    stats.record(timeline)
+    # incomplete timeline
+    timeline = Timeline(1.0)
+    timeline.parsed = 1.5
+    timeline.sent = 5
+    stats.record(timeline)
+    assert stats.requests == 2
+    assert stats.sent == 15
+    assert not stats.timelines
+    hists = dict(stats.histograms())
+    assert tuple(hists) == tuple(x[0] for x in ServeStats.PHASES)
+    assert hists["wait"].count == 2
+    assert hists["wait"].total == 1
+    assert hists["resolve"].total == 0.25
+    assert hists["first_byte"].total == 1
+    assert hists["transfer"].total == 2
+    assert hists["total"].count == 1
+    assert hists["total"].total == 3
+    # keep timelines
+    stats = ServeStats(keep_timelines=True)
+    stats.record(timeline)
+    assert stats.timelines == [timeline]
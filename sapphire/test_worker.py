@@ -10,7 +10,8 @@ import threading
 import pytest
 
 from .job import Job
-from .worker import Worker, WorkerError
+from .server_map import ServerMap
+from .worker import Worker, WorkerError, WorkerPool
 
 def test_worker_01(mocker):
     """test simple Worker in running state"""
@@ -67,7 +68,7 @@ def test_worker_04(mocker, tmp_path):
     (tmp_path / "testfile").touch()
     job = Job(str(tmp_path))
     clnt_sock = mocker.Mock(spec=socket.socket)
-    clnt_sock.recv.return_value = b"GET /testfile HTTP/1.1"
+    clnt_sock.recv.return_value = b"GET /testfile HTTP/1.1\r\n\r\n"
     serv_sock = mocker.Mock(spec=socket.socket)
     serv_sock.accept.return_value = (clnt_sock, None)
     worker = Worker.launch(serv_sock, job)
@@ -114,3 +115,279 @@ def test_response_data_04():
     assert b"Content-Length: " in output
     assert b"HTTP/1.1 404 Not Found" in output
     assert b"<script>window.setTimeout(window.close, 10000)</script>" in output
+
+def test_response_data_05():
+    """test encoded headers and error pages are cached"""
+    # encoded error pages are reused
+    output = Worker._4xx_page(404, "Not Found", close=10)
+    assert Worker._4xx_page(404, "Not Found", close=10) is output
+    assert Worker._4xx_page(404, "Not Found", close=10, keep_alive=True) is not output
+    assert Worker._307_redirect("test", keep_alive=True) is Worker._307_redirect("test", keep_alive=True)
+    # cached portion of 200 header is combined with the content length
+    assert Worker._200_header(1, "text/html").startswith(b"HTTP/1.1 200 OK\r\n")
+    assert Worker._200_header(1, "text/html") == Worker._200_header(1, "text/html")
+    assert b"Content-Length: 22\r\n" in Worker._200_header(22, "text/html")
+    assert b"Connection: keep-alive\r\n\r\n" in Worker._200_header(1, "text/html", keep_alive=True)
+
+def test_response_data_06(tmp_path):
+    """test Worker.prepare_response() with cacheable includes"""
+    (tmp_path / "wwwroot").mkdir()
+    (tmp_path / "wwwroot" / "test.html").write_bytes(b"a")
+    (tmp_path / "inc").mkdir()
+    (tmp_path / "inc" / "lib.js").write_bytes(b"b")
+    (tmp_path / "nc").mkdir()
+    (tmp_path / "nc" / "lib.js").write_bytes(b"c")
+    smap = ServerMap()
+    smap.set_include("inc", str(tmp_path / "inc"), cacheable=True, max_age=60)
+    smap.set_include("nc", str(tmp_path / "nc"))
+    job = Job(str(tmp_path / "wwwroot"), forever=True, server_map=smap)
+    # test case files are not cacheable
+    resp = Worker.prepare_response(b"GET /test.html HTTP/1.1\r\n\r\n", job)
+    assert b"Cache-Control: max-age=0, no-cache\r\n" in resp.header
+    assert b"ETag:" not in resp.header
+    # includes are not cacheable by default
+    resp = Worker.prepare_response(b"GET /nc/lib.js HTTP/1.1\r\n\r\n", job)
+    assert b"Cache-Control: max-age=0, no-cache\r\n" in resp.header
+    assert b"ETag:" not in resp.header
+    # cacheable include
+    resp = Worker.prepare_response(b"GET /inc/lib.js HTTP/1.1\r\n\r\n", job)
+    assert resp.header.startswith(b"HTTP/1.1 200 OK\r\n")
+    assert b"Cache-Control: max-age=60, immutable\r\n" in resp.header
+    etag = resp.header.split(b"ETag: ", 1)[-1].split(b"\r\n", 1)[0]
+    assert len(etag) == 42
+    assert resp.path == str(tmp_path / "inc" / "lib.js")
+    # matching etag
+    resp = Worker.prepare_response(
+        b"GET /inc/lib.js HTTP/1.1\r\nIf-None-Match: \"x\", W/%s\r\n\r\n" % (etag,), job)
+    assert resp.header.startswith(b"HTTP/1.1 304 Not Modified\r\n")
+    assert resp.path is None
+    assert resp.served == str(tmp_path / "inc" / "lib.js")
+    # etag does not match
+    resp = Worker.prepare_response(
+        b"GET /inc/lib.js HTTP/1.1\r\nIf-None-Match: \"x\"\r\n\r\n", job)
+    assert resp.header.startswith(b"HTTP/1.1 200 OK\r\n")
+    # modified content changes the etag
+    (tmp_path / "inc" / "lib.js").write_bytes(b"bb")
+    resp = Worker.prepare_response(
+        b"GET /inc/lib.js HTTP/1.1\r\nIf-None-Match: %s\r\n\r\n" % (etag,), job)
+    assert resp.header.startswith(b"HTTP/1.1 200 OK\r\n")
+    assert etag not in resp.header
+
+def test_response_data_07(mocker):
+    """test Worker._chunked()"""
+    assert b"".join(Worker._chunked([b"a", b"", b"bc"])) == b"1\r\na\r\n2\r\nbc\r\n0\r\n\r\n"
+    assert b"".join(Worker._chunked([])) == b"0\r\n\r\n"
+    # file-like object is closed
+    src = mocker.Mock(spec_set=("close", "read"))
+    src.read.side_effect = (b"a", b"")
+    assert b"".join(Worker._chunked(src)) == b"1\r\na\r\n0\r\n\r\n"
+    assert src.close.call_count == 1
+    # invalid data
+    with pytest.raises(TypeError, match="dynamic request data must be 'bytes'"):
+        tuple(Worker._chunked(["a"]))
+
+def test_worker_06(mocker, tmp_path):
+    """test Worker.handle_request() persistent connection and pipelined requests"""
+    (tmp_path / "test1").write_bytes(b"a")
+    (tmp_path / "test2").write_bytes(b"b")
+    (tmp_path / "test3").write_bytes(b"c")
+    job = Job(str(tmp_path))
+    conn = mocker.Mock(spec=socket.socket)
+    conn.sendfile.return_value = 1
+    conn.recv.side_effect = (
+        b"GET /test1 HTTP/1.1\r\nConnection: keep-alive\r\n\r\n"
+        b"GET /missing HTTP/1.1\r\nConnection: keep-alive\r\n\r\nGET /te",
+        b"st2 HTTP/1.1\r\nConnection: keep-alive\r\n\r\n",
+        socket.timeout,
+        b"GET /test3 HTTP/1.1\r\nConnection: keep-alive\r\n\r\n")
+    Worker.handle_request(conn, job)
+    assert conn.recv.call_count == 4
+    assert conn.close.call_count == 1
+    assert job.is_complete()
+    assert not job.pending
+    sent = b"".join(x[0][0] for x in conn.sendall.call_args_list)
+    assert sent.count(b"Connection: keep-alive") == 3
+    assert sent.count(b"Connection: close") == 1
+    assert b"404 Not Found" in sent
+    # idle persistent connection is closed when the job is complete
+    job = Job(str(tmp_path), forever=True)
+    job.finish()
+    conn.reset_mock()
+    conn.recv.side_effect = (b"GET /test1 HTTP/1.1\r\nConnection: keep-alive\r\n\r\n", socket.timeout)
+    Worker.handle_request(conn, job)
+    assert conn.recv.call_count == 2
+    assert conn.sendall.call_count == 1
+    assert conn.sendfile.call_count == 1
+    assert conn.close.call_count == 1
+
+def test_worker_07():
+    """test Worker.header_end() and Worker.body_length()"""
+    assert Worker.header_end(b"") is None
+    assert Worker.header_end(b"GE") is None
+    assert Worker.header_end(b"POST /test HTTP/1.1\r\nHost: a") is None
+    assert Worker.header_end(b"GET /test HTTP/1.1\r\n\r\nGET") == 22
+    # invalid requests are detected early
+    assert Worker.header_end(b"PUT /") == 5
+    assert Worker.header_end(b"GET /a b c\r\n") == 12
+    # header is too large
+    data = b"GET /test HTTP/1.1\r\n" + b"A" * Worker.MAX_HEADER_SIZE
+    assert Worker.header_end(data) == len(data)
+    assert Worker.body_length(b"GET /test HTTP/1.1\r\n\r\n") is None
+    assert Worker.body_length(b"POST /test HTTP/1.1\r\ncontent-length: 12\r\n\r\n") == 12
+
+def test_worker_08(mocker, tmp_path):
+    """test Worker.handle_request() receiving requests in parts"""
+    (tmp_path / "test1").write_bytes(b"a")
+    job = Job(str(tmp_path))
+    conn = mocker.Mock(spec=socket.socket)
+    conn.sendfile.return_value = 1
+    # header split across multiple recv() calls
+    conn.recv.side_effect = (
+        b"GET /te",
+        b"st1 HTTP/1.1\r\nUser-Agent: " + b"A" * Worker.DEFAULT_RX_SIZE + b"\r",
+        b"\n\r\n")
+    Worker.handle_request(conn, job)
+    assert conn.recv.call_count == 3
+    assert conn.sendall.call_args_list[0][0][0].startswith(b"HTTP/1.1 200 OK")
+    assert job.is_complete()
+    # header is too large
+    job = Job(str(tmp_path))
+    conn.reset_mock()
+    conn.recv.side_effect = (b"GET /test1 HTTP/1.1\r\n",) + (
+        b"A" * Worker.DEFAULT_RX_SIZE,) * (Worker.MAX_HEADER_SIZE // Worker.DEFAULT_RX_SIZE + 1)
+    Worker.handle_request(conn, job)
+    assert conn.sendall.call_args_list[0][0][0].startswith(
+        b"HTTP/1.1 431 Request Header Fields Too Large")
+    assert not job.is_complete()
+
+def test_worker_09(mocker, tmp_path):
+    """test Worker.handle_request() uploads"""
+    wwwroot = tmp_path / "www"
+    wwwroot.mkdir()
+    (wwwroot / "test1").write_bytes(b"a")
+    received = list()
+    def _sink(body):
+        received.append(body.read(3))
+        received.append(body.read())
+        assert body.read() == b""
+        return b"ok"
+    smap = ServerMap()
+    smap.set_upload("cb", _sink, required=True)
+    smap.set_upload("file", str(tmp_path / "upload.bin"), required=True)
+    job = Job(str(wwwroot), server_map=smap)
+    conn = mocker.Mock(spec=socket.socket)
+    conn.sendfile.return_value = 1
+    # body is received in parts and followed by a pipelined request
+    conn.recv.side_effect = (
+        b"POST /cb HTTP/1.1\r\nContent-Length: 8\r\nConnection: keep-alive\r\n\r\nabcd",
+        b"efgh" b"POST /file HTTP/1.1\r\nContent-Length: 6\r\nConnection: keep-alive\r\n\r\n",
+        b"upload",
+        b"GET /test1 HTTP/1.1\r\n\r\n")
+    Worker.handle_request(conn, job)
+    assert received == [b"abc", b"defgh"]
+    assert (tmp_path / "upload.bin").read_bytes() == b"upload"
+    sent = b"".join(x[0][0] for x in conn.sendall.call_args_list)
+    assert sent.count(b"HTTP/1.1 200 OK") == 3
+    assert b"\r\n\r\nok" in sent
+    assert job.is_complete()
+    assert set(job.served) == {"test1"}
+    # unread body is discarded, GET is not accepted by uploads
+    job = Job(str(wwwroot), server_map=smap)
+    conn.reset_mock()
+    conn.recv.side_effect = (
+        b"POST /test1 HTTP/1.1\r\nContent-Length: 4\r\nConnection: keep-alive\r\n\r\nab",
+        b"cd",
+        b"GET /cb HTTP/1.1\r\nConnection: keep-alive\r\n\r\n",
+        b"POST /cb HTTP/1.1\r\n\r\n")
+    Worker.handle_request(conn, job)
+    sent = [x[0][0] for x in conn.sendall.call_args_list]
+    assert len(sent) == 3
+    assert sent[0].startswith(b"HTTP/1.1 405 Method Not Allowed")
+    assert sent[1].startswith(b"HTTP/1.1 405 Method Not Allowed")
+    # POST without a Content-Length
+    assert sent[2].startswith(b"HTTP/1.1 411 Length Required")
+    assert job.pending == 3
+    # invalid callback result
+    smap = ServerMap()
+    smap.set_upload("cb", lambda _: "bad", required=True)
+    job = Job(str(wwwroot), server_map=smap)
+    conn.reset_mock()
+    conn.recv.side_effect = (b"POST /cb HTTP/1.1\r\nContent-Length: 0\r\n\r\n",)
+    Worker.handle_request(conn, job)
+    assert job.is_complete()
+    with pytest.raises(TypeError, match="upload callback must return 'bytes' or None"):
+        raise job.exceptions.get()[1]
+
+def test_worker_10(mocker, tmp_path):
+    """test Worker.handle_request() with a file removed after the Job was created"""
+    (tmp_path / "a.html").write_bytes(b"a")
+    (tmp_path / "b.html").write_bytes(b"b")
+    job = Job(str(tmp_path))
+    (tmp_path / "a.html").unlink()
+    conn = mocker.Mock(spec=socket.socket)
+    conn.recv.return_value = b"GET /a.html HTTP/1.1\r\n\r\n"
+    Worker.handle_request(conn, job)
+    assert conn.sendall.call_count == 1
+    assert b"404 Not Found" in conn.sendall.call_args[0][0]
+    assert conn.sendfile.call_count == 0
+    # the file is still pending
+    assert job.pending == 2
+    assert not job.is_complete()
+    assert not any(job.served)
+
+def test_worker_pool_01(mocker, tmp_path):
+    """test WorkerPool"""
+    (tmp_path / "test1").touch()
+    (tmp_path / "test2").touch()
+    job = Job(str(tmp_path))
+    conn = mocker.Mock(spec=socket.socket)
+    conn.recv.return_value = b"GET /test1 HTTP/1.1\r\n\r\n"
+    conn.sendfile.return_value = 0
+    with WorkerPool(2) as pool:
+        assert pool.size == 2
+        # calling start() again does not launch extra threads
+        pool.start()
+        assert pool.size == 2
+        pool.submit(conn, job)
+        assert pool.wait(timeout=10)
+        assert pool.active == 0
+        assert pool.queued == 0
+        assert pool.handled == 1
+        assert conn.close.call_count == 1
+        assert not job.is_complete()
+        # connection for completed job is closed
+        job.finish()
+        pool.submit(conn, job)
+        assert pool.wait(timeout=10)
+        assert pool.handled == 2
+        assert conn.close.call_count == 2
+        assert conn.recv.call_count == 1
+        pool.close_connections()
+    assert pool.size == 0
+
+def test_worker_pool_02(mocker):
+    """test WorkerPool.start() failures and saturation"""
+    fake_thread = mocker.patch("sapphire.worker.Thread", autospec=True)
+    fake_thread.return_value.start.side_effect = (None, threading.ThreadError)
+    fake_thread.return_value.is_alive.return_value = False
+    pool = WorkerPool(3)
+    pool.start()
+    assert pool.size == 1
+    pool.submit(mocker.Mock(spec=socket.socket), mocker.Mock(spec=Job))
+    assert pool.saturated == 0
+    pool.submit(mocker.Mock(spec=socket.socket), mocker.Mock(spec=Job))
+    assert pool.saturated == 1
+    assert pool.active == 2
+    assert pool.queued == 2
+    assert not pool.wait(timeout=0)
+    pool.close()
+    assert pool.size == 0
+    fake_thread.return_value.start.side_effect = threading.ThreadError
+    with pytest.raises(threading.ThreadError):
+        pool.start()
+    # failed to join
+    fake_thread.return_value.start.side_effect = None
+    fake_thread.return_value.is_alive.return_value = True
+    pool.start()
+    with pytest.raises(WorkerError, match="Worker thread failed to join!"):
+        pool.close()
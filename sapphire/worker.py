@@ -5,17 +5,21 @@
 """
 Sapphire HTTP server worker
 """
+from functools import lru_cache, partial
+from hashlib import sha1
 from logging import getLogger
 from os import stat
 from os.path import isfile
-from re import compile as re_compile
-from socket import error as sock_error, timeout as sock_timeout
+from re import compile as re_compile, IGNORECASE
+from socket import error as sock_error, IPPROTO_TCP, TCP_NODELAY, timeout as sock_timeout
 from sys import exc_info
-from threading import active_count, Thread, ThreadError
-from time import sleep
+from queue import Queue
+from threading import active_count, Condition, Lock, Thread, ThreadError
+from time import sleep, time
 from urllib.parse import unquote_plus
 
 from .server_map import Resource
+from .stats import Timeline
 
 __author__ = "Tyson Smith"
 __credits__ = ["Tyson Smith"]
@@ -27,10 +31,122 @@ class WorkerError(Exception):
     """Raised by Worker"""
 
 
+@lru_cache(maxsize=1024)
+def _content_etag(path, size, mtime_ns, inode):
+    # the file is identified by (path, size, mtime_ns, inode) so modified files
+    # are hashed again, only the hash is cached (not the content)
+    # pylint: disable=unused-argument
+    content_hash = sha1()
+    with open(path, "rb") as in_fp:
+        for chunk in iter(lambda: in_fp.read(Worker.DEFAULT_TX_SIZE), b""):
+            content_hash.update(chunk)
+    return content_hash.hexdigest()
+
+
+class _RequestBody:
+    """File-like object used to read the body of a request from a connection.
+    Data is received as it is read so the body is never buffered in its entirety.
+    """
+
+    __slots__ = ("_buffered", "_conn", "remaining")
+
+    def __init__(self, conn, buffered, length):
+        assert length >= 0
+        self._buffered = buffered  # received data that has not been read
+        self._conn = conn
+        self.remaining = length  # bytes of the body that have not been read
+
+    def drain(self):
+        """Discard the unread portion of the body.
+
+        Args:
+            None
+
+        Returns:
+            bytes: Received data that follows the body (pipelined requests).
+        """
+        while self.remaining > 0:
+            if not self.read(Worker.DEFAULT_TX_SIZE):
+                break
+        buffered = self._buffered
+        self._buffered = b""
+        return buffered
+
+    def read(self, size=-1):
+        """Read from the body.
+
+        Args:
+            size (int): Maximum number of bytes to read, negative values read
+                        the remainder of the body. Fewer bytes may be returned
+                        if the remainder has not been received yet.
+
+        Returns:
+            bytes: Data from the body, empty once the end of the body is reached.
+        """
+        if size < 0:
+            return b"".join(iter(partial(self.read, Worker.DEFAULT_TX_SIZE), b""))
+        if size > self.remaining:
+            size = self.remaining
+        if size < 1:
+            return b""
+        if not self._buffered:
+            self._buffered = self._conn.recv(max(size, Worker.DEFAULT_RX_SIZE))
+            if not self._buffered:
+                # connection closed before the end of the body was received
+                self.remaining = 0
+                return b""
+        data = self._buffered[:size]
+        self._buffered = self._buffered[len(data):]
+        self.remaining -= len(data)
+        return data
+
+
+class Response:
+    """Response data that is ready to be sent to a client.
+
+    Attributes:
+        body (bytes): Data to send following the header.
+        chunks (iterator): Encoded chunks to send following the header.
+        finish (bool): The job is complete once the response is sent.
+        fp (file): File object to send following the header (closed once sent).
+        header (bytes): Status line and headers (may include a body).
+        job (Job): Job that handled the request (None if no Job was found).
+        keep_alive (bool): Connection can be used for additional requests.
+        path (str): File to send following the header.
+        served (str): Entry to add to the served files of the job once sent.
+        size (int): Number of bytes to send from fp.
+    """
+
+    __slots__ = (
+        "body", "chunks", "finish", "fp", "header", "job", "keep_alive", "path", "served", "size")
+
+    def __init__(self, header, body=None, chunks=None, finish=False, fp=None, keep_alive=False,
+                 path=None, served=None, size=0):
+        self.body = body
+        self.chunks = chunks
+        self.finish = finish
+        self.fp = fp
+        self.header = header
+        self.job = None
+        self.keep_alive = keep_alive
+        self.path = path
+        self.served = served
+        self.size = size
+
+
 class Worker:
-    DEFAULT_REQUEST_LIMIT = 0x1000  # 4KB
+    CONTENT_LENGTH_PATTERN = re_compile(b"\\r\\nContent-Length:[ \\t]*(?P<length>\\d+)\\s", IGNORECASE)
+    DEFAULT_RX_SIZE = 0x1000  # 4KB
     DEFAULT_TX_SIZE = 0x10000  # 64KB
-    REQ_PATTERN = re_compile(b"^GET\\s/(?P<request>\\S*)\\sHTTP/1")
+    HEADER_CACHE_LIMIT = 256  # maximum number of cached encoded headers per type
+    IF_NONE_MATCH_PATTERN = re_compile(b"\\r\\nIf-None-Match:[ \\t]*(?P<tags>[^\\r\\n]*)", IGNORECASE)
+    KEEP_ALIVE_PATTERN = re_compile(b"\\r\\nConnection:[ \\t]*keep-alive\\s", IGNORECASE)
+    KEEP_ALIVE_POLL = 0.05  # interval used to check job status on idle connections
+    KEEP_ALIVE_TIMEOUT = 5  # maximum time an idle persistent connection is kept open
+    MAX_HEADER_SIZE = 0x10000  # 64KB, includes the request line and terminator
+    REQ_PATTERN = re_compile(b"^(?P<method>GET|POST)\\s/(?P<request>\\S*)\\sHTTP/1")
+    REQ_PREFIXES = (b"GET /", b"POST /")  # start of valid request lines
+    REQ_TERMINATOR = b"\r\n\r\n"
 
     __slots__ = ("_conn", "_thread")
 
@@ -39,24 +155,100 @@ class Worker:
         self._thread = thread
 
     @staticmethod
-    def _200_header(c_length, c_type, encoding="ascii"):
+    def _200_header(c_length, c_type, encoding="ascii", keep_alive=False, etag=None, max_age=None):
+        # chunked transfer encoding is used when c_length is None
         assert c_type is not None
-        data = "HTTP/1.1 200 OK\r\n" \
-               "Cache-Control: max-age=0, no-cache\r\n" \
-               "Content-Length: %d\r\n" \
-               "Content-Type: %s\r\n" \
-               "Connection: close\r\n\r\n" % (c_length, c_type)
+        tail = Worker._200_header_tail(c_type, encoding, keep_alive, etag, max_age)
+        if c_length is None:
+            return b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked%s" % (tail,)
+        return b"HTTP/1.1 200 OK\r\nContent-Length: %d%s" % (c_length, tail)
+
+    @staticmethod
+    @lru_cache(maxsize=HEADER_CACHE_LIMIT)
+    def _200_header_tail(c_type, encoding, keep_alive, etag, max_age):
+        # encoded portion of the 200 header that follows the content length
+        data = "\r\nCache-Control: %s\r\n" \
+               "Content-Type: %s\r\n" % (Worker._cache_control(etag, max_age), c_type)
+        if etag is not None:
+            data += "ETag: \"%s\"\r\n" % (etag,)
+        data += "Connection: %s\r\n\r\n" % ("keep-alive" if keep_alive else "close",)
+        return data.encode(encoding)
+
+    @staticmethod
+    @lru_cache(maxsize=HEADER_CACHE_LIMIT)
+    def _304_not_modified(etag, max_age, encoding="ascii", keep_alive=False):
+        data = "HTTP/1.1 304 Not Modified\r\n" \
+               "Cache-Control: %s\r\n" \
+               "ETag: \"%s\"\r\n" \
+               "Connection: %s\r\n\r\n" % (
+                   Worker._cache_control(etag, max_age),
+                   etag,
+                   "keep-alive" if keep_alive else "close")
         return data.encode(encoding)
 
+    @classmethod
+    def _chunked(cls, source):
+        """Encode data from a dynamic response using chunked transfer encoding.
+
+        Args:
+            source (iterable or file-like object): Data to encode.
+
+        Yields:
+            bytes: Encoded chunks including the terminating chunk.
+        """
+        if callable(getattr(source, "read", None)):
+            chunks = iter(lambda: source.read(cls.DEFAULT_TX_SIZE), b"")
+        else:
+            chunks = source
+        try:
+            for chunk in chunks:
+                if not isinstance(chunk, bytes):
+                    raise TypeError("dynamic request data must be 'bytes'")
+                # empty chunks are skipped since they indicate the end of the data
+                if chunk:
+                    yield b"%x\r\n%s\r\n" % (len(chunk), chunk)
+            yield b"0\r\n\r\n"
+        finally:
+            if callable(getattr(source, "close", None)):
+                source.close()
+
+    @staticmethod
+    def _cache_control(etag, max_age):
+        # responses without an ETag are not cacheable
+        if etag is None:
+            return "max-age=0, no-cache"
+        if max_age:
+            return "max-age=%d, immutable" % (max_age,)
+        return "no-cache"
+
+    @classmethod
+    def _etag_match(cls, raw_request, etag):
+        # check if If-None-Match header in the request matches etag
+        match = cls.IF_NONE_MATCH_PATTERN.search(raw_request)
+        if match is None:
+            return False
+        for tag in match.group("tags").split(b","):
+            tag = tag.strip()
+            # If-None-Match uses weak comparison
+            if tag.startswith(b"W/"):
+                tag = tag[2:]
+            if tag in (b"*", b"\"%s\"" % (etag.encode("ascii"),)):
+                return True
+        return False
+
     @staticmethod
-    def _307_redirect(redirct_to, encoding="ascii"):
+    @lru_cache(maxsize=HEADER_CACHE_LIMIT)
+    def _307_redirect(redirct_to, encoding="ascii", keep_alive=False):
         data = "HTTP/1.1 307 Temporary Redirect\r\n" \
                "Location: %s\r\n" \
-               "Connection: close\r\n\r\n" % (redirct_to,)
+               "Content-Length: 0\r\n" \
+               "Connection: %s\r\n\r\n" % (
+                   redirct_to, "keep-alive" if keep_alive else "close")
         return data.encode(encoding)
 
     @staticmethod
-    def _4xx_page(code, hdr_msg, close=-1, encoding="ascii"):
+    @lru_cache(maxsize=HEADER_CACHE_LIMIT)
+    def _4xx_page(code, hdr_msg, close=-1, encoding="ascii", keep_alive=False):
         if close < 0:
             content = "<h3>%d!</h3>" % (code,)
         else:
@@ -67,7 +259,8 @@ class Worker:
         data = "HTTP/1.1 %d %s\r\n" \
                "Content-Length: %d\r\n" \
                "Content-Type: text/html\r\n" \
-               "Connection: close\r\n\r\n%s" % (code, hdr_msg, len(content), content)
+               "Connection: %s\r\n\r\n%s" % (
+                   code, hdr_msg, len(content), "keep-alive" if keep_alive else "close", content)
         return data.encode(encoding)
 
     def close(self):
@@ -79,6 +272,23 @@ class Worker:
             # this is here to catch unexpected hangs
             raise WorkerError("Worker thread failed to join!")
 
+    @classmethod
+    def body_length(cls, raw_request):
+        """Find the length of the body that follows the header of a request.
+        Only bodies with a Content-Length are supported.
+
+        Args:
+            raw_request (bytes): Request header received from the client.
+
+        Returns:
+            int: Length of the body or None if the request does not have a
+                 Content-Length.
+        """
+        match = cls.CONTENT_LENGTH_PATTERN.search(raw_request)
+        if match is None:
+            return None
+        return int(match.group("length"))
+
     @property
     def done(self):
         if self._thread is not None and not self._thread.is_alive():
@@ -87,89 +297,116 @@ class Worker:
         return self._thread is None
 
     @classmethod
-    def handle_request(cls, conn, serv_job):
-        finish_job = False  # call finish() on return
-        try:
-            # receive all the incoming data
-            raw_request = conn.recv(cls.DEFAULT_REQUEST_LIMIT)
-            if not raw_request:
-                LOG.debug("raw_request was empty")
-                serv_job.accepting.set()
-                return
+    def _next_request(cls, conn, buffered, serv_job, release=None, wait_idle=False):
+        """Receive the header of the next request from a connection. Data is
+        received until the end of the header is found, the connection is closed
+        or MAX_HEADER_SIZE is exceeded. Data received that belongs to the body
+        or to pipelined requests is returned so it can be used by the caller.
 
-            request = cls.REQ_PATTERN.match(raw_request)
-            if request is None:
-                serv_job.accepting.set()
-                conn.sendall(cls._4xx_page(400, "Bad Request", serv_job.auto_close))
-                LOG.debug("400 request length %d (%d to go)", len(raw_request), serv_job.pending)
-                return
-
-            request = unquote_plus(request.group("request").decode("ascii"))
-            LOG.debug("check_request(%r)", request)
-            resource = serv_job.check_request(request)
-            if resource is None:
-                LOG.debug("resource is None")  # 404
-            elif resource.type in (Resource.URL_FILE, Resource.URL_INCLUDE):
-                finish_job = serv_job.remove_pending(resource.target)
-            elif resource.type in (Resource.URL_DYNAMIC, Resource.URL_REDIRECT):
-                finish_job = serv_job.remove_pending(request)
-            else:  # pragma: no cover
-                # this should never happen
-                raise WorkerError("Unknown resource type %r" % (resource.type,))
-
-            if finish_job and serv_job.forever:
-                LOG.debug("serv_job.forever is set, resetting finish_job")
-                finish_job = False
+        Args:
+            conn (socket.socket): Connection to receive data from.
+            buffered (bytes): Data that has been received but not processed.
+            serv_job (Job): Job that is being served.
+            release (callable): Returns True when an idle persistent connection
+                                should be closed to release the worker.
+            wait_idle (bool): Wait for the next request on a persistent connection.
 
-            if not finish_job:
-                serv_job.accepting.set()
-            else:
-                LOG.debug("expecting to finish")
+        Returns:
+            tuple(bytes, bytes): Raw request (empty if nothing was received) and
+                                 remaining buffered data.
+        """
+        if not buffered and wait_idle:
+            # wait for a new request or until the job is complete
+            deadline = time() + cls.KEEP_ALIVE_TIMEOUT
+            conn.settimeout(cls.KEEP_ALIVE_POLL)
+            while True:
+                try:
+                    buffered = conn.recv(cls.DEFAULT_RX_SIZE)
+                except sock_timeout:
+                    if release is not None and release():
+                        LOG.debug("releasing idle persistent connection")
+                    elif not serv_job.is_complete() and deadline > time():
+                        continue
+                break
+            conn.settimeout(None)
+            if not buffered:
+                return b"", b""
+        # only search data that has not been searched (the terminator can span recv() calls)
+        start = 0
+        while True:
+            end = cls.header_end(buffered, start)
+            if end is not None:
+                break
+            start = max(len(buffered) - len(cls.REQ_TERMINATOR) + 1, 0)
+            data = conn.recv(cls.DEFAULT_RX_SIZE)
+            if not data:
+                # the connection was closed
+                # treat everything that was received as a single request
+                return buffered, b""
+            buffered += data
+        return buffered[:end], buffered[end:]
 
-            if resource is None:
-                conn.sendall(cls._4xx_page(404, "Not Found", serv_job.auto_close))
-                LOG.debug("404 %r (%d to go)", request, serv_job.pending)
-                return
-            if resource.type in (Resource.URL_FILE, Resource.URL_INCLUDE):
-                LOG.debug("target %r", resource.target)
-                # isfile() check for Resource.URL_FILE happens in serv_job.check_request()
-                if resource.type == Resource.URL_INCLUDE and not isfile(resource.target):
-                    conn.sendall(cls._4xx_page(404, "Not Found", serv_job.auto_close))
-                    LOG.debug("404 %r (%d to go)", request, serv_job.pending)
-                    return
-                if serv_job.is_forbidden(resource.target):
-                    # NOTE: this does info leak if files exist on disk.
-                    # We could replace 403 with 404 if it turns out we care but this
-                    # is meant to run locally and only be accessible from localhost
-                    conn.sendall(cls._4xx_page(403, "Forbidden", serv_job.auto_close))
-                    LOG.debug("403 %r (%d to go)", request, serv_job.pending)
-                    return
-            elif resource.type == Resource.URL_REDIRECT:
-                conn.sendall(cls._307_redirect(resource.target))
-                LOG.debug("307 %r -> %r (%d to go)", request, resource.target, serv_job.pending)
-                return
-            elif resource.type == Resource.URL_DYNAMIC:
-                data = resource.target()
-                if not isinstance(data, bytes):
-                    LOG.debug("dynamic request: %r", request)
-                    raise TypeError("dynamic request callback must return 'bytes'")
-                conn.sendall(cls._200_header(len(data), resource.mime))
-                conn.sendall(data)
-                LOG.debug("200 %r - dynamic request (%d to go)", request, serv_job.pending)
-                return
-
-            # at this point we know "resource.target" maps to a file on disk
-            # serve the file
-            data_size = stat(resource.target).st_size
-            LOG.debug("sending: %s bytes, mime: %r", format(data_size, ","), resource.mime)
-            with open(resource.target, "rb") as in_fp:
-                conn.sendall(cls._200_header(data_size, resource.mime))
-                offset = 0
-                while offset < data_size:
-                    conn.sendall(in_fp.read(cls.DEFAULT_TX_SIZE))
-                    offset = in_fp.tell()
-            LOG.debug("200 %r (%d to go)", resource.target, serv_job.pending)
-            serv_job.increment_served(resource.target)
+    @classmethod
+    def handle_request(cls, conn, serv_job, accepted=None, release=None):
+        buffered = b""  # received data that has not been processed
+        finish_job = False  # call finish() on return
+        handled = 0  # number of requests handled using this connection
+        job = serv_job  # job that handled the last request (see JobMultiplexer)
+        keep_alive = True  # use a persistent connection
+        timeline = Timeline(accepted or time())
+        try:
+            while keep_alive and not finish_job:
+                job = serv_job
+                # receive all the incoming data
+                raw_request, buffered = cls._next_request(
+                    conn, buffered, serv_job, release=release, wait_idle=handled > 0)
+                if not raw_request:
+                    LOG.debug("raw_request was empty")
+                    serv_job.accepting.set()
+                    break
+                handled += 1
+                timeline.parsed = time()
+                length = cls.body_length(raw_request)
+                if length is None:
+                    body = None
+                else:
+                    body = _RequestBody(conn, buffered, length)
+                response = cls.prepare_response(raw_request, serv_job, body=body)
+                if body is not None:
+                    # discard the unread portion of the body
+                    buffered = body.drain()
+                timeline.resolved = time()
+                if response.job is not None:
+                    job = response.job
+                finish_job = response.finish
+                keep_alive = response.keep_alive
+                conn.sendall(response.header)
+                timeline.first_byte = time()
+                timeline.sent = len(response.header)
+                if response.body:
+                    conn.sendall(response.body)
+                    timeline.sent += len(response.body)
+                if response.chunks is not None:
+                    for chunk in response.chunks:
+                        conn.sendall(chunk)
+                        timeline.sent += len(chunk)
+                if response.path is not None:
+                    # serve the file, sendfile() uses zero-copy transmission
+                    # when available and falls back to send() if needed
+                    with open(response.path, "rb") as in_fp:
+                        timeline.sent += conn.sendfile(in_fp)
+                if response.fp is not None:
+                    # stream content supplied by a provider
+                    with response.fp as in_fp:
+                        timeline.sent += conn.sendfile(in_fp)
+                timeline.complete = time()
+                if response.served is not None:
+                    job.increment_served(response.served)
+                if job.stats is not None:
+                    timeline.target = response.served
+                    job.stats.record(timeline)
+                # the next request on a persistent connection starts now
+                timeline = Timeline(timeline.complete)
 
         except (sock_error, sock_timeout):
             _, exc_obj, exc_tb = exc_info()
@@ -180,15 +417,199 @@ class Worker:
         except Exception:  # pylint: disable=broad-except
             # set finish_job to abort immediately
             finish_job = True
-            if serv_job.exceptions.empty():
-                serv_job.exceptions.put(exc_info())
+            if job.exceptions.empty():
+                job.exceptions.put(exc_info())
 
         finally:
             conn.close()
             if finish_job:
-                serv_job.finish()
+                job.finish()
             serv_job.worker_complete.set()
 
+    @classmethod
+    def _job_response(cls, request, raw_request, serv_job, keep_alive, body=None):
+        """Prepare the response to a request handled by a Job.
+
+        Args:
+            request (str): Unquoted request (without the leading "/").
+            raw_request (bytes): Request received from the client.
+            serv_job (Job): Job that handles the request.
+            keep_alive (bool): Client requested a persistent connection.
+            body (file-like object): Body of a POST request (None for GET).
+
+        Returns:
+            Response: Response to send to the client.
+        """
+        LOG.debug("check_request(%r)", request)
+        resource = serv_job.check_request(request)
+        if resource is not None and (resource.type == Resource.URL_UPLOAD) != (body is not None):
+            # uploads require POST and POST is only accepted by uploads
+            serv_job.accepting.set()
+            LOG.debug("405 %r (%d to go)", request, serv_job.pending)
+            return Response(
+                cls._4xx_page(405, "Method Not Allowed", serv_job.auto_close, keep_alive=keep_alive),
+                keep_alive=keep_alive)
+        finish_job = False
+        if resource is None:
+            LOG.debug("resource is None")  # 404
+        elif resource.type in (Resource.URL_DATA, Resource.URL_FILE, Resource.URL_INCLUDE):
+            finish_job = serv_job.remove_pending(resource.target)
+        elif resource.type in (Resource.URL_DYNAMIC, Resource.URL_REDIRECT, Resource.URL_UPLOAD):
+            finish_job = serv_job.remove_pending(request)
+        else:  # pragma: no cover
+            # this should never happen
+            raise WorkerError("Unknown resource type %r" % (resource.type,))
+
+        if finish_job and serv_job.forever:
+            LOG.debug("serv_job.forever is set, resetting finish_job")
+            finish_job = False
+
+        if not finish_job:
+            serv_job.accepting.set()
+        else:
+            LOG.debug("expecting to finish")
+            # the connection will be closed once the job is complete
+            keep_alive = False
+
+        if resource is None:
+            LOG.debug("404 %r (%d to go)", request, serv_job.pending)
+            return Response(
+                cls._4xx_page(404, "Not Found", serv_job.auto_close, keep_alive=keep_alive),
+                finish=finish_job,
+                keep_alive=keep_alive)
+        if resource.type in (Resource.URL_FILE, Resource.URL_INCLUDE):
+            LOG.debug("target %r", resource.target)
+            # isfile() check for Resource.URL_FILE happens in serv_job.check_request()
+            if resource.type == Resource.URL_INCLUDE and not isfile(resource.target):
+                LOG.debug("404 %r (%d to go)", request, serv_job.pending)
+                return Response(
+                    cls._4xx_page(404, "Not Found", serv_job.auto_close, keep_alive=keep_alive),
+                    finish=finish_job,
+                    keep_alive=keep_alive)
+            if serv_job.is_forbidden(resource.target):
+                # NOTE: this does info leak if files exist on disk.
+                # We could replace 403 with 404 if it turns out we care but this
+                # is meant to run locally and only be accessible from localhost
+                LOG.debug("403 %r (%d to go)", request, serv_job.pending)
+                return Response(
+                    cls._4xx_page(403, "Forbidden", serv_job.auto_close, keep_alive=keep_alive),
+                    finish=finish_job,
+                    keep_alive=keep_alive)
+        elif resource.type == Resource.URL_REDIRECT:
+            LOG.debug("307 %r -> %r (%d to go)", request, resource.target, serv_job.pending)
+            return Response(
+                cls._307_redirect(resource.target, keep_alive=keep_alive),
+                finish=finish_job,
+                keep_alive=keep_alive)
+        elif resource.type == Resource.URL_DYNAMIC:
+            data = resource.target()
+            if not isinstance(data, bytes):
+                if isinstance(data, str) or not (
+                        hasattr(data, "__iter__") or callable(getattr(data, "read", None))):
+                    LOG.debug("dynamic request: %r", request)
+                    raise TypeError(
+                        "dynamic request callback must return 'bytes', "
+                        "an iterable or a file-like object")
+                LOG.debug("200 %r - chunked dynamic request (%d to go)", request, serv_job.pending)
+                return Response(
+                    cls._200_header(None, resource.mime, keep_alive=keep_alive),
+                    chunks=cls._chunked(data),
+                    finish=finish_job,
+                    keep_alive=keep_alive)
+            LOG.debug("200 %r - dynamic request (%d to go)", request, serv_job.pending)
+            return Response(
+                cls._200_header(len(data), resource.mime, keep_alive=keep_alive),
+                body=data,
+                finish=finish_job,
+                keep_alive=keep_alive)
+        elif resource.type == Resource.URL_UPLOAD:
+            if callable(resource.target):
+                data = resource.target(body)
+                if data is None:
+                    data = b""
+                elif not isinstance(data, bytes):
+                    LOG.debug("upload request: %r", request)
+                    raise TypeError("upload callback must return 'bytes' or None")
+            else:
+                # write the body to the file sink as it is received
+                with open(resource.target, "wb") as out_fp:
+                    for chunk in iter(partial(body.read, cls.DEFAULT_TX_SIZE), b""):
+                        out_fp.write(chunk)
+                data = b""
+            LOG.debug("200 %r - upload request (%d to go)", request, serv_job.pending)
+            return Response(
+                cls._200_header(len(data), resource.mime, keep_alive=keep_alive),
+                body=data,
+                finish=finish_job,
+                keep_alive=keep_alive)
+        elif resource.type == Resource.URL_DATA:
+            # content is supplied by the provider (not from wwwroot)
+            data_fp, size = serv_job.provider.open(resource.target)
+            LOG.debug("200 %r - provided data (%d to go)", request, serv_job.pending)
+            return Response(
+                cls._200_header(size, resource.mime, keep_alive=keep_alive),
+                finish=finish_job,
+                fp=data_fp,
+                keep_alive=keep_alive,
+                served=resource.target,
+                size=size)
+
+        # at this point we know "resource.target" maps to a file on disk
+        f_stat = stat(resource.target)
+        etag = None
+        if resource.type == Resource.URL_INCLUDE and resource.max_age is not None:
+            # file is cacheable
+            etag = _content_etag(
+                resource.target, f_stat.st_size, f_stat.st_mtime_ns, f_stat.st_ino)
+            if cls._etag_match(raw_request, etag):
+                LOG.debug("304 %r (%d to go)", resource.target, serv_job.pending)
+                return Response(
+                    cls._304_not_modified(etag, resource.max_age, keep_alive=keep_alive),
+                    finish=finish_job,
+                    keep_alive=keep_alive,
+                    served=resource.target)
+        LOG.debug("sending: %s bytes, mime: %r", format(f_stat.st_size, ","), resource.mime)
+        LOG.debug("200 %r (%d to go)", resource.target, serv_job.pending)
+        return Response(
+            cls._200_header(
+                f_stat.st_size,
+                resource.mime,
+                keep_alive=keep_alive,
+                etag=etag,
+                max_age=resource.max_age),
+            finish=finish_job,
+            keep_alive=keep_alive,
+            path=resource.target,
+            served=resource.target)
+
+    @classmethod
+    def header_end(cls, data, start=0):
+        """Find the end of the request header in received data. Requests that
+        are invalid or too large are detected without waiting for the end of
+        the header.
+
+        Args:
+            data (bytes): Data received from the client.
+            start (int): Offset to begin searching for the end of the header.
+
+        Returns:
+            int: Offset following the header or None if more data is required.
+                 All the data is used if the request is invalid or too large.
+        """
+        end = data.find(cls.REQ_TERMINATOR, start)
+        if end >= 0:
+            return end + len(cls.REQ_TERMINATOR)
+        if len(data) > cls.MAX_HEADER_SIZE:
+            return len(data)
+        line_end = data.find(b"\r\n")
+        if line_end < 0:
+            # check the start of a partial request line
+            if not any(x.startswith(data[:len(x)]) for x in cls.REQ_PREFIXES):
+                return len(data)
+        elif cls.REQ_PATTERN.match(data, 0, line_end) is None:
+            return len(data)
+        return None
+
     def join(self, timeout=None):
         if self._thread is not None:
             self._thread.join(timeout=timeout)
@@ -196,14 +617,15 @@ class Worker:
                 self._thread = None
 
     @classmethod
-    def launch(cls, listen_sock, job):
+    def launch(cls, listen_sock, job, release=None):
         assert job.accepting.is_set()
         conn = None
         try:
             conn, _ = listen_sock.accept()
             conn.settimeout(None)
+            cls.set_nodelay(conn)
             # create a worker thread to handle client request
-            w_thread = Thread(target=cls.handle_request, args=(conn, job))
+            w_thread = Thread(target=cls.handle_request, args=(conn, job, time(), release))
             job.accepting.clear()
             w_thread.start()
             return cls(conn, w_thread)
@@ -219,3 +641,257 @@ class Worker:
             # wait for system resources to free up
             sleep(0.1)
         return None
+
+    @classmethod
+    def prepare_response(cls, raw_request, serv_job, body=None):
+        """Process a request and update the job. The response is not sent to
+        the client, this is left to the caller.
+
+        Args:
+            raw_request (bytes): Request received from the client.
+            serv_job (Job): Job that is being served.
+            body (file-like object): Body of the request (see body_length()).
+                                     Only used by POST requests.
+
+        Returns:
+            Response: Response to send to the client.
+        """
+        if len(raw_request) > cls.MAX_HEADER_SIZE:
+            serv_job.accepting.set()
+            LOG.debug("431 request length %d (%d to go)", len(raw_request), serv_job.pending)
+            return Response(
+                cls._4xx_page(431, "Request Header Fields Too Large", serv_job.auto_close))
+        request = cls.REQ_PATTERN.match(raw_request)
+        if request is None:
+            serv_job.accepting.set()
+            LOG.debug("400 request length %d (%d to go)", len(raw_request), serv_job.pending)
+            return Response(cls._4xx_page(400, "Bad Request", serv_job.auto_close))
+        if request.group("method") != b"POST":
+            body = None
+        elif body is None:
+            # the end of the body cannot be found without a Content-Length
+            serv_job.accepting.set()
+            LOG.debug("411 POST without Content-Length (%d to go)", serv_job.pending)
+            return Response(cls._4xx_page(411, "Length Required", serv_job.auto_close))
+        keep_alive = cls.KEEP_ALIVE_PATTERN.search(raw_request) is not None
+
+        request = unquote_plus(request.group("request").decode("ascii"))
+        job, request = serv_job.route(request)
+        if job is None:
+            serv_job.accepting.set()
+            LOG.debug("404 %r (no matching job)", request)
+            return Response(
+                cls._4xx_page(404, "Not Found", serv_job.auto_close, keep_alive=keep_alive),
+                keep_alive=keep_alive)
+        if job is serv_job:
+            response = cls._job_response(request, raw_request, job, keep_alive, body=body)
+        else:
+            # requests for multiplexed jobs do not block the listener
+            serv_job.accepting.set()
+            try:
+                response = cls._job_response(request, raw_request, job, keep_alive, body=body)
+            except Exception:  # pylint: disable=broad-except
+                # report the failure to the job that handled the request
+                # instead of aborting all multiplexed jobs
+                if job.exceptions.empty():
+                    job.exceptions.put(exc_info())
+                job.finish()
+                response = Response(cls._4xx_page(500, "Internal Server Error"))
+        response.job = job
+        return response
+
+    @staticmethod
+    def set_nodelay(conn):
+        # responses are sent using multiple writes (header then body) so Nagle's
+        # algorithm must be disabled to avoid waiting on delayed ACKs
+        try:
+            conn.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+        except sock_error:  # pragma: no cover
+            LOG.debug("failed to set TCP_NODELAY")
+
+
+class WorkerPool:
+    """WorkerPool manages long-lived worker threads that handle connections
+    taken from a queue. A pool is intended to be used by a single Job at a time
+    and can be reused by subsequent Jobs.
+    Idle persistent connections are closed when connections are waiting for
+    a worker so they cannot hold every worker for KEEP_ALIVE_TIMEOUT.
+
+    Attributes:
+        handled (int): Number of connections that have been handled.
+        saturated (int): Number of connections submitted while no idle worker
+                         was available.
+    """
+
+    __slots__ = ("_active", "_conns", "_idle", "_queue", "_size", "_threads", "handled", "saturated")
+
+    def __init__(self, size, queue_size=0):
+        assert size > 0
+        assert queue_size >= 0
+        self._active = 0  # number of workers handling a connection
+        self._conns = set()  # connections that are being handled
+        self._idle = Condition(Lock())
+        self._queue = Queue(maxsize=queue_size)
+        self._size = size
+        self._threads = list()
+        self.handled = 0
+        self.saturated = 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _run(self):
+        while True:
+            entry = self._queue.get()
+            if entry is None:
+                break
+            conn, job, accepted = entry
+            with self._idle:
+                self._conns.add(conn)
+            try:
+                if job.is_complete():
+                    # job finished before the connection was handled
+                    conn.close()
+                else:
+                    Worker.handle_request(
+                        conn, job, accepted=accepted, release=self._waiting)
+            finally:
+                with self._idle:
+                    self._conns.discard(conn)
+                    self._active -= 1
+                    self.handled += 1
+                    if self._active < 1:
+                        self._idle.notify_all()
+
+    def _waiting(self):
+        # connections are waiting for an idle worker
+        return not self._queue.empty()
+
+    @property
+    def active(self):
+        """Number of connections that have been submitted and not handled.
+
+        Args:
+            None
+
+        Returns:
+            int: Active connections.
+        """
+        with self._idle:
+            return self._active
+
+    def close(self):
+        """Stop all worker threads. Connections that are being handled are
+        allowed to complete.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout=60)
+            if thread.is_alive():
+                # this is here to catch unexpected hangs
+                raise WorkerError("Worker thread failed to join!")
+        self._threads.clear()
+
+    def close_connections(self):
+        """Close all connections that are currently being handled. This will
+        cause an error in the worker and the connection to be abandoned.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        with self._idle:
+            conns = tuple(self._conns)
+        for conn in conns:
+            LOG.debug("closing socket while worker is running!")
+            conn.close()
+
+    @property
+    def queued(self):
+        """Number of connections waiting for an idle worker.
+
+        Args:
+            None
+
+        Returns:
+            int: Queued connections.
+        """
+        return self._queue.qsize()
+
+    @property
+    def size(self):
+        """Number of running worker threads.
+
+        Args:
+            None
+
+        Returns:
+            int: Worker threads.
+        """
+        return len(self._threads)
+
+    def start(self):
+        """Launch worker threads. Threads that have already been launched are
+        reused.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        while len(self._threads) < self._size:
+            thread = Thread(target=self._run, daemon=True)
+            try:
+                thread.start()
+            except ThreadError:
+                # thread errors can be due to low system resources while fuzzing
+                LOG.warning("ThreadError (pool), threads: %d", active_count())
+                if not self._threads:
+                    raise
+                # continue with the threads that are available
+                break
+            self._threads.append(thread)
+
+    def submit(self, conn, job):
+        """Queue a connection to be handled by a worker. This blocks while the
+        queue is full.
+
+        Args:
+            conn (socket.socket): Connection to handle.
+            job (Job): Job the connection belongs to.
+
+        Returns:
+            None
+        """
+        assert self._threads, "start() must be called first"
+        with self._idle:
+            if self._active >= len(self._threads):
+                self.saturated += 1
+            self._active += 1
+        self._queue.put((conn, job, time()))
+
+    def wait(self, timeout=None):
+        """Wait for all submitted connections to be handled.
+
+        Args:
+            timeout (float): Maximum number of seconds to wait.
+
+        Returns:
+            bool: True if all connections have been handled otherwise False.
+        """
+        with self._idle:
+            return self._idle.wait_for(lambda: self._active < 1, timeout=timeout)